@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from .models import User, Partner, Institution, Student
+from .search import identifier_filter, search_students
 
 class CustomUserAdmin(UserAdmin):
     fieldsets = UserAdmin.fieldsets + (
@@ -14,7 +15,16 @@ class CustomUserAdmin(UserAdmin):
 class StudentAdmin(admin.ModelAdmin):
     list_display = ('unique_id', 'student_name', 'institution', 'partner', 'class_name')
     list_filter = ('class_name', 'institution', 'partner')
-    search_fields = ('student_name', 'father_name', 'unique_id')
+    search_fields = ('student_name', 'father_name', 'village', 'mobile_number', 'unique_id')
+
+    def get_search_results(self, request, queryset, search_term):
+        # The full-text index answers word-prefix searches; only a lone term with a digit in it also
+        # scans IDs and mobile numbers for LIKE '%term%', as the admin's own search did
+        results = search_students(queryset, search_term)
+        identifiers = identifier_filter(search_term)
+        if identifiers is not None:
+            results = results | queryset.filter(identifiers)
+        return results, False
 
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(Partner)
@@ -0,0 +1,91 @@
+import datetime
+
+from django.db.models import F
+
+from .models import Student
+from .pagination import KeysetPaginator
+from .thumbnails import derivative_url
+
+API_ORDERING = ('class_name', 'id')
+
+# Public field name -> values() expression; anything not listed here cannot be requested
+API_FIELDS = {
+    'id': F('id'),
+    'unique_id': F('unique_id'),
+    'student_name': F('student_name'),
+    'father_name': F('father_name'),
+    'class_name': F('class_name'),
+    'other_class': F('other_class'),
+    'village': F('village'),
+    'mobile_number': F('mobile_number'),
+    'photo': F('photo'),
+    'thumbnail': F('photo'),
+    'institution_id': F('institution_id'),
+    'institution_name': F('institution__user__username'),
+    'partner_id': F('partner_id'),
+    'updated_at': F('updated_at'),
+}
+DEFAULT_API_FIELDS = ('id', 'unique_id', 'student_name', 'father_name', 'class_name', 'other_class', 'village', 'mobile_number')
+PHOTO_FIELDS = ('photo', 'thumbnail')
+
+
+class InvalidFields(Exception):
+    pass
+
+
+def parse_fields(value):
+    if not value:
+        return list(DEFAULT_API_FIELDS)
+    fields = list(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in API_FIELDS]
+    if unknown or not fields:
+        raise InvalidFields(unknown)
+    return fields
+
+
+def api_owner(user, role):
+    """Return ``(owner_key, students)`` for a user of ``role``, scoped like that role's dashboard."""
+    if user.role != role:
+        return None
+    if role == 'INSTITUTION':
+        return f'institution-{user.institution.pk}', Student.objects.filter(institution=user.institution)
+    return f'partner-{user.partner.pk}', Student.objects.filter(partner=user.partner)
+
+
+def owner_etag(owner_key, version):
+    return f'"{owner_key}-{version}"'
+
+
+def owner_last_modified(version):
+    # Version 0 predates any recorded change, so there is no honest modification time
+    if not version:
+        return None
+    return datetime.datetime.fromtimestamp(version / 1000, tz=datetime.timezone.utc)
+
+
+def student_values(students, fields, ordering=API_ORDERING):
+    """Select only ``fields`` plus the ``ordering`` columns, as ``values()`` dicts."""
+    columns = {f'api_{field}': API_FIELDS[field] for field in fields if field not in ordering}
+    return students.values(*ordering, **columns)
+
+
+def serialize_rows(rows, fields, ordering=API_ORDERING):
+    storage = Student._meta.get_field('photo').storage
+    items = []
+    for row in rows:
+        item = {}
+        for field in fields:
+            value = row[field] if field in ordering else row[f'api_{field}']
+            if field in PHOTO_FIELDS:
+                value = (storage.url(value) if field == 'photo' else derivative_url(value, 'thumb', storage)) if value else None
+            item[field] = value
+        items.append(item)
+    return items
+
+
+def student_page(students, fields, cursor=None, per_page=100):
+    """Return a keyset page of plain dicts holding only ``fields``, read with ``values()``."""
+    rows = student_values(students, fields)
+    page = KeysetPaginator(rows, ordering=API_ORDERING, per_page=per_page).page(cursor)
+    page.items = serialize_rows(page, fields)
+    return page
@@ -0,0 +1,294 @@
+"""Native async versions of the views that spend most of their time waiting.
+
+``id_card_project.asgi_urls`` routes them in place of their ``core.views``
+twins; ``id_card_project.settings_asgi``, which ``asgi.py`` uses, selects that
+URLconf. Queries go through the async ORM; zip building, enrollment, photo
+verification and storage, file reads, multipart parsing and template rendering
+run on a dedicated executor so they never block the event loop nor borrow the
+thread that serializes sync ORM calls.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, redirect, render
+from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
+
+from .enrollment import EnrollmentConflict, IdempotencyKeyReused, InvalidEnrollment, enroll_students, parse_records, start_photo_decodes
+from .export_cache import SEGMENTED_FORMATS, cached_export
+from .exports import EXPORT_FORMATS, export_owner_key, export_queryset, stream_archive
+from .forms import StudentForm
+from .fragments import aowner_version
+from .http import api_post, authorization_token, ranged_file_response
+from .models import EnrollmentReceipt, Institution, Partner, Student, User
+from .pagination import KeysetPaginator, acached_count
+from .routers import uses_read_only_database
+from .search import search_students
+from .views import DASHBOARD_FIELDS, dashboard_page, search_key, token_required, unknown_referral
+
+STREAM_QUEUE_SIZE = 4
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_blocking_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'ASYNC_BLOCKING_WORKERS', 8),
+    thread_name_prefix='async-blocking',
+)
+
+
+def _call_with_connection_cleanup(func, *args, **kwargs):
+    # Executor threads keep their connections between calls; drop the ones past CONN_MAX_AGE
+    # or unusable before and after, as Django does around each request on its threads
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def run_blocking(func, *args, **kwargs):
+    """Run ``func`` on the blocking executor, with the caller's context (read-only routing, metrics)."""
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, _call_with_connection_cleanup, func, *args, **kwargs)
+    return asyncio.get_running_loop().run_in_executor(_blocking_executor, call)
+
+
+async def iterate_blocking(make_iterator, min_chunk_size=0):
+    """Drive a blocking iterator on one executor thread and yield its items without blocking the loop.
+
+    The whole iterator runs in a single thread, so a database cursor it holds
+    stays with the connection that opened it. With ``min_chunk_size``, byte
+    chunks are joined until they reach that size, so small writes do not each
+    cost a hop to the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(STREAM_QUEUE_SIZE)
+    stopped = False
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        try:
+            pending, size = [], 0
+            for chunk in make_iterator():
+                if stopped:
+                    return
+                if not min_chunk_size:
+                    put((True, chunk))
+                    continue
+                pending.append(chunk)
+                size += len(chunk)
+                if size >= min_chunk_size:
+                    put((True, b''.join(pending)))
+                    pending, size = [], 0
+            if pending:
+                put((True, b''.join(pending)))
+            put((False, None))
+        except Exception as exc:
+            put((False, exc))
+
+    producer = run_blocking(produce)
+    try:
+        while True:
+            more, item = await queue.get()
+            if not more:
+                if item is not None:
+                    raise item
+                break
+            yield item
+    finally:
+        stopped = True
+        # A producer blocked on a full queue must be let through before it notices the stop
+        while not producer.done():
+            while not queue.empty():
+                queue.get_nowait()
+            await asyncio.sleep(0.01)
+
+
+async def request_owner(request):
+    """Load the user with their institution or partner, so nothing queries lazily from the event loop."""
+    user = await request.auser()
+    if user.is_authenticated:
+        user = await User.objects.select_related('institution', 'partner').aget(pk=user.pk)
+    request.user = user
+    return user
+
+
+async def _dashboard_page(request, students, owner_key):
+    # Read before anything is queried: the table fragment is cached under this version
+    version = await aowner_version(owner_key)
+    search = request.GET.get('q', '').strip()
+    students = search_students(students, search, owner_scoped=True)
+    paginator = KeysetPaginator(students, ordering=('class_name', 'id'), per_page=settings.DASHBOARD_PAGE_SIZE)
+    # Queried by render_dashboard only if the table fragment misses the cache
+    page = SimpleLazyObject(lambda: dashboard_page(paginator, request.GET.get('cursor')))
+    total = await acached_count(
+        f'students:{owner_key}:{version}:{search_key(search)}', students, settings.DASHBOARD_COUNT_CACHE_TIMEOUT
+    )
+    return {
+        'students': page, 'page': page, 'total_students': total,
+        'owner_key': owner_key, 'data_version': version, 'search': search,
+    }
+
+
+async def render_dashboard(request, template_name, context):
+    # Rendering may run the lazy page query, so it happens off the event loop, on the blocking
+    # executor: the shared thread-sensitive thread would queue concurrent renders one behind another
+    return await run_blocking(render, request, template_name, context)
+
+@login_required
+@uses_read_only_database
+async def institution_dashboard(request):
+    user = await request_owner(request)
+    if user.role != 'INSTITUTION':
+        return redirect('login')
+
+    institution = user.institution
+    students = Student.objects.filter(institution=institution).only(*DASHBOARD_FIELDS)
+    context = await _dashboard_page(request, students, f'institution-{institution.pk}')
+    return await render_dashboard(request, 'institution_dashboard.html', context)
+
+@login_required
+@uses_read_only_database
+async def partner_dashboard(request):
+    user = await request_owner(request)
+    if user.role != 'PARTNER':
+        return redirect('login')
+
+    partner = user.partner
+    students = (
+        Student.objects.filter(partner=partner)
+        .select_related('institution__user')
+        .only(*DASHBOARD_FIELDS, 'institution__user__username')
+    )
+    referral_path = reverse('referral_student_add', kwargs={'referral_code': partner.referral_code})
+
+    context = await _dashboard_page(request, students, f'partner-{partner.pk}')
+    context['referral_link'] = request.build_absolute_uri(referral_path)
+    return await render_dashboard(request, 'partner_dashboard.html', context)
+
+
+def _cached_archive(owner_key, export_format):
+    path = cached_export(owner_key, export_format)
+    stat = os.stat(path)
+    return path, f'{stat.st_mtime_ns}-{stat.st_size}'
+
+@login_required
+@uses_read_only_database
+async def export_data(request):
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'csv'
+
+    user = await request_owner(request)
+    students = export_queryset(user)
+    if students is None:
+        return HttpResponse("Unauthorized", status=401)
+    students = students.using(students.db)
+
+    if settings.EXPORT_CACHE_ENABLED and export_format in SEGMENTED_FORMATS:
+        path, etag = await run_blocking(_cached_archive, export_owner_key(user), export_format)
+        return ranged_file_response(request, path, 'application/zip', filename='student_data.zip', etag=etag)
+
+    archive = iterate_blocking(lambda: stream_archive(students, export_format), STREAM_CHUNK_SIZE)
+    response = StreamingHttpResponse(archive, content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="student_data.zip"'
+    return response
+
+
+def _save_student_form(form, **fields):
+    """Validate ``form`` and save its student with ``fields`` set; ``False`` when it is invalid."""
+    if not form.is_valid():
+        return False
+    student = form.save(commit=False)
+    for name, value in fields.items():
+        setattr(student, name, value)
+    student.save()
+    return True
+
+
+async def referral_student_add(request, referral_code):
+    partner = await aget_object_or_404(Partner, referral_code=referral_code)
+    # ?institution=<id> binds the link to one institution, so the form has nothing to look up
+    institution = None
+    institution_id = request.GET.get('institution')
+    if institution_id:
+        if not institution_id.isdigit():
+            raise Http404
+        institution = await aget_object_or_404(Institution.objects.select_related('user'), pk=institution_id)
+
+    if request.method == 'POST':
+        # Parsing the upload, verifying and re-encoding the photo and writing its files all block
+        post, files = await run_blocking(lambda: (request.POST, request.FILES))
+        form = StudentForm(post, files, institution=institution)
+        if await run_blocking(_save_student_form, form, partner=partner):
+            return redirect('login')
+    else:
+        form = StudentForm(institution=institution)
+    context = {'form': form, 'partner': partner, 'institution': institution}
+    return await run_blocking(render, request, 'student_form.html', context)
+
+@login_required
+async def student_add_by_institution(request):
+    user = await request_owner(request)
+    if user.role != 'INSTITUTION':
+        return redirect('login')
+
+    if request.method == 'POST':
+        post, files = await run_blocking(lambda: (request.POST, request.FILES))
+        form = StudentForm(post, files, institution=user.institution)
+        if await run_blocking(_save_student_form, form):
+            return redirect('institution_dashboard')
+    else:
+        form = StudentForm(institution=user.institution)
+    return await run_blocking(render, request, 'student_form.html', {'form': form})
+
+
+async def _api_enroll(request, scope, institution=None, partner=None):
+    # Multipart parsing spools large photo parts to disk
+    post, files = await run_blocking(lambda: (request.POST, request.FILES))
+    try:
+        records = parse_records(post.get('records'))
+    except InvalidEnrollment as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+
+    # Decode only new records' photos, and wait for them without holding a thread
+    keys = [record['key'] for record in records]
+    seen = {key async for key in EnrollmentReceipt.objects.filter(scope=scope, key__in=keys).values_list('key', flat=True)}
+    photos = start_photo_decodes([record for record in records if record['key'] not in seen], files)
+    if photos:
+        await asyncio.gather(*[asyncio.wrap_future(future) for future in photos.values()], return_exceptions=True)
+
+    try:
+        # Forms, the transaction and thumbnails stay sync, on the blocking executor rather than
+        # the one thread that every sync_to_async ORM call of the process shares
+        result = await run_blocking(
+            enroll_students, records, files, scope, institution=institution, partner=partner, photos=photos,
+        )
+    except EnrollmentConflict:
+        return JsonResponse({'error': 'These records are already being enrolled; retry shortly.'}, status=409)
+    except IdempotencyKeyReused as exc:
+        return JsonResponse({'error': 'These keys were already used for different records.', 'keys': exc.keys}, status=422)
+    return JsonResponse(result.as_dict())
+
+@api_post
+async def api_institution_enroll(request):
+    token = authorization_token(request)
+    institution = await Institution.objects.filter(api_token=token, user__is_active=True).afirst() if token else None
+    if institution is None:
+        return token_required()
+    return await _api_enroll(request, f'institution-{institution.pk}', institution=institution)
+
+@api_post
+async def api_referral_enroll(request, referral_code):
+    partner = await Partner.objects.filter(referral_code=referral_code).afirst()
+    if partner is None:
+        return unknown_referral()
+    return await _api_enroll(request, f'partner-{partner.pk}', partner=partner)
@@ -0,0 +1,200 @@
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.db.models import Q
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from .storage import is_hashed_name
+
+# CR80 card and A4 sheet at 300 dpi
+CARD_DPI = 300
+CARD_SIZE = (1011, 638)
+SHEET_SIZE = (2480, 3508)
+SHEET_GRID = (2, 5)
+SHEET_GUTTER = 40
+# A4 pages at 300 dpi are about 26 MB each while being written
+CARD_PDF_PAGES_PER_SAVE = 4
+
+# Bump whenever the layout changes so cached cards are re-rendered
+CARD_LAYOUT_VERSION = 1
+
+HEADER_HEIGHT = 120
+PHOTO_BOX = (40, HEADER_HEIGHT + 30, 40 + 300, HEADER_HEIGHT + 30 + 386)
+HEADER_COLOR = (35, 64, 120)
+
+
+
+class CardsPending(Exception):
+    """More cards missed the cache than one call may render; the rest are left for the next call."""
+
+    def __init__(self, rendered, remaining):
+        super().__init__(f'{rendered} cards rendered, {remaining} still to render')
+        self.rendered = rendered
+        self.remaining = remaining
+
+
+def card_class_filter(class_name):
+    """Match students whose card prints ``class_name``; for an "Other" student that is its ``other_class``."""
+    if class_name == 'Other':
+        return Q(class_name='Other') & (Q(other_class__in=('', 'Other')) | Q(other_class__isnull=True))
+    return Q(class_name=class_name) | Q(class_name='Other', other_class=class_name)
+
+
+def card_queryset(students):
+    return students.select_related('institution__user').order_by('class_name', 'student_name', 'id')
+
+
+def card_data(student):
+    s_class = student.class_name
+    if s_class == 'Other':
+        s_class = student.other_class or 'Other'
+    return {
+        'unique_id': student.unique_id,
+        'student_name': student.student_name,
+        'father_name': student.father_name,
+        'class': s_class,
+        'village': student.village,
+        'mobile_number': student.mobile_number,
+        'institution': student.institution.user.username,
+    }
+
+
+def _photo_path(student):
+    if not student.photo:
+        return None
+    try:
+        return student.photo.path
+    except NotImplementedError:
+        return None
+
+
+def card_cache_key(data, photo_path):
+    photo_version = None
+    if photo_path:
+        # Hashed photo names already change with the content; older flat names need the mtime
+        photo_version = os.path.basename(photo_path)
+        if not is_hashed_name(photo_path) and os.path.exists(photo_path):
+            photo_version = f'{photo_version}:{os.path.getmtime(photo_path)}'
+    payload = json.dumps([CARD_LAYOUT_VERSION, data, photo_version], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def card_cache_path(key):
+    return os.path.join(settings.CARD_CACHE_ROOT, key[:2], f'{key}.png')
+
+
+def draw_card(data, photo_path):
+    card = Image.new('RGB', CARD_SIZE, 'white')
+    draw = ImageDraw.Draw(card)
+    title_font = ImageFont.load_default(size=48)
+    label_font = ImageFont.load_default(size=26)
+    value_font = ImageFont.load_default(size=34)
+
+    draw.rectangle((0, 0, CARD_SIZE[0], HEADER_HEIGHT), fill=HEADER_COLOR)
+    draw.text((40, HEADER_HEIGHT // 2), data['institution'], font=title_font, fill='white', anchor='lm')
+
+    draw.rectangle(PHOTO_BOX, outline=(180, 180, 180), width=2)
+    if photo_path:
+        try:
+            with Image.open(photo_path) as photo:
+                photo = ImageOps.fit(ImageOps.exif_transpose(photo).convert('RGB'), (PHOTO_BOX[2] - PHOTO_BOX[0], PHOTO_BOX[3] - PHOTO_BOX[1]))
+                card.paste(photo, PHOTO_BOX[:2])
+        except OSError:
+            pass
+
+    x = PHOTO_BOX[2] + 40
+    y = HEADER_HEIGHT + 30
+    for label, key in (
+        ('Name', 'student_name'),
+        ("Father's Name", 'father_name'),
+        ('Class', 'class'),
+        ('Village', 'village'),
+        ('Mobile', 'mobile_number'),
+    ):
+        draw.text((x, y), label, font=label_font, fill=(110, 110, 110))
+        draw.text((x, y + 28), str(data[key] or ''), font=value_font, fill='black')
+        y += 78
+
+    draw.rectangle((0, CARD_SIZE[1] - 60, CARD_SIZE[0], CARD_SIZE[1]), fill=HEADER_COLOR)
+    draw.text((CARD_SIZE[0] // 2, CARD_SIZE[1] - 30), data['unique_id'], font=value_font, fill='white', anchor='mm')
+    return card
+
+
+def _render_to_cache(path, data, photo_path):
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A partial file of its own: other threads and processes may be rendering the same card
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            draw_card(data, photo_path).save(f, format='PNG', dpi=(CARD_DPI, CARD_DPI))
+        os.replace(partial, path)
+    except BaseException:
+        os.unlink(partial)
+        raise
+    return path
+
+
+def render_cards(students, executor=None, limit=None):
+    """Return ``(paths, rendered)``: every student's cached card PNG, in order, and
+    how many of them had to be rendered.
+
+    The card cache is keyed by a hash of the printed fields and the photo, so
+    unchanged students are never rendered twice. Misses are rendered in this
+    process, or spread over ``executor`` (the ``render_id_cards`` command
+    passes a process pool). With ``limit``, at most that many are rendered and
+    ``CardsPending`` is raised when more remain.
+    """
+    jobs = []
+    for student in students:
+        data = card_data(student)
+        photo_path = _photo_path(student)
+        jobs.append((card_cache_path(card_cache_key(data, photo_path)), data, photo_path))
+
+    misses = {path: (path, data, photo_path) for path, data, photo_path in jobs if not os.path.exists(path)}
+    batch = list(misses.values())[:limit]
+    if executor is None or len(batch) == 1:
+        for job in batch:
+            _render_to_cache(*job)
+    elif batch:
+        list(executor.map(_render_to_cache, *zip(*batch)))
+    if len(batch) < len(misses):
+        raise CardsPending(len(batch), len(misses) - len(batch))
+    return [path for path, _, _ in jobs], len(misses)
+
+
+def _sheets(card_paths):
+    columns, rows = SHEET_GRID
+    per_sheet = columns * rows
+    margin_x = (SHEET_SIZE[0] - columns * CARD_SIZE[0] - (columns - 1) * SHEET_GUTTER) // 2
+    margin_y = (SHEET_SIZE[1] - rows * CARD_SIZE[1] - (rows - 1) * SHEET_GUTTER) // 2
+
+    for start in range(0, max(len(card_paths), 1), per_sheet):
+        sheet = Image.new('RGB', SHEET_SIZE, 'white')
+        for i, path in enumerate(card_paths[start:start + per_sheet]):
+            column, row = i % columns, i // columns
+            with Image.open(path) as card:
+                sheet.paste(card, (
+                    margin_x + column * (CARD_SIZE[0] + SHEET_GUTTER),
+                    margin_y + row * (CARD_SIZE[1] + SHEET_GUTTER),
+                ))
+        yield sheet
+
+
+def write_sheets(card_paths, output):
+    """Lay the cards out on A4 pages and write them to ``output`` (a path or a binary file) as one PDF.
+
+    ``save_all`` holds every page it is given in memory, and each
+    ``append=True`` re-reads the document written so far, so the pages are
+    saved ``CARD_PDF_PAGES_PER_SAVE`` at a time.
+    """
+    sheets = _sheets(card_paths)
+    append = False
+    while batch := list(itertools.islice(sheets, CARD_PDF_PAGES_PER_SAVE)):
+        batch[0].save(output, format='PDF', save_all=True, append_images=batch[1:], append=append, resolution=CARD_DPI)
+        append = True
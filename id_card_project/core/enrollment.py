@@ -0,0 +1,186 @@
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+
+from .export_cache import mark_students_stale
+from .forms import StudentForm
+from .fragments import bump_student_versions
+from .ids import allocate_student_ids
+from .models import EnrollmentReceipt, Student
+from .photos import PhotoRejected, pending_photos, release_photo, restore_photos, submit_photo
+from .thumbnails import generate_derivatives
+
+ENROLLMENT_MAX_RECORDS = getattr(settings, 'ENROLLMENT_MAX_RECORDS', 100)
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
+
+class InvalidEnrollment(ValueError):
+    pass
+
+
+class EnrollmentConflict(Exception):
+    pass
+
+
+class IdempotencyKeyReused(Exception):
+    """Records were sent under keys that already enrolled different data; ``keys`` lists them."""
+
+    def __init__(self, keys):
+        super().__init__(keys)
+        self.keys = keys
+
+
+class EnrollmentResult:
+    def __init__(self):
+        self.records = []
+        self.created = 0
+
+    def add(self, key, status, unique_id=None, errors=None):
+        self.records.append({'key': key, 'status': status, 'unique_id': unique_id, 'errors': errors or {}})
+
+    def as_dict(self):
+        return {'created': self.created, 'results': self.records}
+
+
+def parse_records(raw):
+    """Decode the ``records`` part: a JSON list of objects, each with an idempotency ``key``."""
+    try:
+        records = json.loads(raw or '')
+    except ValueError:
+        raise InvalidEnrollment("records must be a JSON list.")
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise InvalidEnrollment("records must be a JSON list of objects.")
+    if not records or len(records) > ENROLLMENT_MAX_RECORDS:
+        raise InvalidEnrollment(f"Send between 1 and {ENROLLMENT_MAX_RECORDS} records.")
+    for record in records:
+        key = record.get('key')
+        if not isinstance(key, str) or not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise InvalidEnrollment(f"Every record needs a key of at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters.")
+    if len({record['key'] for record in records}) != len(records):
+        raise InvalidEnrollment("Record keys must be unique within a batch.")
+    return records
+
+
+def _form_data(record):
+    data = {field: record.get(field) for field in StudentForm.Meta.fields if field != 'photo'}
+    return {field: '' if value is None else value for field, value in data.items()}
+
+
+def record_digest(record):
+    """Hash the student fields of ``record``; the key and the photo part name are left out."""
+    payload = json.dumps(_form_data(record), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def start_photo_decodes(records, files):
+    """Submit each record's photo part to the shared encode pool, returning futures by key."""
+    photos = {}
+    for record in records:
+        upload = files.get(record.get('photo') or '')
+        if upload is not None:
+            photos[record['key']] = submit_photo(upload)
+    return photos
+
+
+def enroll_students(records, files, scope, institution=None, partner=None, photos=None):
+    """Validate ``records`` with ``StudentForm`` and insert the valid ones in one transaction.
+
+    ``scope`` namespaces the idempotency keys: a record whose key already has
+    a receipt is answered with the student created the first time, and
+    ``IdempotencyKeyReused`` is raised, before anything is stored, if its
+    fields differ from that first time. Photos are named by each record's
+    ``photo`` and normalized concurrently on the shared encode pool while
+    the forms validate, unless ``photos`` already holds their futures from
+    ``start_photo_decodes()``.
+    """
+    result = EnrollmentResult()
+    receipts = {}
+    reused = []
+    digests = {record['key']: record_digest(record) for record in records}
+    for key, unique_id, digest in EnrollmentReceipt.objects.filter(scope=scope, key__in=digests).values_list(
+        'key', 'unique_id', 'payload_digest',
+    ):
+        # Receipts from before digests were stored match any retry
+        if digest and digest != digests[key]:
+            reused.append(key)
+        receipts[key] = unique_id
+    if reused:
+        raise IdempotencyKeyReused(sorted(reused))
+    pending = [record for record in records if record['key'] not in receipts]
+
+    if photos is None:
+        # Start every decode up front; the pool works through them while earlier forms validate
+        photos = start_photo_decodes(pending, files)
+
+    valid = []
+    outcomes = {}
+    for record in pending:
+        key = record['key']
+        errors = {}
+        photo_files = {}
+        if key in photos:
+            try:
+                photo_files['photo'] = ContentFile(photos[key].result(), name=f'{uuid.uuid4().hex}.jpg')
+            except PhotoRejected as exc:
+                errors['photo'] = [str(exc)]
+        elif record.get('photo'):
+            errors['photo'] = [f"No file part named {record['photo']!r}."]
+
+        form = StudentForm(_form_data(record), photo_files, institution=institution)
+        if not form.is_valid() or errors:
+            errors.update({field: list(messages) for field, messages in form.errors.items()})
+            outcomes[key] = ('invalid', None, errors)
+            continue
+        student = form.save(commit=False)
+        student.partner = partner
+        valid.append((key, student))
+
+    if valid:
+        students = [student for _, student in valid]
+        try:
+            with transaction.atomic():
+                mark_students_stale({(s.class_name, s.other_class, s.partner_id) for s in students})
+                for student, unique_id in zip(students, allocate_student_ids(len(students))):
+                    student.unique_id = unique_id
+                # bulk_create commits each new photo file through FileField.pre_save
+                unstored = pending_photos(students)
+                Student.objects.bulk_create(students)
+                restore_photos(unstored)
+                stored_photos = {student.photo.name for student in students if student.photo}
+                EnrollmentReceipt.objects.bulk_create([
+                    EnrollmentReceipt(
+                        scope=scope, key=key, student=student, unique_id=student.unique_id, payload_digest=digests[key],
+                    )
+                    for key, student in valid
+                ])
+                bump_student_versions({(student.institution_id, student.partner_id) for student in students})
+        except IntegrityError as exc:
+            # Another request stored a retry of the same records first; its rows won
+            for name in {student.photo.name for student in students if student.photo}:
+                release_photo(name)
+            raise EnrollmentConflict(scope) from exc
+        result.created = len(students)
+        for key, student in valid:
+            outcomes[key] = ('created', student.unique_id, None)
+
+        storage = Student._meta.get_field('photo').storage
+
+        def write_derivatives():
+            for name in stored_photos:
+                generate_derivatives(name, storage)
+
+        # Only once the rows are committed: photos of rows rolled back with a caller's transaction may be gone
+        transaction.on_commit(write_derivatives, robust=True)
+
+    for record in records:
+        key = record['key']
+        if key in receipts:
+            result.add(key, 'duplicate', unique_id=receipts[key])
+        else:
+            status, unique_id, errors = outcomes[key]
+            result.add(key, status, unique_id=unique_id, errors=errors)
+    return result
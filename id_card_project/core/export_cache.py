@@ -0,0 +1,145 @@
+import hashlib
+import os
+import shutil
+import threading
+import zipfile
+
+from django.conf import settings
+from django.utils import timezone
+
+from .exports import build_archive, order_by_export_class
+from .models import ExportSegment, Student
+
+# The single-workbook layout cannot be split by class, so it is always built in full
+SEGMENTED_FORMATS = ('csv', 'xlsx')
+
+
+def resolve_export_class(class_name, other_class):
+    if class_name == 'Other':
+        return other_class or 'Other'
+    return class_name
+
+
+def student_owner_keys(partner_id):
+    keys = ['admin']
+    if partner_id:
+        keys.append(f'partner-{partner_id}')
+    return keys
+
+
+def mark_segments_stale(owner_keys, export_classes):
+    """Flag the (owner, class) segments as needing a rebuild, creating rows for new classes."""
+    segments = [
+        ExportSegment(owner_key=owner_key, export_format=export_format, export_class=export_class, stale=True)
+        for owner_key in set(owner_keys)
+        for export_class in set(export_classes)
+        for export_format in SEGMENTED_FORMATS
+    ]
+    ExportSegment.objects.bulk_create(
+        segments,
+        update_conflicts=True,
+        unique_fields=['owner_key', 'export_format', 'export_class'],
+        update_fields=['stale'],
+    )
+
+
+def mark_students_stale(rows):
+    """Mark the segments of ``(class_name, other_class, partner_id)`` rows changed without signals."""
+    owners, classes = set(), set()
+    for class_name, other_class, partner_id in rows:
+        owners.update(student_owner_keys(partner_id))
+        classes.add(resolve_export_class(class_name, other_class))
+    if classes:
+        mark_segments_stale(owners, classes)
+
+
+def _owner_queryset(owner_key):
+    if owner_key == 'admin':
+        return Student.objects.all()
+    return Student.objects.filter(partner_id=int(owner_key.split('-', 1)[1]))
+
+
+def _cache_dir(owner_key, export_format):
+    return os.path.join(settings.EXPORT_CACHE_ROOT, owner_key, export_format)
+
+
+def _segment_path(segment):
+    digest = hashlib.sha1(segment.export_class.encode()).hexdigest()
+    return os.path.join(_cache_dir(segment.owner_key, segment.export_format), 'segments', f'{digest}.zip')
+
+
+def _temporary_path(path):
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+def _build_segment(segment):
+    # Clear the flag before reading, so a save that lands mid-build marks it stale again
+    ExportSegment.objects.filter(pk=segment.pk).update(stale=False)
+    students = order_by_export_class(_owner_queryset(segment.owner_key)).filter(export_class=segment.export_class)
+
+    path = _segment_path(segment)
+    rows = students.count()
+    if not rows:
+        ExportSegment.objects.filter(pk=segment.pk, stale=False).delete()
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = _temporary_path(path)
+    try:
+        with open(partial, 'wb') as f:
+            for _ in build_archive(f, students, segment.export_format):
+                pass
+        os.replace(partial, path)
+    except BaseException:
+        # The old segment file is still in place; flag it again so the next export retries
+        ExportSegment.objects.filter(pk=segment.pk).update(stale=True)
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    ExportSegment.objects.filter(pk=segment.pk).update(rows=rows, built_at=timezone.now())
+    return True
+
+
+def _assemble(segments, archive_path):
+    partial = _temporary_path(archive_path)
+    try:
+        with zipfile.ZipFile(partial, 'w') as archive:
+            for segment in segments:
+                with zipfile.ZipFile(_segment_path(segment)) as source:
+                    for info in source.infolist():
+                        target = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                        target.compress_type = info.compress_type
+                        with source.open(info) as reader, archive.open(target, 'w') as writer:
+                            shutil.copyfileobj(reader, writer, 1024 * 1024)
+        os.replace(partial, archive_path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def cached_export(owner_key, export_format):
+    """Return the path of an up-to-date export archive for ``owner_key``.
+
+    The archive is assembled from one cached ZIP segment per class. Only
+    segments marked stale since they were last built are regenerated; when
+    none are, the previously assembled archive is returned as is.
+    """
+    archive_path = os.path.join(_cache_dir(owner_key, export_format), 'student_data.zip')
+    segments = ExportSegment.objects.filter(owner_key=owner_key, export_format=export_format)
+    if not segments.exists():
+        classes = order_by_export_class(_owner_queryset(owner_key)).order_by().values_list('export_class', flat=True).distinct()
+        mark_segments_stale([owner_key], list(classes))
+
+    stale = list(segments.filter(stale=True))
+    if not stale and os.path.exists(archive_path):
+        return archive_path
+
+    for segment in stale:
+        _build_segment(segment)
+
+    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+    _assemble(list(segments.filter(rows__gt=0).order_by('export_class')), archive_path)
+    return archive_path
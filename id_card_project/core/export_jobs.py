@@ -0,0 +1,124 @@
+import datetime
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .exports import build_archive, export_owner_key, export_queryset
+from .models import ExportJob
+
+logger = logging.getLogger(__name__)
+
+EXPORT_JOB_LEASE_SECONDS = getattr(settings, 'EXPORT_JOB_LEASE_SECONDS', 300)
+EXPORT_JOB_RETENTION_SECONDS = getattr(settings, 'EXPORT_JOB_RETENTION_SECONDS', 24 * 60 * 60)
+# Several renewals fit in one lease, so a single slow write does not cost the job
+HEARTBEAT_INTERVAL = EXPORT_JOB_LEASE_SECONDS / 5
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def export_job_path(job):
+    return os.path.join(settings.EXPORT_JOB_ROOT, job.file_name)
+
+
+def fail_abandoned_jobs(**filters):
+    """Fail RUNNING jobs whose worker stopped renewing the lease, e.g. because it was killed."""
+    cutoff = timezone.now() - datetime.timedelta(seconds=EXPORT_JOB_LEASE_SECONDS)
+    return ExportJob.objects.filter(status='RUNNING', heartbeat_at__lt=cutoff, **filters).update(
+        status='FAILED', error="The export worker stopped before finishing.", finished_at=timezone.now(),
+    )
+
+
+def enqueue_export(user, export_format):
+    owner_key = export_owner_key(user)
+    if owner_key is None:
+        return None
+
+    # Identical requests share the job that is already queued or running, unless its worker died
+    fail_abandoned_jobs(owner_key=owner_key, export_format=export_format)
+    active = ExportJob.objects.filter(owner_key=owner_key, export_format=export_format, status__in=ExportJob.ACTIVE_STATUSES)
+    job = active.first()
+    if job is None:
+        try:
+            with transaction.atomic():
+                job = ExportJob.objects.create(requested_by=user, owner_key=owner_key, export_format=export_format)
+        except IntegrityError:
+            # A concurrent request created it first; exportjob_one_active allows only one
+            job = active.get()
+    return job
+
+
+def claim_next_job():
+    fail_abandoned_jobs()
+    for job in ExportJob.objects.filter(status='PENDING').order_by('created_at')[:10]:
+        # Conditional update so two workers can never claim the same job
+        now = timezone.now()
+        claimed = ExportJob.objects.filter(pk=job.pk, status='PENDING').update(status='RUNNING', started_at=now, heartbeat_at=now)
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def renew_lease(job):
+    if not ExportJob.objects.filter(pk=job.pk, status='RUNNING').update(heartbeat_at=timezone.now()):
+        raise LeaseLost(job.pk)
+
+
+def purge_expired_jobs():
+    """Delete finished jobs older than the retention period, with their archives."""
+    cutoff = timezone.now() - datetime.timedelta(seconds=EXPORT_JOB_RETENTION_SECONDS)
+    expired = ExportJob.objects.filter(status__in=('DONE', 'FAILED'), finished_at__lt=cutoff)
+    for job in expired.exclude(file_name=''):
+        path = export_job_path(job)
+        if os.path.exists(path):
+            os.remove(path)
+    return expired.delete()[0]
+
+
+def run_export_job(job):
+    os.makedirs(settings.EXPORT_JOB_ROOT, exist_ok=True)
+    file_name = f'export-{job.pk}-{job.export_format}.zip'
+    final_path = os.path.join(settings.EXPORT_JOB_ROOT, file_name)
+    partial_path = f'{final_path}.{os.getpid()}.{threading.get_ident()}.part'
+
+    try:
+        students = export_queryset(job.requested_by)
+        renewed = time.monotonic()
+        with open(partial_path, 'wb') as archive:
+            for _ in build_archive(archive, students, job.export_format):
+                if time.monotonic() - renewed >= HEARTBEAT_INTERVAL:
+                    renew_lease(job)
+                    renewed = time.monotonic()
+        # Only the lease holder may publish; a job failed as abandoned keeps its status
+        renew_lease(job)
+        os.replace(partial_path, final_path)
+    except LeaseLost:
+        logger.warning("Export job %s lost its lease; dropping the partial archive", job.pk)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        job.refresh_from_db()
+        return job
+    except Exception as exc:
+        logger.exception("Export job %s failed", job.pk)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        outcome = {'status': 'FAILED', 'error': str(exc)}
+    else:
+        outcome = {'status': 'DONE', 'file_name': file_name, 'file_size': os.path.getsize(final_path)}
+    outcome['finished_at'] = timezone.now()
+
+    # Conditional, like renew_lease: a job the reaper failed or that was re-queued meanwhile keeps that state
+    if not ExportJob.objects.filter(pk=job.pk, status='RUNNING').update(**outcome):
+        logger.warning("Export job %s lost its lease before recording its outcome", job.pk)
+        job.refresh_from_db()
+        return job
+    for name, value in outcome.items():
+        setattr(job, name, value)
+    return job
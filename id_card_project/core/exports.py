@@ -0,0 +1,308 @@
+import collections
+import csv
+import itertools
+import logging
+import os
+import re
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db.models import Case, CharField, F, Value, When
+from django.db.models.functions import Coalesce, NullIf
+from openpyxl import Workbook
+
+from .models import Student
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'xlsx', 'xlsx-book')
+EXPORT_HEADER = ['Unique ID', 'Student Name', "Father's Name", 'Class', 'Village', 'Mobile Number']
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 500)
+PHOTO_READ_SIZE = 64 * 1024
+SPOOL_MAX_SIZE = 1024 * 1024
+# Exports read plain tuples; model instances would cost several times the memory per row
+EXPORT_FIELDS = ('export_class', 'unique_id', 'student_name', 'father_name', 'village', 'mobile_number', 'photo')
+# Photo reads are latency bound on network storage: a shared pool reads ahead of the single ZIP writer
+EXPORT_PHOTO_READERS = getattr(settings, 'EXPORT_PHOTO_READERS', 8)
+EXPORT_PHOTO_PREFETCH = getattr(settings, 'EXPORT_PHOTO_PREFETCH', 32)
+# Only photos up to this size are read ahead whole; larger ones are streamed by the writer, so the
+# read-ahead holds at most EXPORT_PHOTO_PREFETCH * EXPORT_PHOTO_INLINE_SIZE bytes
+EXPORT_PHOTO_INLINE_SIZE = getattr(settings, 'EXPORT_PHOTO_INLINE_SIZE', 256 * 1024)
+SHEET_TITLE_MAX_LENGTH = 31
+INVALID_SHEET_TITLE_RE = re.compile(r'[\[\]:*?/\\]')
+
+_photo_executor = ThreadPoolExecutor(max_workers=EXPORT_PHOTO_READERS, thread_name_prefix='export-photo')
+
+
+def export_owner_key(user):
+    if user.role == 'ADMIN':
+        return 'admin'
+    elif user.role == 'PARTNER':
+        return f'partner-{user.partner.pk}'
+    return None
+
+
+def export_queryset(user):
+    if user.role == 'ADMIN':
+        students = Student.objects.all()
+    elif user.role == 'PARTNER':
+        students = Student.objects.filter(partner=user.partner)
+    else:
+        return None
+
+    return order_by_export_class(students)
+
+
+def order_by_export_class(students):
+    # Resolve the export folder in SQL so each class comes out as one contiguous run
+    return students.annotate(
+        export_class=Case(
+            When(class_name='Other', then=Coalesce(NullIf('other_class', Value('')), Value('Other'))),
+            default=F('class_name'),
+            output_field=CharField(),
+        )
+    ).order_by('export_class', 'id')
+
+
+class ZipStreamBuffer:
+    """Write-only file object that hands written bytes back to a generator."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def student_row(student):
+    return [student.unique_id, student.student_name, student.father_name, student.export_class, student.village, student.mobile_number]
+
+
+class ExportTimings:
+    """Split an export's wall time into waiting on photo reads and the writer's own CPU time."""
+
+    def __init__(self):
+        self.rows = 0
+        self.photos = 0
+        self.photo_bytes = 0
+        self.io_wait = 0.0
+        self._started = time.perf_counter()
+        self.wall = self.cpu = 0.0
+
+    def measure(self, steps):
+        """Re-yield ``steps``, adding the CPU time of each step to ``cpu``.
+
+        Each step is timed on the thread that runs it: under ASGI successive
+        steps may run on different executor threads.
+        """
+        steps = iter(steps)
+        while True:
+            started = time.thread_time()
+            try:
+                next(steps)
+            except StopIteration:
+                return
+            finally:
+                self.cpu += time.thread_time() - started
+            yield
+
+    def wait_for(self, photo):
+        started = time.perf_counter()
+        data = photo.result()
+        self.io_wait += time.perf_counter() - started
+        if data is not None:
+            self.photos += 1
+            self.photo_bytes += len(data)
+        return data
+
+    def read(self, f):
+        started = time.perf_counter()
+        data = f.read(PHOTO_READ_SIZE)
+        self.io_wait += time.perf_counter() - started
+        self.photo_bytes += len(data)
+        return data
+
+    def finish(self):
+        self.wall = time.perf_counter() - self._started
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'photos': self.photos,
+            'photo_bytes': self.photo_bytes,
+            'wall_seconds': round(self.wall, 3),
+            'io_wait_seconds': round(self.io_wait, 3),
+            'cpu_seconds': round(self.cpu, 3),
+        }
+
+
+def _read_photo(storage, name):
+    """The content of photo ``name``, or ``None`` when it is too large to hold and must be streamed."""
+    with storage.open(name, 'rb') as f:
+        data = f.read(EXPORT_PHOTO_INLINE_SIZE + 1)
+    return data if len(data) <= EXPORT_PHOTO_INLINE_SIZE else None
+
+
+def _prefetch_photos(rows, window=EXPORT_PHOTO_PREFETCH):
+    """Yield ``(row, photo)`` in order, with up to ``window`` rows' photos being read ahead."""
+    storage = Student._meta.get_field('photo').storage
+    pending = collections.deque()
+    for row in rows:
+        pending.append((row, _photo_executor.submit(_read_photo, storage, row.photo) if row.photo else None))
+        if len(pending) > window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+def _write_photo(zip_file, student, class_name, photo, timings):
+    data = timings.wait_for(photo)
+    _, extension = os.path.splitext(student.photo)
+    entry = zipfile.ZipInfo(f'{class_name}/Photos/{student.unique_id}{extension}', date_time=time.localtime()[:6])
+    # JPEGs are already compressed; deflating them again only costs CPU
+    entry.compress_type = zipfile.ZIP_STORED
+    if data is not None:
+        zip_file.writestr(entry, data)
+        return
+
+    storage = Student._meta.get_field('photo').storage
+    with storage.open(student.photo, 'rb') as source, zip_file.open(entry, 'w') as target:
+        timings.photos += 1
+        while data := timings.read(source):
+            target.write(data)
+            yield
+
+
+def _write_csv_class(zip_file, class_name, students_in_class, timings):
+    # The CSV is spooled (to disk once it grows) while photos stream straight into the archive
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='w+t', encoding='utf-8', newline='') as csv_buffer:
+        csv_writer = csv.writer(csv_buffer)
+        csv_writer.writerow(EXPORT_HEADER)
+
+        for student, photo in students_in_class:
+            csv_writer.writerow(student_row(student))
+            timings.rows += 1
+            if photo:
+                yield from _write_photo(zip_file, student, class_name, photo, timings)
+            yield
+
+        csv_buffer.seek(0)
+        with zip_file.open(f'{class_name}/student_data.csv', 'w') as entry:
+            while True:
+                data = csv_buffer.read(PHOTO_READ_SIZE)
+                if not data:
+                    break
+                entry.write(data.encode('utf-8'))
+                yield
+
+
+def _write_xlsx_class(zip_file, class_name, students_in_class, timings):
+    # Write-only sheets buffer their rows in a temporary file rather than as cell objects
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Students")
+    worksheet.append(EXPORT_HEADER)
+
+    for student, photo in students_in_class:
+        worksheet.append(student_row(student))
+        timings.rows += 1
+        if photo:
+            yield from _write_photo(zip_file, student, class_name, photo, timings)
+        yield
+
+    with zip_file.open(f'{class_name}/student_data.xlsx', 'w') as entry:
+        workbook.save(entry)
+    yield
+
+
+def sheet_title(class_name, used_titles):
+    """Return an Excel-safe sheet title for ``class_name`` that is not in ``used_titles``."""
+    title = INVALID_SHEET_TITLE_RE.sub('_', str(class_name)).strip("'")[:SHEET_TITLE_MAX_LENGTH] or 'Class'
+    candidate, n = title, 1
+    # Excel compares sheet titles case-insensitively
+    while candidate.lower() in used_titles:
+        n += 1
+        suffix = f' ({n})'
+        candidate = title[:SHEET_TITLE_MAX_LENGTH - len(suffix)] + suffix
+    used_titles.add(candidate.lower())
+    return candidate
+
+
+def _write_xlsx_book(zip_file, classes, timings):
+    """One workbook with a sheet per class and a leading summary sheet."""
+    workbook = Workbook(write_only=True)
+    summary = workbook.create_sheet("Summary")
+    summary.append(['Class', 'Sheet', 'Students'])
+    used_titles = {'summary'}
+    total = 0
+
+    for class_name, students_in_class in classes:
+        title = sheet_title(class_name, used_titles)
+        worksheet = workbook.create_sheet(title)
+        worksheet.append(EXPORT_HEADER)
+        count = 0
+        for student, photo in students_in_class:
+            worksheet.append(student_row(student))
+            count += 1
+            if photo:
+                yield from _write_photo(zip_file, student, class_name, photo, timings)
+            yield
+        timings.rows += count
+        summary.append([class_name, title, count])
+        total += count
+
+    summary.append(['Total', None, total])
+    with zip_file.open('student_data.xlsx', 'w') as entry:
+        workbook.save(entry)
+    yield
+
+
+def build_archive(fileobj, students, export_format, timings=None):
+    """Write the export ZIP for ``students`` into ``fileobj``.
+
+    ``students`` must be ordered by ``order_by_export_class``; rows are read
+    as tuples in chunks and each class is written before the next is read,
+    while a thread pool reads photos ahead of the writer. Pass an
+    ``ExportTimings`` to collect where the time went.
+    This is a generator: it yields after every row so callers can drain
+    ``fileobj`` while the archive is being produced.
+    """
+    timings = timings or ExportTimings()
+    yield from timings.measure(_write_archive(fileobj, students, export_format, timings))
+    timings.finish()
+    logger.info(
+        "Exported %d rows and %d photos (%d bytes) in %.2fs: %.2fs waiting on photo reads, %.2fs CPU",
+        timings.rows, timings.photos, timings.photo_bytes, timings.wall, timings.io_wait, timings.cpu,
+    )
+    yield
+
+
+def _write_archive(fileobj, students, export_format, timings):
+    rows = students.values_list(*EXPORT_FIELDS, named=True).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    classes = itertools.groupby(_prefetch_photos(rows), key=lambda pair: pair[0].export_class)
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        if export_format == 'xlsx-book':
+            yield from _write_xlsx_book(zip_file, classes, timings)
+        else:
+            write_class = _write_xlsx_class if export_format == 'xlsx' else _write_csv_class
+            for class_name, students_in_class in classes:
+                yield from write_class(zip_file, class_name, students_in_class, timings)
+
+
+def stream_archive(students, export_format):
+    buffer = ZipStreamBuffer()
+    for _ in build_archive(buffer, students, export_format):
+        data = buffer.drain()
+        if data:
+            yield data
@@ -1,18 +1,67 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
+from django.core.files.uploadedfile import UploadedFile
+from django.urls import reverse
+from .institutions import institution_name
 from .models import User, Partner, Institution, Student
+from .photos import PhotoRejected, ingest_photo
+
+class InstitutionAutocomplete(forms.Widget):
+    """A search box over the ``institution_lookup`` endpoint that posts the chosen institution's pk.
+
+    Only the selected institution is rendered, never the full list of choices.
+    """
+    template_name = 'widgets/institution_autocomplete.html'
+
+    class Media:
+        js = ['js/institution_autocomplete.js']
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['lookup_url'] = reverse('institution_lookup')
+        context['widget']['label'] = institution_name(value) if value not in (None, '') else ''
+        return context
 
 class StudentForm(forms.ModelForm):
+    # A plain FileField: the image is decoded and verified once, in clean_photo
+    photo = forms.FileField(required=False, widget=forms.FileInput(attrs={'accept': 'image/*'}))
+
     class Meta:
         model = Student
         fields = ['student_name', 'father_name', 'class_name', 'other_class', 'village', 'mobile_number', 'photo', 'institution']
-        widgets = {
-            'photo': forms.HiddenInput(),
-        }
+        widgets = {'institution': InstitutionAutocomplete}
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, institution=None, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['photo'].required = False
+        if institution is not None:
+            # Already decided by the caller, so there is nothing to pick or to look up
+            del self.fields['institution']
+            self.instance.institution = institution
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        # The field already fetched the institution by pk; skip the model's second existence query
+        exclude.add('institution')
+        return exclude
+
+    def clean_photo(self):
+        photo = self.cleaned_data.get('photo')
+        if not isinstance(photo, UploadedFile):
+            return photo
+        try:
+            return ingest_photo(photo)
+        except PhotoRejected as exc:
+            raise forms.ValidationError(str(exc))
+
+class StudentImportForm(forms.Form):
+    sheet = forms.FileField(label="Spreadsheet (CSV or XLSX)", widget=forms.FileInput(attrs={'accept': '.csv,.xlsx'}))
+    photos = forms.FileField(label="Photos (ZIP)", required=False, widget=forms.FileInput(attrs={'accept': '.zip'}))
+
+    def clean_sheet(self):
+        sheet = self.cleaned_data['sheet']
+        if not sheet.name.lower().endswith(('.csv', '.xlsx')):
+            raise forms.ValidationError("Upload a .csv or .xlsx file.")
+        return sheet
 
 class CustomUserCreationForm(UserCreationForm):
     class Meta(UserCreationForm.Meta):
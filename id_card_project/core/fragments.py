@@ -0,0 +1,107 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .models import DataVersion
+
+
+def owner_version(owner_key):
+    """Return the current data version of ``owner_key``: a millisecond timestamp, or 0 before any change."""
+    version = DataVersion.objects.filter(key=owner_key).values_list('version', flat=True).first()
+    return version or 0
+
+
+async def aowner_version(owner_key):
+    """Async ``owner_version()``."""
+    version = await DataVersion.objects.filter(key=owner_key).values_list('version', flat=True).afirst()
+    return version or 0
+
+
+def bump_owner_versions(owner_keys):
+    """Advance the versions of ``owner_keys``; call it in the transaction that changes their data."""
+    owner_keys = set(owner_keys)
+    if not owner_keys:
+        return
+    now = int(time.time() * 1000)
+    # Strictly increasing, even for two bumps within the same millisecond
+    DataVersion.objects.filter(key__in=owner_keys).update(version=Greatest(F('version') + 1, Value(now)))
+    DataVersion.objects.bulk_create([DataVersion(key=key, version=now) for key in owner_keys], ignore_conflicts=True)
+
+
+def student_version_owners(institution_id, partner_id):
+    owners = []
+    if institution_id:
+        owners.append(f'institution-{institution_id}')
+    if partner_id:
+        owners.append(f'partner-{partner_id}')
+    return owners
+
+
+def bump_student_versions(rows):
+    """Bump the owners of ``(institution_id, partner_id)`` rows changed without signals."""
+    bump_owner_versions(owner for row in rows for owner in student_version_owners(*row))
+
+
+def fragment_key(name, owner_key, version, vary):
+    digest = hashlib.md5(repr(vary).encode(), usedforsecurity=False).hexdigest()
+    return f'fragment:{name}:{owner_key}:{version}:{digest}'
+
+
+class FragmentStats:
+    """Per-process hit ratio of the fragment cache and the render time it saved."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.render_seconds = 0.0
+            self.saved_seconds = 0.0
+
+    def hit(self, render_seconds):
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += render_seconds
+
+    def miss(self, render_seconds):
+        with self._lock:
+            self.misses += 1
+            self.render_seconds += render_seconds
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+fragment_stats = FragmentStats()
+
+
+def cached_fragment(name, owner_key, version, vary, render):
+    """Return ``render()``'s output from the cache, rendering and storing it on a miss.
+
+    ``version`` must be the owner version read before the data being
+    rendered was queried; read any later, a change committed in between
+    would file the old rows under the new version.
+    """
+    key = fragment_key(name, owner_key, version, vary)
+    cached = cache.get(key)
+    if cached is not None:
+        html, render_seconds = cached
+        fragment_stats.hit(render_seconds)
+        return html
+
+    started = time.perf_counter()
+    html = render()
+    render_seconds = time.perf_counter() - started
+    fragment_stats.miss(render_seconds)
+    cache.set(key, (html, render_seconds), settings.DASHBOARD_FRAGMENT_CACHE_TIMEOUT)
+    return html
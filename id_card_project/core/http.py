@@ -0,0 +1,130 @@
+import functools
+import os
+import re
+import uuid
+
+from asgiref.sync import iscoroutinefunction
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.csrf import csrf_exempt
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(RANGE_CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def parse_range(header, size):
+    """Return ``(start, end)`` for a single ``bytes=`` range, ``None`` to ignore it,
+    or ``False`` when the range cannot be satisfied."""
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        suffix = int(last)
+        if suffix == 0:
+            return False
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def if_range_matches(if_range, etag, last_modified):
+    """Whether an ``If-Range`` validator still names this file: its ETag, or its exact ``Last-Modified`` date."""
+    if if_range.startswith('"'):
+        return if_range == etag
+    if if_range.startswith('W/'):
+        # Weak validators never satisfy If-Range
+        return False
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def ranged_file_response(request, path, content_type, filename=None, etag=None):
+    """Serve ``path`` honouring a single-part ``Range`` request header and conditional GETs."""
+    stat = os.stat(path)
+    size = stat.st_size
+    last_modified = int(stat.st_mtime)
+    etag = quote_etag(etag or f'{last_modified}-{size}')
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        response['ETag'] = etag
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and request.method in ('GET', 'HEAD'):
+        if_range = request.headers.get('If-Range')
+        if not if_range or if_range_matches(if_range.strip(), etag, last_modified):
+            byte_range = parse_range(range_header, size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(path, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
+
+
+def authorization_token(request):
+    """The UUID sent as ``Authorization: Token <uuid>``, or ``None`` when there is no well-formed one."""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'token':
+        return None
+    try:
+        return uuid.UUID(token.strip())
+    except ValueError:
+        return None
+
+
+def api_post(view_func):
+    """Accept only POST, answering other methods with a JSON 405, and skip the CSRF check.
+
+    Only for views that authenticate without cookies (a token header or a
+    code in the URL): a forged cross-site request carries neither.
+    """
+    def not_allowed():
+        return JsonResponse({'error': 'Method not allowed'}, status=405, headers={'Allow': 'POST'})
+
+    if iscoroutinefunction(view_func):
+        @functools.wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method != 'POST':
+                return not_allowed()
+            return await view_func(request, *args, **kwargs)
+        return csrf_exempt(async_wrapper)
+
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            return not_allowed()
+        return view_func(request, *args, **kwargs)
+    return csrf_exempt(wrapper)
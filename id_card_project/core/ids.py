@@ -0,0 +1,104 @@
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import BigIntegerField, F, Max
+from django.db.models.functions import Cast, Substr
+
+from .models import IdCounter, Student
+
+STUDENT_COUNTER = 'student'
+
+
+def format_student_id(number):
+    # Four digits is only the minimum width; S10000 and beyond keep parsing with int(unique_id[1:])
+    return f'S{number:04d}'
+
+
+def _highest_student_number():
+    highest = Student.objects.filter(unique_id__regex=r'^S[0-9]+$').annotate(
+        number=Cast(Substr('unique_id', 2), BigIntegerField())
+    ).aggregate(highest=Max('number'))['highest']
+    return highest or 0
+
+
+class IdAllocator:
+    """Hands out numbers from a counter row, reserving them from the database in blocks.
+
+    Each process keeps the unused part of its last block in memory, so most
+    allocations never touch the database and concurrent workers only contend
+    on the counter row once per block. The block size is read from the
+    ``block_size_setting`` setting at every reservation.
+    """
+
+    def __init__(self, name, block_size_setting, default_block_size=20):
+        self.name = name
+        self.block_size_setting = block_size_setting
+        self.default_block_size = default_block_size
+        self._lock = threading.Lock()
+        self._ranges = deque()
+        # A child forked after an allocation would hand out the same numbers as its parent
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._forget)
+
+    @property
+    def block_size(self):
+        return getattr(settings, self.block_size_setting, self.default_block_size)
+
+    def _forget(self):
+        # The parent's lock may have been held by another thread at fork time
+        self._lock = threading.Lock()
+        self._ranges = deque()
+
+    def reset(self):
+        with self._lock:
+            self._ranges.clear()
+
+    def _take(self, count):
+        taken = []
+        with self._lock:
+            while self._ranges and len(taken) < count:
+                start, end = self._ranges.popleft()
+                stop = min(end + 1, start + count - len(taken))
+                taken.extend(range(start, stop))
+                if stop <= end:
+                    self._ranges.appendleft((stop, end))
+        return taken
+
+    def _release(self, start, end):
+        if start <= end:
+            with self._lock:
+                self._ranges.append((start, end))
+
+    def _reserve(self, count):
+        with transaction.atomic():
+            updated = IdCounter.objects.filter(name=self.name).update(value=F('value') + count)
+            if not updated:
+                try:
+                    with transaction.atomic():
+                        IdCounter.objects.create(name=self.name, value=_highest_student_number())
+                except IntegrityError:
+                    pass
+                IdCounter.objects.filter(name=self.name).update(value=F('value') + count)
+            end = IdCounter.objects.filter(name=self.name).values_list('value', flat=True).get()
+        return end - count + 1, end
+
+    def allocate(self, count=1):
+        numbers = self._take(count)
+        missing = count - len(numbers)
+        if missing:
+            start, end = self._reserve(missing + self.block_size)
+            numbers.extend(range(start, start + missing))
+            # Leftovers only become reusable once the reservation is committed; if the
+            # surrounding transaction rolls back the counter does too and they must not be reused
+            transaction.on_commit(lambda: self._release(start + missing, end))
+        return numbers
+
+
+student_id_allocator = IdAllocator(STUDENT_COUNTER, 'STUDENT_ID_BLOCK_SIZE')
+
+
+def allocate_student_ids(count=1):
+    return [format_student_id(number) for number in student_id_allocator.allocate(count)]
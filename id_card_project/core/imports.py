@@ -0,0 +1,219 @@
+import csv
+import io
+import os
+import zipfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+from .export_cache import mark_students_stale
+from .exports import EXPORT_HEADER
+from .forms import StudentForm
+from .fragments import bump_student_versions
+from .ids import allocate_student_ids
+from .models import Student
+from .photos import ingest_photo, release_photo
+from .thumbnails import generate_derivatives
+
+IMPORT_BATCH_SIZE = getattr(settings, 'IMPORT_BATCH_SIZE', 200)
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+CLASS_VALUES = {value for value, _ in Student.CLASS_CHOICES}
+
+
+class InvalidImport(ValueError):
+    """The upload cannot be imported at all; ``field`` names the form field at fault."""
+
+    def __init__(self, message, field='sheet'):
+        super().__init__(message)
+        self.field = field
+
+
+def _normalize_header(header):
+    return [str(cell or '').strip().lower() for cell in header]
+
+
+def read_sheet(sheet, file_name):
+    """Yield ``(row_number, values)`` for each data row, header included as row 1."""
+    if file_name.lower().endswith('.xlsx'):
+        try:
+            workbook = load_workbook(sheet, read_only=True, data_only=True)
+        except (zipfile.BadZipFile, InvalidFileException, KeyError):
+            raise InvalidImport("Upload a valid .xlsx file.")
+        rows = workbook.active.iter_rows(values_only=True)
+    else:
+        rows = csv.reader(io.TextIOWrapper(sheet, encoding='utf-8-sig', newline=''))
+
+    try:
+        header = next(rows, None)
+        if header is None or _normalize_header(header)[:len(EXPORT_HEADER)] != _normalize_header(EXPORT_HEADER):
+            raise InvalidImport(f"The first row must be the export header: {', '.join(EXPORT_HEADER)}")
+
+        for row_number, values in enumerate(rows, start=2):
+            values = ['' if cell is None else str(cell).strip() for cell in values][:len(EXPORT_HEADER)]
+            if not any(values):
+                continue
+            yield row_number, values + [''] * (len(EXPORT_HEADER) - len(values))
+    except UnicodeDecodeError:
+        raise InvalidImport("The CSV file must be UTF-8 encoded.")
+    except csv.Error as exc:
+        raise InvalidImport(f"The CSV file cannot be read: {exc}")
+
+
+class PhotoArchive:
+    """Photos in a ZIP, matched to rows by file name: the row's Unique ID or its sheet row number."""
+
+    def __init__(self, fileobj):
+        try:
+            self.zip_file = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile:
+            raise InvalidImport("Upload a valid ZIP file.", field='photos')
+        self.entries = {}
+        for info in self.zip_file.infolist():
+            stem, extension = os.path.splitext(os.path.basename(info.filename))
+            if not info.is_dir() and extension.lower() in PHOTO_EXTENSIONS:
+                self.entries[stem] = info
+
+    def get(self, *keys):
+        for key in keys:
+            info = self.entries.get(str(key)) if key else None
+            if info is None:
+                continue
+            if info.file_size > settings.PHOTO_MAX_UPLOAD_SIZE:
+                raise InvalidImport(f"{info.filename} is larger than {settings.PHOTO_MAX_UPLOAD_SIZE // 1024} KB.", field='photos')
+            try:
+                data = self.zip_file.read(info)
+            except (zipfile.BadZipFile, OSError):
+                raise InvalidImport(f"{info.filename} is damaged in the ZIP file.", field='photos')
+            return SimpleUploadedFile(os.path.basename(info.filename), data)
+        return None
+
+
+def row_form_data(values):
+    unique_id, student_name, father_name, class_value, village, mobile_number = values
+    # Exports write the resolved class, so anything outside the choices came from "Other"
+    if class_value in CLASS_VALUES:
+        class_name, other_class = class_value, ''
+    else:
+        class_name, other_class = 'Other', class_value
+    return {
+        'student_name': student_name,
+        'father_name': father_name,
+        'class_name': class_name,
+        'other_class': other_class,
+        'village': village,
+        'mobile_number': mobile_number,
+    }
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = []
+        self.created = 0
+        self.failed = 0
+        self.committed = False
+
+    @property
+    def errors(self):
+        return [row for row in self.rows if row['errors']]
+
+    def add(self, row_number, errors=None, unique_id=None):
+        self.rows.append({'row': row_number, 'errors': errors or {}, 'unique_id': unique_id})
+        if errors:
+            self.failed += 1
+
+
+def _export_rows(students):
+    return {(student.class_name, student.other_class, student.partner_id) for student in students}
+
+
+def _store_photos(batch, stored_photos):
+    # Outside any transaction: encoding and writing files never holds the database write lock
+    for _, student, _ in batch:
+        if student.photo and not student.photo._committed:
+            student.photo.save(student.photo.name, student.photo.file, save=False)
+            stored_photos.add(student.photo.name)
+
+
+def _insert(rows, result, archive):
+    students = [student for _, student, _ in rows]
+    # bulk_create sends no signals; the cache flags roll back with the rows if the insert fails
+    mark_students_stale(_export_rows(students))
+    for student, unique_id in zip(students, allocate_student_ids(len(students))):
+        student.unique_id = unique_id
+    Student.objects.bulk_create(students, batch_size=IMPORT_BATCH_SIZE)
+
+    storage = Student._meta.get_field('photo').storage
+    for _, student, photo_keys in rows:
+        # A release racing the import removed a shared file between storing it and writing this row
+        if student.photo and not storage.exists(student.photo.name):
+            storage.save_as(student.photo.name, ingest_photo(archive.get(*photo_keys)))
+    for row_number, student, _ in rows:
+        result.add(row_number, unique_id=student.unique_id)
+    result.created = len(students)
+
+
+def import_students(institution, sheet, file_name, photos=None, partner=None):
+    """Validate and insert every row of an exported-layout sheet for ``institution``.
+
+    The import is all or nothing: every row is validated and its photo
+    encoded and stored first, without a transaction, and only if all of them
+    pass are the rows inserted, in one short transaction. Otherwise the
+    result lists every failing row and the stored photos are released.
+    """
+    result = ImportResult()
+    archive = PhotoArchive(photos) if photos else None
+    stored_photos = set()
+    rows = []
+
+    try:
+        batch = []
+        for row_number, values in read_sheet(sheet, file_name):
+            photo_keys = (values[0], row_number)
+            try:
+                photo = archive.get(*photo_keys) if archive else None
+            except InvalidImport as exc:
+                result.add(row_number, errors={'photo': [str(exc)]})
+                continue
+            form = StudentForm(row_form_data(values), {'photo': photo} if photo else {}, institution=institution)
+            if not form.is_valid():
+                result.add(row_number, errors={field: list(messages) for field, messages in form.errors.items()})
+                continue
+            if result.failed:
+                # Already failing; keep validating so the report is complete, but keep nothing
+                continue
+
+            student = form.save(commit=False)
+            student.partner = partner
+            batch.append((row_number, student, photo_keys))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                # Only a batch of encoded photos is held in memory at a time
+                _store_photos(batch, stored_photos)
+                rows += batch
+                batch = []
+
+        if not result.failed and (rows or batch):
+            _store_photos(batch, stored_photos)
+            rows += batch
+            with transaction.atomic():
+                _insert(rows, result, archive)
+                bump_student_versions([(institution.pk, partner.pk if partner else None)])
+    except BaseException:
+        for name in stored_photos:
+            release_photo(name)
+        raise
+
+    if result.failed:
+        result.rows = result.errors
+        # Nothing was inserted; drop the photo files nobody references
+        for name in stored_photos:
+            release_photo(name)
+        return result
+
+    result.committed = True
+    storage = Student._meta.get_field('photo').storage
+    for name in stored_photos:
+        generate_derivatives(name, storage)
+    return result
@@ -0,0 +1,66 @@
+import hashlib
+import sys
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .fragments import bump_owner_versions, owner_version
+from .models import Institution
+
+# Lookup results are cached under this version, bumped whenever an institution is added, renamed or removed
+LOOKUP_VERSION_KEY = 'institutions'
+INSTITUTION_LOOKUP_LIMIT = 10
+
+
+def prefix_range(prefix):
+    """Return ``(low, high)`` such that ``low <= s < high`` holds exactly for strings starting with ``prefix``.
+
+    ``high`` is ``None`` when the prefix is made only of the last code point,
+    so nothing sorts above the matching strings.
+    """
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return prefix, None
+    code = ord(stem[-1]) + 1
+    # Surrogates cannot be stored; the next code point after U+D7FF is U+E000
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000
+    return prefix, stem[:-1] + chr(code)
+
+
+def lookup_institutions(prefix, limit=INSTITUTION_LOOKUP_LIMIT):
+    """Return up to ``limit`` institutions whose name starts with ``prefix``, as ``{'id', 'name'}`` dicts.
+
+    The prefix is matched case-insensitively as a range on the indexed,
+    lowercased ``lookup_name`` rather than with a ``LIKE``, so a lookup reads
+    only the matching entries.
+    """
+    prefix = prefix.strip()
+    if not prefix:
+        return []
+    digest = hashlib.md5(prefix.encode(), usedforsecurity=False).hexdigest()
+    key = f'institution-lookup:{owner_version(LOOKUP_VERSION_KEY)}:{limit}:{digest}'
+
+    def fetch():
+        low, high = prefix_range(Institution.normalize_name(prefix))
+        match = Q(lookup_name__gte=low)
+        if high is not None:
+            match &= Q(lookup_name__lt=high)
+        rows = Institution.objects.filter(match).order_by('lookup_name').values_list('pk', 'user__username')[:limit]
+        return [{'id': pk, 'name': name} for pk, name in rows]
+
+    return cache.get_or_set(key, fetch, settings.INSTITUTION_LOOKUP_CACHE_TIMEOUT)
+
+
+def institution_name(pk):
+    """The display name of the institution ``pk``, or ``None`` when it does not exist."""
+    try:
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None
+    return Institution.objects.filter(pk=pk).values_list('user__username', flat=True).first()
+
+
+def bump_institution_lookups():
+    bump_owner_versions([LOOKUP_VERSION_KEY])
@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.exports import EXPORT_FORMATS, ExportTimings, build_archive, order_by_export_class
+from core.models import Student
+from core.seeding import seed_owners, seed_students, student_rows, sync_student_counter, use_scratch_database
+
+ALIAS = 'benchmark'
+
+
+class Command(BaseCommand):
+    help = "Seed a scratch SQLite database and measure export throughput and peak Python heap per format."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000)
+        parser.add_argument('--institutions', type=int, default=50)
+        parser.add_argument('--partners', type=int, default=10)
+        parser.add_argument('--format', dest='formats', action='append', choices=EXPORT_FORMATS,
+                            help="Format to measure; repeat for several. All formats by default.")
+        parser.add_argument('--database', help="Scratch SQLite file to (re)use; a temporary one by default.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+
+    def seed(self, options):
+        if Student.objects.using(ALIAS).exists():
+            self.stdout.write("Reusing the seeded dataset")
+            return
+        institution_ids, partner_ids = seed_owners(options['institutions'], options['partners'], prefix='bench', using=ALIAS)
+        seed_students(student_rows(options['rows'], institution_ids, partner_ids), using=ALIAS)
+        sync_student_counter(options['rows'], using=ALIAS)
+        with connections[ALIAS].cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def export(self, export_format, path):
+        students = order_by_export_class(Student.objects.using(ALIAS))
+        timings = ExportTimings()
+        with open(path, 'wb') as f:
+            for _ in build_archive(f, students, export_format, timings):
+                pass
+        return os.path.getsize(path), timings
+
+    def handle(self, *args, **options):
+        scratch = tempfile.mkdtemp()
+        path = options['database'] or os.path.join(scratch, 'benchmark.sqlite3')
+        use_scratch_database(ALIAS, path)
+        self.seed(options)
+        rows = Student.objects.using(ALIAS).count()
+
+        results = {}
+        for export_format in options['formats'] or EXPORT_FORMATS:
+            archive = os.path.join(scratch, f'export.{export_format}.zip')
+            size, timings = self.export(export_format, archive)
+            seconds = timings.wall
+
+            # A second, traced run: tracemalloc slows everything down, so it is kept out of the timing
+            tracemalloc.start()
+            self.export(export_format, archive)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            os.remove(archive)
+
+            results[export_format] = {
+                **timings.as_dict(),
+                'rows_per_second': round(rows / seconds),
+                'archive_bytes': size,
+                'peak_heap_bytes': peak,
+            }
+            self.stdout.write(
+                f"  {export_format}: {seconds:.2f}s ({timings.io_wait:.2f}s photo I/O wait, {timings.cpu:.2f}s CPU), "
+                f"{results[export_format]['rows_per_second']} rows/s, peak heap {peak / 1024 / 1024:.1f} MiB"
+            )
+
+        report = {'database': path, 'rows': rows, 'formats': results}
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
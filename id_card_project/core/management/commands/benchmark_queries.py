@@ -0,0 +1,158 @@
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+
+from core.exports import order_by_export_class
+from core.models import Student
+from core.pagination import KeysetPaginator
+from core.search import SEARCH_FIELDS, search_students
+from core.seeding import seed_owners, seed_students, student_rows, sync_student_counter, use_scratch_database
+
+ALIAS = 'benchmark'
+BENCHMARKED_INDEXES = (
+    'student_inst_class_idx', 'student_partner_class_idx', 'student_mobile_idx',
+    'student_inst_updated_idx', 'student_partner_updated_idx',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a scratch SQLite database and record EXPLAIN QUERY PLAN output and timings for the "
+        "dashboard, export, search and admin changelist queries, with and without the Student access-path indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--institutions', type=int, default=500)
+        parser.add_argument('--partners', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20, help="Timed runs per query.")
+        parser.add_argument('--database', help="Scratch SQLite file to (re)use; a temporary one by default.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+
+    def seed(self, options):
+        if Student.objects.using(ALIAS).exists():
+            self.stdout.write("Reusing the seeded dataset")
+            return
+        started = time.perf_counter()
+        institution_ids, partner_ids = seed_owners(options['institutions'], options['partners'], prefix='bench', using=ALIAS)
+        seed_students(student_rows(options['rows'], institution_ids, partner_ids), using=ALIAS)
+        sync_student_counter(options['rows'], using=ALIAS)
+        with connections[ALIAS].cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.stdout.write(f"Seeded {options['rows']} students in {time.perf_counter() - started:.1f}s")
+
+    def queries(self):
+        students = Student.objects.using(ALIAS)
+        institution_id = students.order_by('id').values_list('institution_id', flat=True)[0]
+        partner_id = students.exclude(partner=None).order_by('id').values_list('partner_id', flat=True)[0]
+        mobile_number = students.order_by('-id').values_list('mobile_number', flat=True)[0]
+        last_change = students.order_by('-updated_at').values_list('updated_at', flat=True)[0]
+
+        def dashboard_page(**owner):
+            return students.filter(**owner).order_by('class_name', 'id')[:51]
+
+        def icontains_search(queryset, text):
+            for term in text.split():
+                queryset = queryset.filter(Q(*[(f'{field}__icontains', term) for field in SEARCH_FIELDS], _connector=Q.OR))
+            return queryset
+
+        def deep_dashboard_page(**owner):
+            owned = students.filter(**owner).order_by('class_name', 'id')
+            last = owned.values_list('class_name', 'id')[owned.count() // 2]
+            paginator = KeysetPaginator(owned, ordering=('class_name', 'id'), per_page=50)
+            return owned.filter(paginator._after(list(last)))[:51]
+
+        return {
+            'institution_dashboard_first_page': lambda: dashboard_page(institution_id=institution_id),
+            'institution_dashboard_deep_page': lambda: deep_dashboard_page(institution_id=institution_id),
+            'partner_dashboard_first_page': lambda: dashboard_page(partner_id=partner_id).select_related('institution__user'),
+            'partner_dashboard_count': lambda: students.filter(partner_id=partner_id).values('id'),
+            'partner_export': lambda: order_by_export_class(students.filter(partner_id=partner_id)),
+            'class_group_counts': lambda: students.filter(partner_id=partner_id).values('class_name').order_by('class_name').distinct(),
+            'admin_changelist_search': lambda: students.select_related('institution__user', 'partner__user').filter(
+                Q(student_name__icontains='ravi') | Q(father_name__icontains='ravi') | Q(unique_id__icontains='ravi')
+            ).order_by('-pk')[:100],
+            # Word prefixes, as typed into the admin and dashboard search boxes; LIKE '%term%' scans every row
+            'admin_search_icontains': lambda: icontains_search(students, f'ravi red {mobile_number[:6]}').order_by('-pk')[:100],
+            'admin_search_fulltext': lambda: search_students(students, f'ravi red {mobile_number[:6]}').order_by('-pk')[:100],
+            'dashboard_search_icontains': lambda: icontains_search(
+                students.filter(institution_id=institution_id), 'meena eluru'
+            ).order_by('class_name', 'id')[:51],
+            'dashboard_search_fulltext': lambda: search_students(
+                students.filter(institution_id=institution_id), 'meena eluru'
+            ).order_by('class_name', 'id')[:51],
+            # What the dashboards run: one owner's rows through its index, matched with LIKE
+            'dashboard_search_owner_scoped': lambda: search_students(
+                students.filter(institution_id=institution_id), 'meena eluru', owner_scoped=True
+            ).order_by('class_name', 'id')[:51],
+            # A delta sync with nothing new should cost an index probe, not a scan of the owner's rows
+            'partner_sync_delta': lambda: students.filter(partner_id=partner_id, updated_at__gt=last_change).order_by('updated_at', 'id')[:501],
+            'admin_changelist_filter': lambda: students.filter(class_name='5', institution_id=institution_id).order_by('-pk')[:100],
+            'duplicate_mobile_lookup': lambda: students.filter(mobile_number=mobile_number),
+        }
+
+    def measure(self, repeat):
+        results = {}
+        for name, build in self.queries().items():
+            queryset = build()
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            results[name] = {
+                'plan': queryset.explain(),
+                'median_ms': round(statistics.median(timings), 3),
+                'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            }
+            self.stdout.write(f"  {name}: {results[name]['median_ms']} ms")
+        return results
+
+    def drop_indexes(self):
+        with connections[ALIAS].schema_editor() as editor:
+            for index in Student._meta.indexes:
+                if index.name in BENCHMARKED_INDEXES:
+                    editor.remove_index(Student, index)
+
+    def restore_indexes(self):
+        with connections[ALIAS].schema_editor() as editor:
+            for index in Student._meta.indexes:
+                if index.name in BENCHMARKED_INDEXES:
+                    editor.add_index(Student, index)
+
+    def handle(self, *args, **options):
+        path = options['database'] or os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+        use_scratch_database(ALIAS, path)
+        self.seed(options)
+
+        self.stdout.write("With access-path indexes:")
+        with_indexes = self.measure(options['repeat'])
+        self.drop_indexes()
+        try:
+            self.stdout.write("Without access-path indexes:")
+            without_indexes = self.measure(options['repeat'])
+        finally:
+            self.restore_indexes()
+
+        report = {
+            'database': path,
+            'rows': Student.objects.using(ALIAS).count(),
+            'repeat': options['repeat'],
+            'queries': {
+                name: {'with_indexes': with_indexes[name], 'without_indexes': without_indexes[name]}
+                for name in with_indexes
+            },
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
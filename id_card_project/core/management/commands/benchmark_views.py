@@ -0,0 +1,154 @@
+import io
+import json
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from core.models import Institution, Partner, User
+
+
+def _photo_upload():
+    buffer = io.BytesIO()
+    Image.new('RGB', (350, 450), (120, 90, 60)).save(buffer, format='JPEG')
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the core views through the test client against the current database "
+        "(seed it with seed_data) and report p50/p95 latency, queries, bytes and peak memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help="Timed requests per view.")
+        parser.add_argument('--warmup', type=int, default=1, help="Untimed requests per view first.")
+        parser.add_argument('--view', dest='views', action='append', help="Only benchmark this view; repeatable.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+
+    def accounts(self):
+        institution = Institution.objects.annotate(students=Count('student')).order_by('-students').first()
+        partner = Partner.objects.annotate(students=Count('student')).order_by('-students').first()
+        if institution is None or partner is None:
+            raise CommandError("Seed an institution and a partner first, e.g. with seed_data")
+        admin, _ = User.objects.get_or_create(
+            username='benchmark_admin', defaults={'role': 'ADMIN', 'is_staff': True, 'is_superuser': True},
+        )
+        return institution, partner, admin
+
+    def views(self):
+        institution, partner, admin = self.accounts()
+        referral_path = reverse('referral_student_add', kwargs={'referral_code': partner.referral_code})
+        student_data = {
+            'student_name': 'Benchmark Student',
+            'father_name': 'Benchmark Father',
+            'class_name': '5',
+            'village': 'Eluru',
+            'mobile_number': '9876543210',
+            'institution': institution.pk,
+        }
+        return {
+            'institution_dashboard': (institution.user, lambda client: client.get(reverse('institution_dashboard'))),
+            'partner_dashboard': (partner.user, lambda client: client.get(reverse('partner_dashboard'))),
+            'export_data_csv': (partner.user, lambda client: client.get(reverse('export_data'), {'format': 'csv'})),
+            'export_data_xlsx': (partner.user, lambda client: client.get(reverse('export_data'), {'format': 'xlsx'})),
+            'referral_student_add_get': (None, lambda client: client.get(referral_path)),
+            'referral_student_add_post': (
+                None, self.rolled_back(lambda client: client.post(referral_path, {**student_data, 'photo': _photo_upload()})),
+            ),
+            'institution_lookup': (
+                None, lambda client: client.get(reverse('institution_lookup'), {'q': institution.user.username[:3]}),
+            ),
+            'user_list': (admin, lambda client: client.get(reverse('user_list'))),
+            'student_admin_changelist': (admin, lambda client: client.get(reverse('admin:core_student_changelist'))),
+        }
+
+    def request(self, client, send):
+        response = send(client)
+        if response.streaming:
+            # Count streamed bytes without holding the body, so peak memory is the view's own
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        response.close()
+        return response.status_code, size
+
+    def rolled_back(self, send):
+        # Enrollments are rolled back so repeated runs measure the same database
+        def send_and_roll_back(client):
+            with transaction.atomic():
+                response = send(client)
+                transaction.set_rollback(True)
+            return response
+        return send_and_roll_back
+
+    def measure(self, client, send, options):
+        for _ in range(options['warmup']):
+            self.request(client, send)
+
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            status, size = self.request(client, send)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+
+        # The request_started signal resets connection.queries, so count executions directly
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+            self.request(client, send)
+
+        # Traced separately: tracemalloc slows every allocation down
+        tracemalloc.start()
+        try:
+            self.request(client, send)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'status': status,
+            'p50_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            'queries': len(queries),
+            'bytes': size,
+            'peak_memory_bytes': peak,
+        }
+
+    def handle(self, *args, **options):
+        # The test client talks to the "testserver" host
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            views = self.views()
+            unknown = set(options['views'] or ()) - set(views)
+            if unknown:
+                raise CommandError(f"Unknown views: {', '.join(sorted(unknown))}")
+
+            results = {}
+            for name, (user, send) in views.items():
+                if options['views'] and name not in options['views']:
+                    continue
+                client = Client()
+                if user is not None:
+                    client.force_login(user)
+                results[name] = self.measure(client, send, options)
+                self.stdout.write(
+                    f"  {name}: p50 {results[name]['p50_ms']} ms, p95 {results[name]['p95_ms']} ms, "
+                    f"{results[name]['queries']} queries, {results[name]['bytes']} bytes, "
+                    f"peak {results[name]['peak_memory_bytes'] / 1024:.0f} KiB"
+                )
+
+        report = {'repeat': options['repeat'], 'warmup': options['warmup'], 'views': results}
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
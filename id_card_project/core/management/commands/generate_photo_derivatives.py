@@ -0,0 +1,73 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import Student
+from core.thumbnails import generate_derivatives
+
+
+def _generate(name, force):
+    try:
+        return name, generate_derivatives(name, Student._meta.get_field('photo').storage, force=force), None
+    except OSError as exc:
+        return name, 0, str(exc)
+
+
+class Command(BaseCommand):
+    help = "Backfill thumbnail and print derivatives for existing student photos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Size of the process pool.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Students handed to the pool per checkpoint.")
+        parser.add_argument('--force', action='store_true', help="Regenerate derivatives that already exist.")
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(settings.MEDIA_ROOT, '.derivatives_checkpoint'),
+            help="File recording the last processed student id, so an interrupted run resumes where it stopped.",
+        )
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start from the first student.")
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def write_checkpoint(self, path, last_id):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f'{path}.tmp'
+        with open(partial, 'w') as f:
+            f.write(str(last_id))
+        os.replace(partial, path)
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint']
+        last_id = 0 if options['restart'] else self.read_checkpoint(checkpoint)
+        if last_id:
+            self.stdout.write(f"Resuming after student id {last_id}")
+
+        written = failed = 0
+        students = Student.objects.exclude(photo='').order_by('id')
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            while True:
+                batch = list(students.filter(id__gt=last_id).values_list('id', 'photo')[:options['batch_size']])
+                if not batch:
+                    break
+
+                names = [photo for _, photo in batch]
+                for name, count, error in pool.map(_generate, names, [options['force']] * len(names)):
+                    written += count
+                    if error:
+                        failed += 1
+                        self.stderr.write(f"{name}: {error}")
+
+                # Only move the checkpoint once the whole batch is on disk
+                last_id = batch[-1][0]
+                self.write_checkpoint(checkpoint, last_id)
+                self.stdout.write(f"Processed up to student id {last_id}")
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} derivatives ({failed} photos failed)"))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.imports import InvalidImport, import_students
+from core.models import Institution, Partner
+
+
+class Command(BaseCommand):
+    help = (
+        "Import students for an institution from a CSV/XLSX sheet in the export layout, "
+        "optionally with a ZIP of photos named by Unique ID or sheet row number."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('institution', help="Username of the institution the students belong to.")
+        parser.add_argument('sheet', help="Path to the .csv or .xlsx file.")
+        parser.add_argument('--photos', help="Path to a ZIP of photos.")
+        parser.add_argument('--partner', help="Username of the referring partner, if any.")
+
+    def handle(self, *args, **options):
+        try:
+            institution = Institution.objects.get(user__username=options['institution'])
+        except Institution.DoesNotExist:
+            raise CommandError(f"No institution named {options['institution']}")
+        partner = None
+        if options['partner']:
+            try:
+                partner = Partner.objects.get(user__username=options['partner'])
+            except Partner.DoesNotExist:
+                raise CommandError(f"No partner named {options['partner']}")
+
+        photos = open(options['photos'], 'rb') if options['photos'] else None
+        try:
+            with open(options['sheet'], 'rb') as sheet:
+                result = import_students(institution, sheet, options['sheet'], photos=photos, partner=partner)
+        except InvalidImport as exc:
+            raise CommandError(str(exc))
+        finally:
+            if photos:
+                photos.close()
+
+        if not result.committed:
+            for row in result.rows:
+                for field, messages in row['errors'].items():
+                    self.stderr.write(f"Row {row['row']}: {field}: {' '.join(messages)}")
+            raise CommandError(f"Nothing was imported: {result.failed} rows failed validation")
+        self.stdout.write(self.style.SUCCESS(f"Imported {result.created} students"))
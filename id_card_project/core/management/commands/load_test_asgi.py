@@ -0,0 +1,175 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from core.models import Institution, Partner
+
+VIEWS = ('institution_dashboard', 'partner_dashboard', 'export_data')
+MODES = ('wsgi', 'asgi')
+# Each mode runs with the settings its deployment uses, and so with that deployment's URLconf
+SETTINGS_MODULES = {'wsgi': 'id_card_project.settings', 'asgi': 'id_card_project.settings_asgi'}
+
+
+class Stats:
+    def __init__(self, client_threads=0):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        # Threads that only wait to send a request are the load generator's, not the server's
+        self.client_threads = client_threads
+        self.peak_threads = threading.active_count()
+
+    def add(self, started, ok):
+        with self.lock:
+            if ok:
+                self.latencies.append(time.perf_counter() - started)
+            else:
+                self.errors += 1
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    def report(self, seconds):
+        latencies = sorted(self.latencies) or [0.0]
+        return {
+            'requests': len(self.latencies),
+            'errors': self.errors,
+            'requests_per_second': round(len(self.latencies) / seconds, 1),
+            'p50_ms': round(statistics.median(latencies) * 1000, 3),
+            'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 3),
+            'peak_threads': self.peak_threads - self.client_threads,
+        }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare WSGI and ASGI concurrency for the dashboard and export views against the current "
+        "database (seed it with seed_data). Each mode runs in its own process: WSGI through the sync "
+        "views with a fixed pool of worker threads, ASGI through core.async_views on one event loop, "
+        "both under the same number of concurrent clients."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=10.0, help="Duration of each run.")
+        parser.add_argument('--clients', type=int, default=32, help="Concurrent clients in both modes.")
+        parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads serving those clients.")
+        parser.add_argument('--view', dest='views', action='append', choices=VIEWS, help="Only this view; repeatable.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--worker', choices=MODES, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            return self.run_worker(options)
+
+        report = {'seconds': options['seconds'], 'clients': options['clients'], 'threads': options['threads'], 'views': {}}
+        for view in options['views'] or VIEWS:
+            report['views'][view] = {}
+            for mode in MODES:
+                result = self.spawn(mode, view, options)
+                report['views'][view][mode] = result
+                self.stdout.write(
+                    f"  {view} {mode}: {result['requests_per_second']} req/s, p95 {result['p95_ms']} ms, "
+                    f"{result['errors']} errors, peak {result['peak_threads']} threads"
+                )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+    def spawn(self, mode, view, options):
+        # A fresh process per mode, so neither run warms the other's caches
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': SETTINGS_MODULES[mode]}
+        command = [
+            sys.executable, sys.argv[0], 'load_test_asgi', '--worker', mode, '--view', view,
+            '--seconds', str(options['seconds']), '--clients', str(options['clients']), '--threads', str(options['threads']),
+        ]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(f"The {mode} run failed:\n{completed.stderr}")
+        return json.loads(completed.stdout)
+
+    def requests(self, view):
+        institution = Institution.objects.annotate(students=Count('student')).order_by('-students').first()
+        partner = Partner.objects.annotate(students=Count('student')).order_by('-students').first()
+        if institution is None or partner is None:
+            raise CommandError("Seed an institution and a partner first, e.g. with seed_data")
+        return {
+            'institution_dashboard': (institution.user, reverse('institution_dashboard'), {}),
+            'partner_dashboard': (partner.user, reverse('partner_dashboard'), {}),
+            'export_data': (partner.user, reverse('export_data'), {'format': 'csv'}),
+        }[view]
+
+    def run_worker(self, options):
+        view = options['views'][0]
+        user, path, params = self.requests(view)
+        # Exports stream uncached, so the run measures the archive being built rather than a file copy
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], EXPORT_CACHE_ENABLED=False):
+            if options['worker'] == 'wsgi':
+                stats = self.run_wsgi(user, path, params, options)
+            else:
+                stats = asyncio.run(self.run_asgi(user, path, params, options))
+        self.stdout.write(json.dumps(stats.report(options['seconds'])))
+
+    def run_wsgi(self, user, path, params, options):
+        # Client threads holding the semaphore serve the request, so they count as the server's workers
+        stats = Stats(client_threads=max(options['clients'] - options['threads'], 0))
+        deadline = time.monotonic() + options['seconds']
+        # Clients beyond the worker threads wait for one, as they would in a threaded server's accept queue
+        workers = threading.Semaphore(options['threads'])
+
+        def client_loop():
+            client = Client()
+            client.force_login(user)
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                with workers:
+                    response = client.get(path, params)
+                    ok = response.status_code == 200
+                    if response.streaming:
+                        for _ in response.streaming_content:
+                            pass
+                    response.close()
+                stats.add(started, ok)
+
+        threads = [threading.Thread(target=client_loop) for _ in range(options['clients'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return stats
+
+    async def run_asgi(self, user, path, params, options):
+        stats = Stats()
+        deadline = time.monotonic() + options['seconds']
+
+        async def client_loop():
+            client = AsyncClient()
+            await client.aforce_login(user)
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                response = await client.get(path, params)
+                ok = response.status_code == 200
+                if response.streaming:
+                    if response.is_async:
+                        async for _ in response.streaming_content:
+                            pass
+                    else:
+                        for _ in response.streaming_content:
+                            pass
+                stats.add(started, ok)
+
+        await asyncio.gather(*(client_loop() for _ in range(options['clients'])))
+        return stats
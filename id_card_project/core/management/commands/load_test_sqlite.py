@@ -0,0 +1,135 @@
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+from core.exports import EXPORT_FIELDS, order_by_export_class
+from core.models import Student
+from core.seeding import seed_owners, seed_students, student_rows, use_scratch_database
+
+# (writer OPTIONS, reader OPTIONS): Django's stock SQLite connection versus the tuned profile in settings
+PROFILES = {
+    'baseline': ({}, {}),
+    'tuned': (settings.DATABASES['default']['OPTIONS'], settings.DATABASES['readonly']['OPTIONS']),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent enrollments against concurrent export-sized reads on scratch SQLite files, "
+        "once with Django's default connection and once with the tuned profile, and compare "
+        "lock errors and throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20_000, help="Students seeded before the run.")
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=10.0, help="Duration of each run.")
+        parser.add_argument('--profile', dest='profiles', action='append', choices=PROFILES,
+                            help="Profile to run; repeat for several. Both by default.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+
+    def setup(self, profile, directory, options):
+        writer_options, reader_options = PROFILES[profile]
+        path = os.path.join(directory, f'{profile}.sqlite3')
+        writer, reader = f'load_{profile}', f'load_{profile}_read'
+        use_scratch_database(writer, path, OPTIONS=dict(writer_options))
+        use_scratch_database(reader, path, migrate=False, OPTIONS=dict(reader_options))
+
+        institution_ids, partner_ids = seed_owners(5, 2, prefix='load', using=writer)
+        seed_students(student_rows(options['rows'], institution_ids, partner_ids), using=writer)
+        return writer, reader, institution_ids[0]
+
+    def run(self, writer, reader, institution_id, options):
+        deadline = time.monotonic() + options['seconds']
+        lock = threading.Lock()
+        results = {'writes': 0, 'lock_errors': 0, 'other_errors': 0, 'reads': 0, 'write_latencies': []}
+
+        def count(key, value=1):
+            with lock:
+                results[key] += value
+
+        def write(worker):
+            n = 0
+            try:
+                while time.monotonic() < deadline:
+                    n += 1
+                    student = Student(
+                        student_name=f'Load {worker}-{n}', father_name='Father', class_name='1',
+                        village='Village', mobile_number='9999999999', unique_id=f'L{worker}-{n}',
+                        institution_id=institution_id,
+                    )
+                    started = time.perf_counter()
+                    try:
+                        # Read then write, like an enrollment checking the counter first; bulk_create
+                        # skips the ID allocator and signals, which use the default database
+                        with transaction.atomic(using=writer):
+                            Student.objects.using(writer).filter(mobile_number=student.mobile_number).exists()
+                            Student.objects.using(writer).bulk_create([student])
+                    except OperationalError as exc:
+                        count('lock_errors' if 'locked' in str(exc) else 'other_errors')
+                        continue
+                    with lock:
+                        results['writes'] += 1
+                        results['write_latencies'].append(time.perf_counter() - started)
+            finally:
+                connections[writer].close()
+
+        def read():
+            try:
+                while time.monotonic() < deadline:
+                    students = order_by_export_class(Student.objects.using(reader)).values_list(*EXPORT_FIELDS)
+                    try:
+                        for _ in students.iterator(chunk_size=500):
+                            pass
+                    except OperationalError as exc:
+                        count('lock_errors' if 'locked' in str(exc) else 'other_errors')
+                        continue
+                    count('reads')
+            finally:
+                connections[reader].close()
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(options['writers'])]
+        threads += [threading.Thread(target=read) for _ in range(options['readers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        latencies = sorted(results.pop('write_latencies')) or [0.0]
+        results.update({
+            'writes_per_second': round(results['writes'] / options['seconds'], 1),
+            'reads_per_second': round(results['reads'] / options['seconds'], 2),
+            'write_p50_ms': round(statistics.median(latencies) * 1000, 3),
+            'write_p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 3),
+        })
+        return results
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp()
+        report = {
+            'rows': options['rows'], 'writers': options['writers'], 'readers': options['readers'],
+            'seconds': options['seconds'], 'profiles': {},
+        }
+        for profile in options['profiles'] or PROFILES:
+            writer, reader, institution_id = self.setup(profile, directory, options)
+            result = self.run(writer, reader, institution_id, options)
+            report['profiles'][profile] = result
+            self.stdout.write(
+                f"  {profile}: {result['writes_per_second']} writes/s, {result['reads_per_second']} reads/s, "
+                f"{result['lock_errors']} lock errors, write p95 {result['write_p95_ms']} ms"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,69 @@
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.export_cache import mark_students_stale
+from core.fragments import bump_student_versions
+from core.models import Student
+from core.photos import release_photo
+from core.storage import is_hashed_name
+from core.thumbnails import generate_derivatives
+
+
+class Command(BaseCommand):
+    help = "Move existing student photos into the content-addressed, sharded layout while the site keeps running."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many photos would move.")
+
+    def handle(self, *args, **options):
+        storage = Student._meta.get_field('photo').storage
+        students = Student.objects.exclude(photo='').order_by('id')
+        moved = skipped = missing = 0
+        last_id = 0
+
+        while True:
+            batch = list(students.filter(id__gt=last_id).values_list('id', 'photo')[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            for pk, old_name in batch:
+                if is_hashed_name(old_name):
+                    skipped += 1
+                    continue
+                if not storage.exists(old_name):
+                    missing += 1
+                    self.stderr.write(f"Student {pk}: {old_name} is missing")
+                    continue
+                if options['dry_run']:
+                    moved += 1
+                    continue
+
+                # Write the new copy first; the old file stays readable until the row points elsewhere
+                with storage.open(old_name, 'rb') as f:
+                    content = ContentFile(f.read(), name=old_name)
+                new_name = storage.save(old_name, content)
+
+                # The transaction takes the write lock, ordering the swap against release_photo(): a release
+                # of the new name that ran since the save deleted a file no row used yet, so it is written
+                # again, derivatives included; one that runs later counts this row. Only rows that still
+                # reference the old file are swapped, so concurrent edits win.
+                with transaction.atomic():
+                    if Student.objects.select_for_update().filter(pk=pk, photo=old_name).exists():
+                        if not storage.exists(new_name):
+                            storage.save_as(new_name, content)
+                        generate_derivatives(new_name, storage)
+                        Student.objects.filter(pk=pk).update(photo=new_name, updated_at=timezone.now())
+                        moved += 1
+                        mark_students_stale(Student.objects.filter(pk=pk).values_list('class_name', 'other_class', 'partner_id'))
+                        bump_student_versions(Student.objects.filter(pk=pk).values_list('institution_id', 'partner_id'))
+                release_photo(old_name)
+                release_photo(new_name)
+
+        verb = "Would move" if options['dry_run'] else "Moved"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {moved} photos ({skipped} already migrated, {missing} missing)"
+        ))
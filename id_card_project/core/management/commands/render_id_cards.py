@@ -0,0 +1,42 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.cards import card_class_filter, card_queryset, render_cards, write_sheets
+from core.models import Institution, Student
+
+
+class Command(BaseCommand):
+    help = "Render ID cards for an institution (optionally one class) into a multi-up PDF."
+
+    def add_arguments(self, parser):
+        parser.add_argument('institution', help="Username of the institution.")
+        parser.add_argument('output', help="Path of the PDF to write.")
+        parser.add_argument('--class-name', help="Only render this class.")
+        parser.add_argument('--workers', type=int, default=settings.CARD_RENDER_WORKERS, help="Size of the process pool; 1 renders in this process.")
+
+    def handle(self, *args, **options):
+        try:
+            institution = Institution.objects.get(user__username=options['institution'])
+        except Institution.DoesNotExist:
+            raise CommandError(f"No institution named {options['institution']}")
+
+        students = Student.objects.filter(institution=institution)
+        if options['class_name']:
+            students = students.filter(card_class_filter(options['class_name']))
+
+        if options['workers'] == 1:
+            paths, rendered = render_cards(card_queryset(students))
+        else:
+            # Spawned rather than forked: a child forked from this process would inherit its open database connection
+            with ProcessPoolExecutor(
+                max_workers=options['workers'], mp_context=multiprocessing.get_context('spawn'), initializer=django.setup,
+            ) as pool:
+                paths, rendered = render_cards(card_queryset(students), executor=pool)
+        write_sheets(paths, options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(paths)} cards to {options['output']} ({rendered} rendered, {len(paths) - rendered} from cache)"
+        ))
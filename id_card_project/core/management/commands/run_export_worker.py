@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.export_jobs import claim_next_job, purge_expired_jobs, run_export_job
+
+
+class Command(BaseCommand):
+    help = "Process queued export jobs, write their archives to EXPORT_JOB_ROOT and remove expired ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit instead of polling.")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to sleep when the queue is empty.")
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job()
+            if job is None:
+                # Idle: drop archives past EXPORT_JOB_RETENTION_SECONDS before waiting for more work
+                purged = purge_expired_jobs()
+                if purged:
+                    self.stdout.write(f"Removed {purged} expired export jobs")
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f"Running export job {job.pk} ({job.owner_key}, {job.export_format})")
+            job = run_export_job(job)
+            self.stdout.write(f"Export job {job.pk} finished: {job.status}")
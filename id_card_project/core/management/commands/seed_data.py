@@ -0,0 +1,59 @@
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+
+from core.export_cache import mark_students_stale
+from core.fragments import bump_student_versions
+from core.models import IdCounter, Student, User
+from core.seeding import seed_owners, seed_students, student_rows, sync_student_counter, synthetic_photos
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed institutions, partners and students in every class, with synthetic photos, "
+        "for benchmarking and load testing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--institutions', type=int, default=20)
+        parser.add_argument('--partners', type=int, default=5)
+        parser.add_argument('--students', type=int, default=10_000)
+        parser.add_argument('--photos', type=int, default=100,
+                            help="Distinct photos shared round-robin by the students; 0 for none.")
+        parser.add_argument('--prefix', default='seed', help="Username prefix of the seeded accounts.")
+        parser.add_argument('--password', default='password', help="Password of the seeded accounts.")
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using, prefix = options['database'], options['prefix']
+        if User.objects.using(using).filter(username__startswith=f'{prefix}_').exists():
+            raise CommandError(f"Accounts prefixed {prefix}_ already exist; pick another --prefix")
+        started = time.perf_counter()
+
+        institution_ids, partner_ids = seed_owners(options['institutions'], options['partners'], prefix=prefix, using=using)
+        # One hash shared by every seeded account; hashing per user would dominate small runs
+        User.objects.using(using).filter(pk__in=institution_ids + partner_ids).update(
+            password=make_password(options['password'])
+        )
+
+        photos = synthetic_photos(options['photos']) if options['photos'] else []
+        counter = IdCounter.objects.using(using).filter(name='student').aggregate(value=Max('value'))['value'] or 0
+        first_number = counter + 1
+        rows = student_rows(
+            options['students'], institution_ids, partner_ids, first_number=first_number,
+            photo=(lambda n: photos[n % len(photos)]) if photos else None,
+        )
+        seed_students(rows, using=using)
+        sync_student_counter(first_number + options['students'] - 1, using=using)
+
+        # Raw inserts send no signals, so flag every cached export and dashboard the new rows belong to
+        mark_students_stale(
+            Student.objects.using(using).values_list('class_name', 'other_class', 'partner_id').distinct()
+        )
+        bump_student_versions(Student.objects.using(using).values_list('institution_id', 'partner_id').distinct())
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {options['institutions']} institutions, {options['partners']} partners and "
+            f"{options['students']} students with {len(photos)} photos in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,83 @@
+import mimetypes
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from .http import ranged_file_response
+from .models import Student
+from .storage import is_hashed_name
+from .thumbnails import DERIVATIVE_SIZES, DERIVATIVE_VERSION
+
+DERIVATIVE_RE = re.compile(r'^(?P<stem>.+)_(?:%s)\.jpg$' % '|'.join(map(re.escape, DERIVATIVE_SIZES)))
+MEDIA_CACHE_MAX_AGE = getattr(settings, 'MEDIA_CACHE_MAX_AGE', 365 * 24 * 60 * 60)
+
+
+def visible_students(user):
+    """The students whose photos ``user`` may see: the same ones their dashboard or the admin shows."""
+    if user.role == 'ADMIN' or user.has_perm('core.view_student'):
+        return Student.objects.all()
+    if user.role == 'INSTITUTION':
+        return Student.objects.filter(institution=user.institution)
+    if user.role == 'PARTNER':
+        return Student.objects.filter(partner=user.partner)
+    return Student.objects.none()
+
+
+def photo_filter(name):
+    """Match students whose photo is ``name``, or the original that ``name`` is a derivative of.
+
+    The original keeps its own extension, so it is found with a range on the
+    indexed photo column: every ``<stem>.<ext>`` sorts from ``<stem>.`` to
+    just before ``<stem>/``.
+    """
+    match = Q(photo=name)
+    derivative = DERIVATIVE_RE.match(name)
+    if derivative:
+        stem = derivative['stem']
+        match |= Q(photo__gte=f'{stem}.', photo__lt=f'{stem}/')
+    return match
+
+
+def is_fingerprinted(name, version=None):
+    """Whether the URL for ``name`` changes whenever its content does, so it may be cached for good."""
+    derivative = DERIVATIVE_RE.match(name)
+    if derivative:
+        return is_hashed_name(f"{derivative['stem']}.jpg") and version == DERIVATIVE_VERSION
+    return is_hashed_name(name)
+
+
+def media_response(request, name):
+    """Serve the stored photo ``name``, through the front-end server when one is configured.
+
+    ``MEDIA_SENDFILE_BACKEND`` set to ``'x-accel-redirect'`` (nginx) or
+    ``'x-sendfile'`` (Apache, lighttpd) answers with only a header naming
+    the file, and the server sends it along with Range and conditional
+    handling. Otherwise Django streams it with the same support.
+    """
+    storage = Student._meta.get_field('photo').storage
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    backend = getattr(settings, 'MEDIA_SENDFILE_BACKEND', None)
+
+    if backend == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(name)
+    elif backend == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = storage.path(name)
+    else:
+        try:
+            response = ranged_file_response(request, storage.path(name), content_type)
+        except FileNotFoundError:
+            raise Http404(name)
+
+    # Private: an authorized response must never be stored by a shared cache
+    if is_fingerprinted(name, request.GET.get('v')):
+        patch_cache_control(response, private=True, max_age=MEDIA_CACHE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
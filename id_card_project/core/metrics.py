@@ -0,0 +1,268 @@
+import bisect
+import collections
+import contextlib
+import logging
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .fragments import fragment_stats
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SLOW_REQUEST_FINGERPRINTS = 5
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE_RE = re.compile(r'\s+')
+
+_recorder = ContextVar('query_recorder', default=None)
+
+
+def fingerprint(sql):
+    """Reduce ``sql`` to its shape, so the same query with other values groups together."""
+    sql = _STRING_RE.sub('?', sql.replace('%s', '?'))
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _PLACEHOLDER_LIST_RE.sub('(...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """Counts and times the queries run while ``recording()`` is active.
+
+    The hook is installed once on every connection and finds the active
+    recorder through a context variable, so queries the async ORM runs in
+    its worker threads are counted along with the request thread's own.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = collections.Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @contextlib.contextmanager
+    def recording(self):
+        for connection in connections.all(initialized_only=True):
+            _install_query_hook(connection)
+        token = _recorder.set(self)
+        try:
+            yield
+        finally:
+            _recorder.reset(token)
+
+
+def _record_query(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def _install_query_hook(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        # First in line, so wrappers pushed and popped by execute_wrapper() blocks leave it alone
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+class RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.duration = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.queries = 0
+        self.db_duration = 0.0
+        self.response_bytes = 0
+        self.streamed = 0
+        self.first_byte = 0.0
+
+
+class MetricsRegistry:
+    """Per-process request metrics keyed by URL name, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = collections.defaultdict(RouteStats)
+
+    def record(self, route, duration, queries, db_duration, response_bytes, first_byte=None):
+        with self._lock:
+            stats = self._routes[route]
+            stats.requests += 1
+            stats.duration += duration
+            index = bisect.bisect_left(DURATION_BUCKETS, duration)
+            if index < len(stats.buckets):
+                stats.buckets[index] += 1
+            stats.queries += queries
+            stats.db_duration += db_duration
+            stats.response_bytes += response_bytes
+            if first_byte is not None:
+                stats.streamed += 1
+                stats.first_byte += first_byte
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {route: vars(stats).copy() | {'buckets': list(stats.buckets)} for route, stats in self._routes.items()}
+
+    def render(self):
+        routes = sorted(self.snapshot().items())
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        family('idcard_request_duration_seconds', 'histogram', 'Wall time of requests, by URL name.')
+        for route, stats in routes:
+            label = _label(route)
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, stats['buckets']):
+                cumulative += count
+                lines.append(f'idcard_request_duration_seconds_bucket{{route="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'idcard_request_duration_seconds_bucket{{route="{label}",le="+Inf"}} {stats["requests"]}')
+            lines.append(f'idcard_request_duration_seconds_sum{{route="{label}"}} {stats["duration"]:.6f}')
+            lines.append(f'idcard_request_duration_seconds_count{{route="{label}"}} {stats["requests"]}')
+
+        for name, key, help_text in (
+            ('idcard_db_queries_total', 'queries', 'Database queries run while serving requests, by URL name.'),
+            ('idcard_db_duration_seconds_total', 'db_duration', 'Time spent in database queries, by URL name.'),
+            ('idcard_response_bytes_total', 'response_bytes', 'Response body bytes sent, by URL name.'),
+        ):
+            family(name, 'counter', help_text)
+            for route, stats in routes:
+                value = f'{stats[key]:.6f}' if isinstance(stats[key], float) else stats[key]
+                lines.append(f'{name}{{route="{_label(route)}"}} {value}')
+
+        family('idcard_time_to_first_byte_seconds', 'summary', 'Time until the first chunk of streamed responses, by URL name.')
+        for route, stats in routes:
+            if stats['streamed']:
+                lines.append(f'idcard_time_to_first_byte_seconds_sum{{route="{_label(route)}"}} {stats["first_byte"]:.6f}')
+                lines.append(f'idcard_time_to_first_byte_seconds_count{{route="{_label(route)}"}} {stats["streamed"]}')
+
+        for name, kind, help_text, value in (
+            ('idcard_fragment_cache_hits_total', 'counter', 'Dashboard fragments served from the cache.', fragment_stats.hits),
+            ('idcard_fragment_cache_misses_total', 'counter', 'Dashboard fragments rendered and cached.', fragment_stats.misses),
+            ('idcard_fragment_cache_hit_ratio', 'gauge', 'Share of dashboard fragments served from the cache.', f'{fragment_stats.hit_ratio:.4f}'),
+            ('idcard_fragment_render_seconds_total', 'counter', 'Time spent rendering dashboard fragments on misses.', f'{fragment_stats.render_seconds:.6f}'),
+            ('idcard_fragment_saved_seconds_total', 'counter', 'Render time saved by fragment cache hits.', f'{fragment_stats.saved_seconds:.6f}'),
+        ):
+            family(name, kind, help_text)
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+class PerformanceMetricsMiddleware:
+    """Record wall time, queries, DB time, response size and streamed time to first byte per URL name.
+
+    Streamed responses are measured until their last chunk is sent, including
+    the queries run while iterating. Requests slower than
+    ``METRICS_SLOW_REQUEST_MS`` are logged with their most frequent query
+    fingerprints.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with recorder.recording():
+            response = self.get_response(request)
+        return self._measure(request, response, recorder, started)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with recorder.recording():
+            response = await self.get_response(request)
+        return self._measure(request, response, recorder, started)
+
+    def _measure(self, request, response, recorder, started):
+        route = request.resolver_match.view_name if request.resolver_match else 'unmatched'
+        # File responses go out through the server's file wrapper; wrapping them would defeat sendfile
+        if response.streaming and not getattr(response, 'file_to_stream', None):
+            measure = self._ameasure_stream if response.is_async else self._measure_stream
+            response.streaming_content = measure(response.streaming_content, route, recorder, started)
+        else:
+            size = int(response.get('Content-Length') or 0) if response.streaming else len(response.content)
+            self._finish(route, recorder, started, size)
+        return response
+
+    def _measure_stream(self, content, route, recorder, started):
+        first_byte = None
+        size = 0
+        iterator = iter(content)
+        try:
+            while True:
+                with recorder.recording():
+                    chunk = next(iterator, None)
+                if chunk is None:
+                    break
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+                size += len(chunk)
+                yield chunk
+        finally:
+            self._finish(route, recorder, started, size, first_byte=first_byte or 0.0)
+
+    async def _ameasure_stream(self, content, route, recorder, started):
+        first_byte = None
+        size = 0
+        iterator = aiter(content)
+        try:
+            while True:
+                with recorder.recording():
+                    chunk = await anext(iterator, None)
+                if chunk is None:
+                    break
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+                size += len(chunk)
+                yield chunk
+        finally:
+            self._finish(route, recorder, started, size, first_byte=first_byte or 0.0)
+
+    def _finish(self, route, recorder, started, size, first_byte=None):
+        duration = time.perf_counter() - started
+        registry.record(route, duration, recorder.count, recorder.duration, size, first_byte)
+        if duration * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+            top = '; '.join(f'{count}x {sql}' for sql, count in recorder.fingerprints.most_common(SLOW_REQUEST_FINGERPRINTS))
+            logger.warning(
+                "Slow request to %s: %.0f ms, %d queries in %.0f ms. Top queries: %s",
+                route, duration * 1000, recorder.count, recorder.duration * 1000, top or 'none',
+            )
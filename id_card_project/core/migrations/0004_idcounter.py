@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 02:46
+
+from django.db import migrations, models
+
+
+def seed_student_counter(apps, schema_editor):
+    Student = apps.get_model("core", "Student")
+    IdCounter = apps.get_model("core", "IdCounter")
+    db_alias = schema_editor.connection.alias
+
+    # Compare numerically: "S10000" sorts before "S9999" as a string
+    highest = 0
+    for unique_id in (
+        Student.objects.using(db_alias).values_list("unique_id", flat=True).iterator()
+    ):
+        if unique_id[1:].isdigit():
+            highest = max(highest, int(unique_id[1:]))
+    IdCounter.objects.using(db_alias).update_or_create(
+        name="student", defaults={"value": highest}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_exportjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IdCounter",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=50, primary_key=True, serialize=False),
+                ),
+                ("value", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_student_counter, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 02:53
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_idcounter"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="student",
+            name="photo",
+            field=models.ImageField(
+                db_index=True,
+                storage=core.storage.get_photo_storage,
+                upload_to="student_photos/",
+            ),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-18 03:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_content_addressed_photos"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="student",
+            name="institution",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="core.institution",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="student",
+            name="partner",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="core.partner",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="student",
+            index=models.Index(
+                fields=["institution", "class_name", "id"],
+                name="student_inst_class_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="student",
+            index=models.Index(
+                fields=["partner", "class_name", "id"], name="student_partner_class_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="student",
+            index=models.Index(fields=["mobile_number"], name="student_mobile_idx"),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 03:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_student_access_path_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExportSegment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("owner_key", models.CharField(max_length=50)),
+                ("export_format", models.CharField(max_length=10)),
+                ("export_class", models.CharField(max_length=100)),
+                ("stale", models.BooleanField(default=True)),
+                ("rows", models.PositiveIntegerField(default=0)),
+                ("built_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("owner_key", "export_format", "export_class"),
+                        name="exportsegment_unique_segment",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:10
+
+from django.db import migrations
+
+# An external-content FTS5 index over core_student, kept in sync by triggers so raw and bulk
+# inserts are indexed too. The prefix option keeps short "as-you-type" prefixes cheap.
+CREATE_SEARCH_SQL = [
+    """
+    CREATE VIRTUAL TABLE core_student_search USING fts5(
+        student_name, father_name, village, mobile_number, unique_id,
+        content='core_student', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER core_student_search_insert AFTER INSERT ON core_student BEGIN
+        INSERT INTO core_student_search(rowid, student_name, father_name, village, mobile_number, unique_id)
+        VALUES (new.id, new.student_name, new.father_name, new.village, new.mobile_number, new.unique_id);
+    END
+    """,
+    """
+    CREATE TRIGGER core_student_search_delete AFTER DELETE ON core_student BEGIN
+        INSERT INTO core_student_search(core_student_search, rowid, student_name, father_name, village, mobile_number, unique_id)
+        VALUES ('delete', old.id, old.student_name, old.father_name, old.village, old.mobile_number, old.unique_id);
+    END
+    """,
+    """
+    CREATE TRIGGER core_student_search_update
+    AFTER UPDATE OF student_name, father_name, village, mobile_number, unique_id ON core_student BEGIN
+        INSERT INTO core_student_search(core_student_search, rowid, student_name, father_name, village, mobile_number, unique_id)
+        VALUES ('delete', old.id, old.student_name, old.father_name, old.village, old.mobile_number, old.unique_id);
+        INSERT INTO core_student_search(rowid, student_name, father_name, village, mobile_number, unique_id)
+        VALUES (new.id, new.student_name, new.father_name, new.village, new.mobile_number, new.unique_id);
+    END
+    """,
+    "INSERT INTO core_student_search(core_student_search) VALUES ('rebuild')",
+]
+
+DROP_SEARCH_SQL = [
+    "DROP TRIGGER IF EXISTS core_student_search_update",
+    "DROP TRIGGER IF EXISTS core_student_search_delete",
+    "DROP TRIGGER IF EXISTS core_student_search_insert",
+    "DROP TABLE IF EXISTS core_student_search",
+]
+
+
+def run_on_sqlite(statements):
+    def run(apps, schema_editor):
+        # Other backends fall back to icontains in core.search
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_exportsegment"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_on_sqlite(CREATE_SEARCH_SQL), run_on_sqlite(DROP_SEARCH_SQL)
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:35
+
+from django.db import migrations, models
+
+# Adding updated_at makes SQLite rebuild core_student, which drops the search index triggers
+# from 0008_student_search; the FTS5 table itself keeps its rows, so only the triggers return.
+SEARCH_TRIGGERS_SQL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS core_student_search_insert AFTER INSERT ON core_student BEGIN
+        INSERT INTO core_student_search(rowid, student_name, father_name, village, mobile_number, unique_id)
+        VALUES (new.id, new.student_name, new.father_name, new.village, new.mobile_number, new.unique_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_student_search_delete AFTER DELETE ON core_student BEGIN
+        INSERT INTO core_student_search(core_student_search, rowid, student_name, father_name, village, mobile_number, unique_id)
+        VALUES ('delete', old.id, old.student_name, old.father_name, old.village, old.mobile_number, old.unique_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_student_search_update
+    AFTER UPDATE OF student_name, father_name, village, mobile_number, unique_id ON core_student BEGIN
+        INSERT INTO core_student_search(core_student_search, rowid, student_name, father_name, village, mobile_number, unique_id)
+        VALUES ('delete', old.id, old.student_name, old.father_name, old.village, old.mobile_number, old.unique_id);
+        INSERT INTO core_student_search(rowid, student_name, father_name, village, mobile_number, unique_id)
+        VALUES (new.id, new.student_name, new.father_name, new.village, new.mobile_number, new.unique_id);
+    END
+    """,
+]
+
+
+def restore_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in SEARCH_TRIGGERS_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_student_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StudentTombstone",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("student_id", models.BigIntegerField()),
+                ("unique_id", models.CharField(max_length=10)),
+                ("institution_id", models.BigIntegerField(blank=True, null=True)),
+                ("partner_id", models.BigIntegerField(blank=True, null=True)),
+                ("deleted_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        # Unapplying the field rebuilds the table again; restore the triggers after that too
+        migrations.RunPython(migrations.RunPython.noop, restore_search_triggers),
+        migrations.AddField(
+            model_name="student",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="student",
+            index=models.Index(
+                fields=["institution", "updated_at", "id"],
+                name="student_inst_updated_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="student",
+            index=models.Index(
+                fields=["partner", "updated_at", "id"],
+                name="student_partner_updated_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="studenttombstone",
+            index=models.Index(
+                fields=["institution_id", "id"], name="tombstone_inst_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="studenttombstone",
+            index=models.Index(
+                fields=["partner_id", "id"], name="tombstone_partner_idx"
+            ),
+        ),
+    ]
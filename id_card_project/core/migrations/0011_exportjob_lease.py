@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:42
+
+from django.db import migrations, models
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    ExportJob = apps.get_model("core", "ExportJob")
+    db_alias = schema_editor.connection.alias
+
+    # Keep the oldest active job per owner and format, the one enqueue_export handed out
+    seen = set()
+    active = ExportJob.objects.using(db_alias).filter(status__in=("PENDING", "RUNNING"))
+    for job in active.order_by("created_at", "id"):
+        key = (job.owner_key, job.export_format)
+        if key in seen:
+            job.status = "FAILED"
+            job.error = "Superseded by an identical export."
+            job.save(update_fields=["status", "error"])
+        seen.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0010_enrollmentreceipt"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="exportjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="exportjob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status__in", ("PENDING", "RUNNING"))),
+                fields=("owner_key", "export_format"),
+                name="exportjob_one_active",
+            ),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:12
+
+import uuid
+
+from django.db import migrations, models
+
+
+def issue_api_tokens(apps, schema_editor):
+    Institution = apps.get_model("core", "Institution")
+    db_alias = schema_editor.connection.alias
+    for institution in Institution.objects.using(db_alias).only("pk"):
+        institution.api_token = uuid.uuid4()
+        institution.save(update_fields=["api_token"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0012_dataversion"),
+    ]
+
+    operations = [
+        # Added nullable first: a single default would give every existing institution the same token
+        migrations.AddField(
+            model_name="institution",
+            name="api_token",
+            field=models.UUIDField(null=True, editable=False),
+        ),
+        migrations.RunPython(issue_api_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="institution",
+            name="api_token",
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0013_institution_api_token"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="enrollmentreceipt",
+            name="payload_digest",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+def fill_lookup_names(apps, schema_editor):
+    Institution = apps.get_model("core", "Institution")
+    db_alias = schema_editor.connection.alias
+    for institution in Institution.objects.using(db_alias).select_related("user"):
+        institution.lookup_name = institution.user.username.lower()
+        institution.save(update_fields=["lookup_name"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0014_enrollmentreceipt_payload_digest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="institution",
+            name="lookup_name",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=150
+            ),
+        ),
+        migrations.RunPython(fill_lookup_names, migrations.RunPython.noop),
+    ]
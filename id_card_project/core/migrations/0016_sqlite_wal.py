@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def set_journal_mode(mode):
+    def run(apps, schema_editor):
+        connection = schema_editor.connection
+        # The journal mode is stored in the database file, so it is switched once here rather than on
+        # every connection; an in-memory database has no file and keeps its own mode
+        if connection.vendor == "sqlite" and not connection.is_in_memory_db():
+            with connection.cursor() as cursor:
+                cursor.execute(f"PRAGMA journal_mode={mode}")
+
+    return run
+
+
+use_wal = set_journal_mode("WAL")
+use_rollback_journal = set_journal_mode("DELETE")
+
+
+class Migration(migrations.Migration):
+    # SQLite cannot change the journal mode inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("core", "0015_institution_lookup_name"),
+    ]
+
+    operations = [
+        migrations.RunPython(use_wal, use_rollback_journal),
+    ]
@@ -1,6 +1,11 @@
+import logging
 import uuid
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from .storage import get_photo_storage
+from .thumbnails import derivative_url, generate_derivatives
+
+logger = logging.getLogger(__name__)
 
 class User(AbstractUser):
     ROLE_CHOICES = (
@@ -19,10 +24,22 @@ class Partner(models.Model):
 
 class Institution(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="institution")
+    # Sent by enrollment devices as "Authorization: Token <api_token>"
+    api_token = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    # The username lowercased, so a name lookup in any case is one range on this index
+    lookup_name = models.CharField(max_length=150, db_index=True, editable=False, default='')
 
     def __str__(self):
         return self.user.username
 
+    @staticmethod
+    def normalize_name(name):
+        return name.lower()
+
+    def save(self, *args, **kwargs):
+        self.lookup_name = self.normalize_name(self.user.username)
+        super().save(*args, **kwargs)
+
 class Student(models.Model):
     CLASS_CHOICES = (
         ('Nursery', 'Nursery'),
@@ -46,21 +63,161 @@ class Student(models.Model):
     other_class = models.CharField(max_length=100, blank=True, null=True)
     village = models.CharField(max_length=100)
     mobile_number = models.CharField(max_length=15)
-    photo = models.ImageField(upload_to='student_photos/')
-    institution = models.ForeignKey(Institution, on_delete=models.CASCADE)
-    partner = models.ForeignKey(Partner, on_delete=models.SET_NULL, null=True, blank=True)
+    photo = models.ImageField(upload_to='student_photos/', storage=get_photo_storage, db_index=True)
+    # The composite indexes below start with these columns, so the FKs don't need their own
+    institution = models.ForeignKey(Institution, on_delete=models.CASCADE, db_index=False)
+    partner = models.ForeignKey(Partner, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
     unique_id = models.CharField(max_length=10, unique=True, editable=False)
+    # Not set by QuerySet.update(); pass updated_at=timezone.now() there so delta syncs see the change
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Dashboards and exports filter by owner and walk (class_name, id)
+            models.Index(fields=['institution', 'class_name', 'id'], name='student_inst_class_idx'),
+            models.Index(fields=['partner', 'class_name', 'id'], name='student_partner_class_idx'),
+            # Delta syncs walk an owner's changes by (updated_at, id)
+            models.Index(fields=['institution', 'updated_at', 'id'], name='student_inst_updated_idx'),
+            models.Index(fields=['partner', 'updated_at', 'id'], name='student_partner_updated_idx'),
+            # Duplicate checks by phone number
+            models.Index(fields=['mobile_number'], name='student_mobile_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so signal handlers can see what a save changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
 
     def save(self, *args, **kwargs):
         if not self.unique_id:
-            last_student = Student.objects.order_by('id').last()
-            if last_student and last_student.unique_id:
-                last_id = int(last_student.unique_id[1:])
-                new_id = last_id + 1
-                self.unique_id = f'S{new_id:04d}'
-            else:
-                self.unique_id = 'S0001'
+            from .ids import allocate_student_ids
+            self.unique_id = allocate_student_ids(1)[0]
+        from .photos import pending_photos, restore_photos
+        pending = pending_photos([self])
         super().save(*args, **kwargs)
+        restore_photos(pending)
+        if pending:
+            try:
+                generate_derivatives(self.photo.name, self.photo.storage)
+            except OSError:
+                logger.warning("Could not generate derivatives for %s", self.photo.name, exc_info=True)
+
+    def photo_derivative_url(self, size):
+        return derivative_url(self.photo.name, size, self.photo.storage)
+
+    @property
+    def thumbnail_url(self):
+        return self.photo_derivative_url('thumb')
 
     def __str__(self):
         return self.student_name
+
+class ExportJob(models.Model):
+    STATUS_CHOICES = (
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+    ACTIVE_STATUSES = ('PENDING', 'RUNNING')
+
+    requested_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="export_jobs")
+    owner_key = models.CharField(max_length=50)
+    export_format = models.CharField(max_length=10)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    file_name = models.CharField(max_length=255, blank=True)
+    file_size = models.BigIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Renewed by the worker while it builds; a RUNNING job whose heartbeat lapses has lost its worker
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='exportjob_queue_idx'),
+            models.Index(fields=['owner_key', 'export_format', 'status'], name='exportjob_dedup_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner_key', 'export_format'],
+                condition=models.Q(status__in=('PENDING', 'RUNNING')),
+                name='exportjob_one_active',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.owner_key} {self.export_format} ({self.status})'
+
+class DataVersion(models.Model):
+    """Per-owner data version, bumped whenever that owner's students change.
+
+    Kept in the database rather than the cache, so every worker process
+    agrees on it and an ETag or cache key built from it is never stale.
+    """
+    key = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.key} v{self.version}'
+
+class IdCounter(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name}={self.value}'
+
+class ExportSegment(models.Model):
+    owner_key = models.CharField(max_length=50)
+    export_format = models.CharField(max_length=10)
+    export_class = models.CharField(max_length=100)
+    stale = models.BooleanField(default=True)
+    rows = models.PositiveIntegerField(default=0)
+    built_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner_key', 'export_format', 'export_class'], name='exportsegment_unique_segment'),
+        ]
+
+    def __str__(self):
+        return f'{self.owner_key} {self.export_format} {self.export_class}'
+
+class StudentTombstone(models.Model):
+    # Plain ids rather than foreign keys: the tombstone outlives the student and may outlive its owners
+    student_id = models.BigIntegerField()
+    unique_id = models.CharField(max_length=10)
+    institution_id = models.BigIntegerField(null=True, blank=True)
+    partner_id = models.BigIntegerField(null=True, blank=True)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['institution_id', 'id'], name='tombstone_inst_idx'),
+            models.Index(fields=['partner_id', 'id'], name='tombstone_partner_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.unique_id} removed {self.deleted_at:%Y-%m-%d %H:%M}'
+
+class EnrollmentReceipt(models.Model):
+    # One row per accepted batch-enrollment record, so a retried upload returns the same student
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=64)
+    student = models.ForeignKey(Student, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    unique_id = models.CharField(max_length=10)
+    # SHA-256 of the record's fields: a retry matches it, another record sent under the same key does not
+    payload_digest = models.CharField(max_length=64, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='enrollmentreceipt_unique_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.scope} {self.key} -> {self.unique_id}'
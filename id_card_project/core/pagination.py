@@ -0,0 +1,145 @@
+import base64
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values, direction):
+    payload = json.dumps({'k': values, 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return payload['k'], payload['d']
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, previous_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class KeysetPaginator:
+    """Cursor pagination over an ordered tuple of columns, ending in a unique one.
+
+    Each page is a single indexed range query, so the cost does not grow
+    with how deep into the table the client has paged.
+    """
+
+    def __init__(self, queryset, ordering=('id',), per_page=50):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+
+    def _key(self, item):
+        if isinstance(item, dict):
+            return [item[field] for field in self.ordering]
+        return [getattr(item, field) for field in self.ordering]
+
+    def _cursor_values(self, values, cursor):
+        """Convert decoded cursor ``values`` to the ordering columns' types, or raise ``InvalidCursor``."""
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidCursor(cursor)
+        converted = []
+        for field, value in zip(self.ordering, values):
+            if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+                raise InvalidCursor(cursor)
+            try:
+                value = self.queryset.model._meta.get_field(field).to_python(value)
+            except FieldDoesNotExist:
+                pass
+            except ValidationError:
+                raise InvalidCursor(cursor)
+            converted.append(value)
+        return converted
+
+    def _after(self, values, reverse=False):
+        lookup = 'lt' if reverse else 'gt'
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            equal = {f: v for f, v in zip(self.ordering[:i], values[:i])}
+            condition |= Q(**equal, **{f'{field}__{lookup}': values[i]})
+        return condition
+
+    def _page_query(self, cursor):
+        direction = 'next'
+        queryset = self.queryset
+        if cursor:
+            values, direction = decode_cursor(cursor)
+            if direction not in ('next', 'prev'):
+                raise InvalidCursor(cursor)
+            values = self._cursor_values(values, cursor)
+            queryset = queryset.filter(self._after(values, reverse=direction == 'prev'))
+
+        order_by = [f'-{field}' if direction == 'prev' else field for field in self.ordering]
+        return queryset.order_by(*order_by)[:self.per_page + 1], direction
+
+    def page(self, cursor=None):
+        queryset, direction = self._page_query(cursor)
+        return self._build_page(list(queryset), cursor, direction)
+
+    async def apage(self, cursor=None):
+        queryset, direction = self._page_query(cursor)
+        return self._build_page([item async for item in queryset.aiterator()], cursor, direction)
+
+    def _build_page(self, items, cursor, direction):
+        backwards = direction == 'prev'
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if backwards:
+            items.reverse()
+
+        next_cursor = previous_cursor = None
+        if items:
+            if has_more or backwards:
+                next_cursor = encode_cursor(self._key(items[-1]), 'next')
+            if cursor and (has_more or not backwards):
+                previous_cursor = encode_cursor(self._key(items[0]), 'prev')
+        return KeysetPage(items, next_cursor, previous_cursor)
+
+
+def cached_count(key, queryset, timeout):
+    """Return ``queryset.count()``, reusing a cached value for ``timeout`` seconds.
+
+    A falsy timeout disables counting altogether and returns ``None``.
+    """
+    if not timeout:
+        return None
+    return cache.get_or_set(f'count:{key}', queryset.count, timeout)
+
+
+async def acached_count(key, queryset, timeout):
+    """Async ``cached_count()``."""
+    if not timeout:
+        return None
+    count = await cache.aget(f'count:{key}')
+    if count is None:
+        count = await queryset.acount()
+        await cache.aset(f'count:{key}', count, timeout)
+    return count
@@ -0,0 +1,99 @@
+import io
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from .models import Student
+from .thumbnails import DERIVATIVE_SIZES, derivative_name
+
+# Many phone cameras write JPEGs with extra frames (depth maps, previews), which Pillow reports as
+# MPO; only the first frame, the photo itself, is kept when it is re-encoded to JPEG
+ACCEPTED_FORMATS = ('JPEG', 'MPO', 'PNG', 'WEBP')
+
+# Re-encoding is CPU bound, so a small shared pool keeps a burst of enrollments from
+# oversubscribing the worker while request threads simply wait on their result
+_encode_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'PHOTO_ENCODE_WORKERS', 2),
+    thread_name_prefix='photo-encode',
+)
+
+
+class PhotoRejected(ValueError):
+    pass
+
+
+def normalize_photo(source):
+    """Decode an uploaded image once and return it re-encoded as a normalized JPEG."""
+    max_bytes = settings.PHOTO_MAX_UPLOAD_SIZE
+    max_pixels = settings.PHOTO_MAX_PIXELS
+
+    if getattr(source, 'size', 0) > max_bytes:
+        raise PhotoRejected(f"Photo is larger than {max_bytes // 1024} KB.")
+
+    source.seek(0)
+    try:
+        with Image.open(source) as image:
+            # Only the header has been read so far; check the pixel count before decoding
+            if image.format not in ACCEPTED_FORMATS:
+                raise PhotoRejected("Photo must be a JPEG, PNG or WebP image.")
+            if image.width * image.height > max_pixels:
+                raise PhotoRejected(f"Photo is larger than {max_pixels} pixels.")
+            image.load()
+            image = ImageOps.exif_transpose(image).convert('RGB')
+    except (OSError, Image.DecompressionBombError):
+        raise PhotoRejected("Upload a valid image.")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=settings.PHOTO_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def submit_photo(source):
+    return _encode_executor.submit(normalize_photo, source)
+
+
+def ingest_photo(source):
+    """Validate and normalize an uploaded photo, returning a file ready to assign to ``Student.photo``."""
+    data = submit_photo(source).result()
+    return ContentFile(data, name=f'{uuid.uuid4().hex}.jpg')
+
+
+def release_photo(name):
+    """Drop one reference to a stored photo, deleting the file once no student uses it.
+
+    Content-addressed names are shared between rows with identical captures,
+    so the remaining references are counted before anything is removed. The
+    count and the delete run in one transaction, which here starts by taking
+    the database write lock: a save still writing a row for the same content
+    commits first and is counted. A save that found the file just before it
+    was deleted puts it back through ``restore_photos()``.
+    """
+    if not name:
+        return False
+    storage = Student._meta.get_field('photo').storage
+    with transaction.atomic():
+        if Student.objects.filter(photo=name).exists():
+            return False
+        for target in [name] + [derivative_name(name, size) for size in DERIVATIVE_SIZES]:
+            storage.delete(target)
+    return True
+
+
+def pending_photos(students):
+    """The uploaded photo content of ``students`` not stored yet, for ``restore_photos()`` once their rows are saved."""
+    return [(student, student.photo.file) for student in students if student.photo and not student.photo._committed]
+
+
+def restore_photos(pending):
+    """Re-write photos that a concurrent ``release_photo()`` deleted between storing them and saving their rows.
+
+    Call it with what ``pending_photos()`` returned before the save, inside the saving transaction.
+    """
+    for student, content in pending:
+        storage = student.photo.storage
+        if not storage.exists(student.photo.name):
+            storage.save_as(student.photo.name, content)
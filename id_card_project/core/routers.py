@@ -0,0 +1,70 @@
+import contextlib
+import functools
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+
+from django.conf import settings
+from django.db import connections
+
+READ_ONLY_ALIAS = 'readonly'
+
+_read_only = ContextVar('read_only_database', default=False)
+
+
+@contextlib.contextmanager
+def read_only_database():
+    """Send ORM reads made inside the block to the read-only connection."""
+    token = _read_only.set(True)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+
+def uses_read_only_database(view_func):
+    if iscoroutinefunction(view_func):
+        # The async ORM copies the context into its worker threads, so the router sees the flag there too
+        @functools.wraps(view_func)
+        async def async_wrapper(*args, **kwargs):
+            with read_only_database():
+                return await view_func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(view_func)
+    def wrapper(*args, **kwargs):
+        with read_only_database():
+            return view_func(*args, **kwargs)
+    return wrapper
+
+
+def read_only_available():
+    if READ_ONLY_ALIAS not in settings.DATABASES:
+        return False
+    # A shared in-memory database (the SQLite test database) locks tables across
+    # connections, so reads stay on the default connection there
+    connection = connections[READ_ONLY_ALIAS]
+    return not (connection.vendor == 'sqlite' and connection.is_in_memory_db())
+
+
+class ReadOnlyRouter:
+    """Route reads to ``READ_ONLY_ALIAS`` inside ``read_only_database()``; everything else uses the default."""
+
+    def db_for_read(self, model, **hints):
+        if _read_only.get() and read_only_available():
+            return READ_ONLY_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Instances loaded through the read-only connection are saved through the default one
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db == READ_ONLY_ALIAS:
+            return 'default'
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are the same database file
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != READ_ONLY_ALIAS
@@ -0,0 +1,62 @@
+import re
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+# Kept in sync by triggers on core_student. SQLite migrations that rebuild that table drop the
+# triggers, so such a migration must recreate them, as 0009_student_sync does.
+SEARCH_TABLE = 'core_student_search'
+SEARCH_FIELDS = ('student_name', 'father_name', 'village', 'mobile_number', 'unique_id')
+# Searched inside as well as by prefix: staff look up "0012" for S0012 or part of a phone number
+IDENTIFIER_FIELDS = ('unique_id', 'mobile_number')
+TERM_RE = re.compile(r'\w+')
+
+
+def search_terms(text):
+    return TERM_RE.findall((text or '').lower())
+
+
+def match_expression(terms):
+    """Build an FTS5 query matching rows that contain every term as a word prefix."""
+    # Quoting each term keeps user input from being read as FTS5 syntax (AND, NEAR, column filters)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def word_prefix_filter(students, terms):
+    """Match every term as a word prefix with ``LIKE`` over ``SEARCH_FIELDS``: what the index does, without it."""
+    for term in terms:
+        matches = [Q(**{f'{field}__istartswith': term}) | Q(**{f'{field}__icontains': f' {term}'}) for field in SEARCH_FIELDS]
+        students = students.filter(Q(*matches, _connector=Q.OR))
+    return students
+
+
+def search_students(students, text, owner_scoped=False):
+    """Narrow ``students`` to rows matching every word of ``text`` as a prefix.
+
+    SQLite databases use the ``core_student_search`` FTS5 index; other
+    backends fall back to ``LIKE`` over the same fields. So does an
+    ``owner_scoped`` queryset, already narrowed to one institution or partner
+    through its index: scanning those rows is cheaper than building the
+    index's match set over the whole table first.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return students
+
+    if connections[students.db].vendor == 'sqlite' and not owner_scoped:
+        matches = RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [match_expression(terms)])
+        return students.filter(pk__in=matches)
+    return word_prefix_filter(students, terms)
+
+
+def identifier_filter(text):
+    """Match ``text`` anywhere in ``IDENTIFIER_FIELDS``, or return ``None`` unless it is a single word with a digit.
+
+    Only such searches can be looking for part of an ID or number, so name
+    searches never pay for the ``LIKE '%term%'`` scan this needs.
+    """
+    terms = search_terms(text)
+    if len(terms) != 1 or not any(char.isdigit() for char in terms[0]):
+        return None
+    return Q(*(Q(**{f'{field}__icontains': terms[0]}) for field in IDENTIFIER_FIELDS), _connector=Q.OR)
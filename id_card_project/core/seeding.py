@@ -0,0 +1,139 @@
+import io
+import random
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from .ids import format_student_id
+from .models import IdCounter, Institution, Partner, Student, User
+from .thumbnails import generate_derivatives
+
+FIRST_NAMES = ['Asha', 'Ravi', 'Meena', 'Kiran', 'Suresh', 'Lakshmi', 'Arjun', 'Divya', 'Naveen', 'Priya', 'Rahul', 'Sita']
+LAST_NAMES = ['Rao', 'Reddy', 'Kumar', 'Naidu', 'Sharma', 'Varma', 'Chowdary', 'Patel']
+VILLAGES = ['Amalapuram', 'Bhimavaram', 'Chirala', 'Dharmavaram', 'Eluru', 'Gudivada', 'Kavali', 'Narsipatnam']
+OTHER_CLASSES = ['Tuition', 'Intermediate', 'Degree']
+CLASS_VALUES = [value for value, _ in Student.CLASS_CHOICES]
+
+
+def seed_owners(institutions, partners, prefix='seed', using='default'):
+    """Create ``institutions`` institution and ``partners`` partner accounts; return their pks."""
+    users = [
+        User(username=f'{prefix}_institution_{i}', role='INSTITUTION', password='!')
+        for i in range(institutions)
+    ] + [
+        User(username=f'{prefix}_partner_{i}', role='PARTNER', password='!')
+        for i in range(partners)
+    ]
+    User.objects.using(using).bulk_create(users, batch_size=500)
+    users = {user.username: user for user in User.objects.using(using).filter(username__startswith=f'{prefix}_')}
+
+    Institution.objects.using(using).bulk_create(
+        [
+            Institution(user=user, lookup_name=Institution.normalize_name(user.username))
+            for user in (users[f'{prefix}_institution_{i}'] for i in range(institutions))
+        ],
+        batch_size=500,
+    )
+    Partner.objects.using(using).bulk_create(
+        [Partner(user=users[f'{prefix}_partner_{i}']) for i in range(partners)], batch_size=500
+    )
+    return (
+        [users[f'{prefix}_institution_{i}'].pk for i in range(institutions)],
+        [users[f'{prefix}_partner_{i}'].pk for i in range(partners)],
+    )
+
+
+def synthetic_photos(count, seed=0):
+    """Store ``count`` portrait-sized JPEGs, with their derivatives, and return their names."""
+    storage = Student._meta.get_field('photo').storage
+    rng = random.Random(seed)
+    names = []
+    for i in range(count):
+        background = (rng.randrange(256), rng.randrange(256), (i * 37) % 256)
+        image = Image.new('RGB', (350, 450), background)
+        draw = ImageDraw.Draw(image)
+        draw.ellipse((105, 70, 245, 230), fill=(rng.randrange(150, 230), rng.randrange(100, 180), 90))
+        draw.rectangle((55, 250, 295, 450), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        # Per-pixel noise so the JPEGs are about as large as real photos
+        image = Image.blend(image, Image.effect_noise((350, 450), 40).convert('RGB'), 0.2)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=settings.PHOTO_JPEG_QUALITY)
+        name = storage.save(f'student_photos/seed_{i}.jpg', ContentFile(buffer.getvalue()))
+        generate_derivatives(name, storage)
+        names.append(name)
+    return names
+
+
+def student_rows(count, institution_ids, partner_ids, first_number=1, photo=None, seed=0):
+    """Yield column tuples for synthetic students, covering every ``CLASS_CHOICES`` value."""
+    rng = random.Random(seed)
+    for n in range(first_number, first_number + count):
+        class_name = CLASS_VALUES[n % len(CLASS_VALUES)]
+        yield (
+            f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            class_name,
+            rng.choice(OTHER_CLASSES) if class_name == 'Other' else None,
+            rng.choice(VILLAGES),
+            f'9{rng.randrange(10 ** 9):09d}',
+            photo(n) if photo else '',
+            format_student_id(n),
+            rng.choice(institution_ids),
+            rng.choice(partner_ids) if partner_ids and rng.random() < 0.8 else None,
+        )
+
+
+STUDENT_COLUMNS = (
+    'student_name', 'father_name', 'class_name', 'other_class', 'village',
+    'mobile_number', 'photo', 'unique_id', 'institution_id', 'partner_id', 'updated_at',
+)
+
+
+def seed_students(rows, using='default', batch_size=10000):
+    """Insert raw student rows with ``executemany``; millions of ORM instances would be far slower."""
+    table = Student._meta.db_table
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(table),
+        ', '.join(quote(column) for column in STUDENT_COLUMNS),
+        ', '.join(['%s'] * len(STUDENT_COLUMNS)),
+    )
+
+    # Raw inserts skip auto_now; stamp every row so delta syncs pick them up
+    updated_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    inserted = 0
+    batch = []
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for row in rows:
+            batch.append((*row, updated_at))
+            if len(batch) >= batch_size:
+                cursor.executemany(sql, batch)
+                inserted += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            inserted += len(batch)
+    return inserted
+
+
+def sync_student_counter(last_number, using='default'):
+    """Move the unique ID counter past rows inserted without the allocator."""
+    counter, _ = IdCounter.objects.using(using).get_or_create(name='student')
+    if counter.value < last_number:
+        counter.value = last_number
+        counter.save(using=using, update_fields=['value'])
+
+
+def use_scratch_database(alias, path, migrate=True, **overrides):
+    """Register ``alias`` as a copy of the default database stored at ``path`` and migrate it."""
+    settings_dict = dict(connections.databases['default'])
+    settings_dict.update({'NAME': path, 'TEST': {**settings_dict.get('TEST', {}), 'NAME': path}}, **overrides)
+    connections.databases[alias] = settings_dict
+    if migrate:
+        call_command('migrate', database=alias, verbosity=0)
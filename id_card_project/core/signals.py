@@ -0,0 +1,95 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .export_cache import mark_students_stale
+from .fragments import bump_student_versions
+from .institutions import bump_institution_lookups
+from .models import Institution, Student, StudentTombstone, User
+from .photos import release_photo
+
+
+@receiver(post_save, sender=Student)
+def release_replaced_photo(sender, instance, created, **kwargs):
+    old_photo = getattr(instance, '_loaded_values', {}).get('photo')
+    if old_photo and old_photo != instance.photo.name:
+        transaction.on_commit(lambda: release_photo(old_photo))
+    instance._loaded_values = {**getattr(instance, '_loaded_values', {}), 'photo': instance.photo.name}
+
+
+def _export_fields(student):
+    return student.class_name, student.other_class, student.partner_id
+
+
+def _owner_fields(student):
+    return student.institution_id, student.partner_id
+
+
+def _record_move(student, loaded):
+    # Delta syncs filter by owner, so an owner the student left needs a tombstone to drop it
+    old_institution = loaded.get('institution_id', student.institution_id)
+    old_partner = loaded.get('partner_id', student.partner_id)
+    left_institution = old_institution if old_institution != student.institution_id else None
+    left_partner = old_partner if old_partner != student.partner_id else None
+    if left_institution or left_partner:
+        StudentTombstone.objects.create(
+            student_id=student.pk, unique_id=student.unique_id,
+            institution_id=left_institution, partner_id=left_partner,
+        )
+
+
+@receiver(post_save, sender=Student)
+def mark_saved_student_stale(sender, instance, **kwargs):
+    loaded = getattr(instance, '_loaded_values', {})
+    export_rows = {_export_fields(instance)}
+    owner_rows = {_owner_fields(instance)}
+    if 'class_name' in loaded:
+        # The class, institution or partner may have changed; what the student left needs a refresh too
+        export_rows.add((loaded['class_name'], loaded.get('other_class'), loaded.get('partner_id')))
+        owner_rows.add((loaded.get('institution_id'), loaded.get('partner_id')))
+    mark_students_stale(export_rows)
+    _record_move(instance, loaded)
+    # In the save's transaction: readers see the new rows and the new version together
+    bump_student_versions(owner_rows)
+    instance._loaded_values = {
+        **loaded,
+        **dict(zip(('class_name', 'other_class', 'partner_id'), _export_fields(instance))),
+        'institution_id': instance.institution_id,
+    }
+
+
+@receiver(post_delete, sender=Student)
+def mark_deleted_student_stale(sender, instance, **kwargs):
+    mark_students_stale([_export_fields(instance)])
+    StudentTombstone.objects.create(
+        student_id=instance.pk, unique_id=instance.unique_id,
+        institution_id=instance.institution_id, partner_id=instance.partner_id,
+    )
+    bump_student_versions([_owner_fields(instance)])
+
+
+@receiver(post_delete, sender=Student)
+def release_deleted_photo(sender, instance, **kwargs):
+    if instance.photo:
+        name = instance.photo.name
+        transaction.on_commit(lambda: release_photo(name))
+
+
+@receiver(post_save, sender=Institution)
+@receiver(post_delete, sender=Institution)
+def refresh_institution_lookups(sender, **kwargs):
+    bump_institution_lookups()
+
+
+@receiver(post_save, sender=User)
+def refresh_renamed_institution(sender, instance, created, update_fields=None, **kwargs):
+    # Logins save last_login alone; only a possible rename changes lookup results
+    if created or instance.role != 'INSTITUTION' or (update_fields and 'username' not in update_fields):
+        return
+    Institution.objects.filter(user=instance).update(lookup_name=Institution.normalize_name(instance.username))
+    bump_institution_lookups()
+    # Partner dashboards, the students API and delta syncs show the institution's name with each student
+    students = Student.objects.filter(institution_id=instance.pk)
+    students.update(updated_at=timezone.now())
+    bump_student_versions(students.values_list('institution_id', 'partner_id').distinct())
@@ -0,0 +1,38 @@
+// Fills the datalist of each institution search box from the lookup endpoint and copies the
+// chosen institution's id into the hidden input that is actually posted.
+document.querySelectorAll('.institution-autocomplete').forEach(input => {
+    const valueInput = document.getElementById(input.dataset.valueInput);
+    const options = input.list;
+    const ids = new Map();
+    let timer;
+
+    function choose() {
+        valueInput.value = ids.get(input.value) || '';
+        input.setCustomValidity(input.value && !valueInput.value ? 'Pick an institution from the list.' : '');
+    }
+
+    input.addEventListener('input', () => {
+        choose();
+        clearTimeout(timer);
+        const query = input.value.trim();
+        if (!query || valueInput.value) {
+            return;
+        }
+        timer = setTimeout(async () => {
+            const response = await fetch(`${input.dataset.lookupUrl}?q=${encodeURIComponent(query)}`);
+            if (!response.ok) {
+                return;
+            }
+            const { results } = await response.json();
+            options.replaceChildren(...results.map(result => {
+                ids.set(result.name, String(result.id));
+                return new Option(result.name);
+            }));
+            choose();
+        }, 150);
+    });
+
+    if (input.value) {
+        ids.set(input.value, valueInput.value);
+    }
+});
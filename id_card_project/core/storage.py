@@ -0,0 +1,80 @@
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+HASHED_NAME_RE = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[^/]+$')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File storage that names every file after the SHA-256 of its content.
+
+    ``student_photos/capture.jpg`` is stored as
+    ``student_photos/ab/cd/abcd...ef.jpg``: the two levels of fan-out keep
+    directories small, and saving content that is already stored just
+    returns the existing name instead of writing a second copy.
+    """
+
+    fan_out = 2
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+
+        _, extension = os.path.splitext(name)
+        shards = [digest[i * 2:i * 2 + 2] for i in range(self.fan_out)]
+        return posixpath.join(posixpath.dirname(name), *shards, f'{digest}{extension.lower()}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        name = self.hashed_name(name, content)
+        if not self.exists(name):
+            self.store(name, content)
+        return name
+
+    def save_as(self, name, content, max_length=None):
+        """Store ``content`` under exactly ``name``, e.g. a derivative next to its hashed original."""
+        return self.store(name, content)
+
+    def store(self, name, content):
+        """Write ``content`` at exactly ``name``, replacing any file already there.
+
+        The file is written aside and renamed into place, so two requests
+        storing the same photo at once both end up with the hash-derived name
+        instead of one of them being moved to an ``_abc1234`` variant.
+        """
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, partial = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            os.chmod(partial, self.file_permissions_mode or 0o644)
+            os.replace(partial, path)
+        except BaseException:
+            os.unlink(partial)
+            raise
+        return name
+
+
+photo_storage = ContentAddressedStorage()
+
+
+def get_photo_storage():
+    return photo_storage
+
+
+def is_hashed_name(name):
+    return bool(HASHED_NAME_RE.search(name))
@@ -0,0 +1,80 @@
+import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .api import serialize_rows, student_values
+from .models import StudentTombstone
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+
+SYNC_ORDERING = ('updated_at', 'id')
+
+
+class InvalidSyncToken(Exception):
+    pass
+
+
+class SyncPage:
+    def __init__(self, changed, deleted, token, more):
+        self.changed = changed
+        self.deleted = deleted
+        self.token = token
+        self.more = more
+
+
+def encode_token(updated_at, student_id, tombstone_id):
+    return encode_cursor([updated_at.isoformat() if updated_at else None, student_id, tombstone_id], 'sync')
+
+
+def decode_token(token):
+    try:
+        (updated_at, student_id, tombstone_id), direction = decode_cursor(token)
+        if direction != 'sync' or not isinstance(student_id, int) or not isinstance(tombstone_id, int):
+            raise ValueError(token)
+        return (datetime.datetime.fromisoformat(updated_at) if updated_at else None), student_id, tombstone_id
+    except (InvalidCursor, ValueError, TypeError):
+        raise InvalidSyncToken(token)
+
+
+def owner_tombstones(owner_key):
+    kind, pk = owner_key.split('-')
+    return StudentTombstone.objects.filter(**{f'{kind}_id': int(pk)})
+
+
+def sync_page(owner_key, students, fields, token=None, limit=500, settle_seconds=5):
+    """Return the students of ``owner_key`` created, changed or removed since ``token``.
+
+    Changes are walked by ``(updated_at, id)`` and removals by tombstone id,
+    each through an owner index, so a sync reads only what changed. Rows
+    saved in the last ``settle_seconds`` wait for the next sync: a save
+    stamps ``updated_at`` before it commits, and a token must never move
+    past a timestamp that is still about to appear.
+    """
+    tombstones = owner_tombstones(owner_key)
+    if token:
+        since, since_id, tombstone_id = decode_token(token)
+    else:
+        # A first sync gets every current student, so earlier removals are of no interest
+        since, since_id = None, 0
+        tombstone_id = tombstones.order_by('-id').values_list('id', flat=True).first() or 0
+
+    changed = students.filter(updated_at__lte=timezone.now() - datetime.timedelta(seconds=settle_seconds))
+    if since is not None:
+        changed = changed.filter(Q(updated_at__gt=since) | Q(updated_at=since, id__gt=since_id))
+    rows = list(student_values(changed, fields, SYNC_ORDERING).order_by(*SYNC_ORDERING)[:limit + 1])
+    removed = list(tombstones.filter(id__gt=tombstone_id).order_by('id').values_list('id', 'student_id', 'unique_id')[:limit + 1])
+    more = len(rows) > limit or len(removed) > limit
+    rows, removed = rows[:limit], removed[:limit]
+
+    if rows:
+        since, since_id = rows[-1]['updated_at'], rows[-1]['id']
+    if removed:
+        tombstone_id = removed[-1][0]
+
+    # A student that moved away and back again is still the caller's; its change row covers it
+    current = set(students.filter(pk__in={student_id for _, student_id, _ in removed}).values_list('pk', flat=True))
+    deleted = list({
+        student_id: {'id': student_id, 'unique_id': unique_id}
+        for _, student_id, unique_id in removed if student_id not in current
+    }.values())
+    return SyncPage(serialize_rows(rows, fields, SYNC_ORDERING), deleted, encode_token(since, since_id, tombstone_id), more)
@@ -0,0 +1,37 @@
+from django import template
+
+from ..fragments import cached_fragment
+
+register = template.Library()
+
+
+class OwnerFragmentNode(template.Node):
+    def __init__(self, nodelist, name, owner_key, version, vary):
+        self.nodelist = nodelist
+        self.name = name
+        self.owner_key = owner_key
+        self.version = version
+        self.vary = vary
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        owner_key = self.owner_key.resolve(context)
+        version = self.version.resolve(context)
+        vary = [value.resolve(context) for value in self.vary]
+        return cached_fragment(name, owner_key, version, vary, lambda: self.nodelist.render(context))
+
+
+@register.tag
+def ownerfragment(parser, token):
+    """Cache the enclosed block per owner data version.
+
+    Usage: ``{% ownerfragment "name" owner_key version [vary ...] %}...{% endownerfragment %}``.
+    ``version`` is the owner version the view read before querying; the
+    cached copy is dropped as soon as a student of ``owner_key`` changes.
+    """
+    bits = token.split_contents()
+    if len(bits) < 4:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a fragment name, an owner key and a version")
+    nodelist = parser.parse(('endownerfragment',))
+    parser.delete_first_token()
+    return OwnerFragmentNode(nodelist, *[parser.compile_filter(bit) for bit in bits[1:4]], [parser.compile_filter(bit) for bit in bits[4:]])
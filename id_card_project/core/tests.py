@@ -1,6 +1,63 @@
-from django.test import TestCase
-from django.urls import reverse
-from .models import User, Partner, Institution, Student
+import asyncio
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+import uuid
+import zipfile
+from contextlib import closing
+from importlib import import_module
+from types import SimpleNamespace
+from unittest import mock
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from openpyxl import Workbook, load_workbook
+from PIL import Image, PdfParser
+from django.shortcuts import render
+from django.urls import resolve, reverse
+from id_card_project import settings as project_settings, settings_asgi
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date
+from .forms import StudentForm
+from .institutions import lookup_institutions, prefix_range
+from .enrollment import enroll_students
+from .models import User, Partner, Institution, Student, StudentTombstone, EnrollmentReceipt, ExportJob, ExportSegment, IdCounter
+from .export_cache import cached_export
+from .export_jobs import claim_next_job, export_job_path, run_export_job
+from .seeding import seed_students, student_rows
+from .exports import ExportTimings, build_archive, order_by_export_class, sheet_title
+from .cards import (
+    CARD_SIZE, _render_to_cache, card_cache_key, card_cache_path, card_class_filter, card_data, card_queryset,
+    draw_card, render_cards, write_sheets,
+)
+from .fragments import bump_owner_versions, fragment_stats, owner_version
+from .metrics import fingerprint, registry
+from .async_views import _save_student_form, iterate_blocking, run_blocking
+from .routers import ReadOnlyRouter, read_only_available, read_only_database
+from .pagination import KeysetPaginator, encode_cursor
+from .photos import ingest_photo, release_photo
+from .search import SEARCH_TABLE, match_expression, search_students, search_terms
+from .ids import allocate_student_ids, student_id_allocator
+from .storage import get_photo_storage, is_hashed_name
+from .thumbnails import DERIVATIVE_SIZES, DERIVATIVE_VERSION, derivative_name
 
 class UserModelTest(TestCase):
     def test_create_admin_user(self):
@@ -105,3 +162,2088 @@ class ReferralSystemTest(TestCase):
         self.assertIsNotNone(student)
         self.assertEqual(student.student_name, 'Test Student')
         self.assertEqual(student.partner, self.partner)
+
+class InstitutionPickerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.partner = Partner.objects.create(user=User.objects.create_user(username='picker_partner', password='password', role='PARTNER'))
+        for username in ('Sunrise School', 'sunbeam_academy', 'Sundar Vidyalaya', 'Green Valley', 'ABC School', 'St Joseph'):
+            Institution.objects.create(user=User.objects.create_user(username=username, password='password', role='INSTITUTION'))
+        self.institution = Institution.objects.get(user__username='Green Valley')
+        self.referral_url = reverse('referral_student_add', kwargs={'referral_code': self.partner.referral_code})
+        self.student_data = {
+            'student_name': 'Picked Student', 'father_name': 'Father', 'class_name': '1',
+            'village': 'Village', 'mobile_number': '1234567890',
+        }
+
+    def lookup(self, q):
+        return [row['name'] for row in self.client.get(reverse('institution_lookup'), {'q': q}).json()['results']]
+
+    def test_form_renders_without_loading_every_institution(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.referral_url)
+        self.assertContains(response, reverse('institution_lookup'))
+        self.assertContains(response, 'js/institution_autocomplete.js')
+        self.assertNotContains(response, 'Sunrise School')
+
+    def test_lookup_matches_prefixes_and_is_cached(self):
+        self.assertEqual(self.lookup('Sun'), ['sunbeam_academy', 'Sundar Vidyalaya', 'Sunrise School'])
+        self.assertEqual(self.lookup('sunb'), ['sunbeam_academy'])
+        self.assertEqual(self.lookup(' '), [])
+        # Only the lookup version is read; the results come from the cache
+        with self.assertNumQueries(1):
+            self.assertEqual(self.lookup('Sun'), ['sunbeam_academy', 'Sundar Vidyalaya', 'Sunrise School'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.get(username='Sunrise School')
+            user.username = 'Moonrise School'
+            user.save()
+        self.assertEqual(self.lookup('Sun'), ['sunbeam_academy', 'Sundar Vidyalaya'])
+        self.assertEqual(self.lookup('mOON'), ['Moonrise School'])
+
+    def test_lookup_ignores_case_anywhere_in_the_prefix(self):
+        self.assertEqual(self.lookup('abc'), ['ABC School'])
+        self.assertEqual(self.lookup('st j'), ['St Joseph'])
+        self.assertEqual(self.lookup('SUNR'), ['Sunrise School'])
+        self.assertEqual(self.lookup(chr(sys.maxunicode)), [])
+        with CaptureQueriesContext(connection) as queries:
+            lookup_institutions('gReEn')
+        plan = connection.cursor().execute(f'EXPLAIN QUERY PLAN {queries[-1]["sql"]}').fetchall()
+        self.assertIn('core_institution_lookup_name', ' '.join(str(row) for row in plan))
+
+    def test_prefix_range_bounds_only_matching_strings(self):
+        self.assertEqual(prefix_range('ab'), ('ab', 'ac'))
+        self.assertEqual(prefix_range('a' + chr(sys.maxunicode)), ('a' + chr(sys.maxunicode), 'b'))
+        self.assertEqual(prefix_range(chr(sys.maxunicode)), (chr(sys.maxunicode), None))
+        self.assertEqual(prefix_range('\ud7ff'), ('\ud7ff', '\ue000'))
+
+    def test_institution_is_validated_with_one_lookup(self):
+        form = StudentForm({**self.student_data, 'institution': self.institution.pk})
+        with self.assertNumQueries(1):
+            self.assertTrue(form.is_valid())
+        self.assertFalse(StudentForm({**self.student_data, 'institution': 999999}).is_valid())
+
+        # A re-rendered form shows the chosen institution's name, not the whole list
+        html = str(StudentForm({**self.student_data, 'institution': self.institution.pk})['institution'])
+        self.assertIn('value="Green Valley"', html)
+        self.assertNotIn('Sunrise School', html)
+
+    def test_referral_link_can_pre_bind_the_institution(self):
+        url = f'{self.referral_url}?institution={self.institution.pk}'
+        response = self.client.get(url)
+        self.assertContains(response, 'Institution: Green Valley')
+        self.assertNotContains(response, 'name="institution"')
+
+        self.client.post(url, self.student_data)
+        student = Student.objects.get(student_name='Picked Student')
+        self.assertEqual((student.institution, student.partner), (self.institution, self.partner))
+        self.assertEqual(self.client.get(f'{self.referral_url}?institution=999999').status_code, 404)
+        self.assertEqual(self.client.get(f'{self.referral_url}?institution=abc').status_code, 404)
+
+    def test_institutions_cannot_move_their_students(self):
+        self.client.login(username='Green Valley', password='password')
+        self.client.post(reverse('student_add'), self.student_data)
+        student = Student.objects.get(student_name='Picked Student')
+        other = Institution.objects.get(user__username='Sunrise School')
+        self.client.post(reverse('student_update', kwargs={'pk': student.pk}), {**self.student_data, 'institution': other.pk})
+        student.refresh_from_db()
+        self.assertEqual(student.institution, self.institution)
+
+class StudentExportFixture:
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_override = override_settings(
+            MEDIA_ROOT=self.media_root, EXPORT_CACHE_ROOT=os.path.join(self.media_root, 'export_cache')
+        )
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        self.admin_user = User.objects.create_user(username='export_admin', password='password', role='ADMIN')
+        self.partner_user = User.objects.create_user(username='export_partner', password='password', role='PARTNER')
+        self.partner = Partner.objects.create(user=self.partner_user)
+        self.institution_user = User.objects.create_user(username='export_institution', password='password', role='INSTITUTION')
+        self.institution = Institution.objects.create(user=self.institution_user)
+
+        self.create_student('Asha', '1', partner=self.partner)
+        self.create_student('Ravi', '1')
+        self.create_student('Meena', 'Other', other_class='Tuition', partner=self.partner)
+
+    def create_student(self, name, class_name, other_class=None, partner=None):
+        student = Student(
+            student_name=name,
+            father_name=f'{name} Father',
+            class_name=class_name,
+            other_class=other_class,
+            village='Village',
+            mobile_number='9999999999',
+            institution=self.institution,
+            partner=partner,
+        )
+        student.photo = ContentFile(make_jpeg(color=(len(name), 0, 0)), name=f'{name}.jpg')
+        student.save()
+        return student
+
+
+class StudentExportTestCase(StudentExportFixture, TestCase):
+    pass
+
+
+class ExportDataTests(StudentExportTestCase):
+    def export(self, username, **params):
+        self.client.login(username=username, password='password')
+        response = self.client.get(reverse('export_data'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_admin_csv_export_streams_every_class(self):
+        archive = self.export('export_admin', format='csv')
+        names = archive.namelist()
+        self.assertIn('1/student_data.csv', names)
+        self.assertIn('Tuition/student_data.csv', names)
+        self.assertEqual(len([n for n in names if '/Photos/' in n]), 3)
+
+        rows = list(csv.reader(io.StringIO(archive.read('1/student_data.csv').decode('utf-8'))))
+        self.assertEqual(rows[0][1], 'Student Name')
+        self.assertEqual(sorted(row[1] for row in rows[1:]), ['Asha', 'Ravi'])
+
+        photo_name = [n for n in names if n.startswith('Tuition/Photos/')][0]
+        meena = Student.objects.get(student_name='Meena')
+        self.assertEqual(photo_name, f'Tuition/Photos/{meena.unique_id}.jpg')
+        with meena.photo.open('rb') as photo:
+            self.assertEqual(archive.read(photo_name), photo.read())
+
+    def test_partner_xlsx_export_is_scoped_to_partner(self):
+        archive = self.export('export_partner', format='xlsx')
+        workbook = load_workbook(io.BytesIO(archive.read('1/student_data.xlsx')))
+        rows = list(workbook.active.values)
+        self.assertEqual([row[1] for row in rows[1:]], ['Asha'])
+        self.assertIn('Tuition/student_data.xlsx', archive.namelist())
+
+    def test_photos_are_stored_and_sheets_deflated(self):
+        archive = self.export('export_admin', format='csv')
+        for info in archive.infolist():
+            expected = zipfile.ZIP_STORED if '/Photos/' in info.filename else zipfile.ZIP_DEFLATED
+            self.assertEqual(info.compress_type, expected, info.filename)
+
+    def test_prefetched_photos_keep_row_order_and_are_timed(self):
+        for i in range(6):
+            self.create_student(f'Prefetch {i}', '2')
+        timings = ExportTimings()
+        with tempfile.TemporaryFile() as f, self.assertLogs('core.exports', 'INFO') as logs:
+            for _ in build_archive(f, order_by_export_class(Student.objects.all()), 'csv', timings):
+                pass
+            f.seek(0)
+            archive = zipfile.ZipFile(f)
+            photo_names = [n for n in archive.namelist() if n.startswith('2/Photos/')]
+            unique_ids = list(Student.objects.filter(class_name='2').order_by('id').values_list('unique_id', flat=True))
+            self.assertEqual(photo_names, [f'2/Photos/{uid}.jpg' for uid in unique_ids])
+
+        self.assertEqual((timings.rows, timings.photos), (9, 9))
+        self.assertGreaterEqual(timings.wall, timings.io_wait)
+        self.assertIn('waiting on photo reads', logs.output[0])
+
+    def test_large_photos_are_streamed_not_read_ahead(self):
+        meena = Student.objects.get(student_name='Meena')
+        with meena.photo.open('rb') as photo:
+            content = photo.read()
+        timings = ExportTimings()
+        with mock.patch('core.exports.EXPORT_PHOTO_INLINE_SIZE', len(content) - 1), \
+                mock.patch('core.exports.PHOTO_READ_SIZE', 100), tempfile.TemporaryFile() as f:
+            steps = sum(1 for _ in build_archive(f, order_by_export_class(Student.objects.all()), 'csv', timings))
+            f.seek(0)
+            archive = zipfile.ZipFile(f)
+            self.assertEqual(archive.read(f'Tuition/Photos/{meena.unique_id}.jpg'), content)
+            self.assertEqual(archive.getinfo(f'Tuition/Photos/{meena.unique_id}.jpg').compress_type, zipfile.ZIP_STORED)
+
+        # The writer yields after every chunk, so the caller can drain the archive as it grows
+        self.assertGreater(steps, len(content) // 100)
+        self.assertEqual(timings.photos, 3)
+
+    def test_cpu_time_is_summed_on_the_thread_running_each_step(self):
+        def steps():
+            for _ in range(3):
+                started = time.thread_time()
+                while time.thread_time() - started < 0.02:
+                    pass
+                yield
+
+        timings = ExportTimings()
+        measured = timings.measure(steps())
+        # Under ASGI each step may run on a different executor thread
+        for _ in range(3):
+            thread = threading.Thread(target=next, args=(measured,))
+            thread.start()
+            thread.join()
+        self.assertGreaterEqual(timings.cpu, 0.06)
+        self.assertLess(timings.cpu, 1)
+
+    def test_single_workbook_has_a_sheet_per_class_and_a_summary(self):
+        self.create_student('Kiran', 'Other', other_class='Tuition: Evening/Weekend batch for seniors')
+        archive = self.export('export_admin', format='xlsx-book')
+        self.assertIn('student_data.xlsx', archive.namelist())
+        self.assertFalse([n for n in archive.namelist() if n.endswith('/student_data.xlsx')])
+        self.assertEqual(len([n for n in archive.namelist() if '/Photos/' in n]), 4)
+
+        workbook = load_workbook(io.BytesIO(archive.read('student_data.xlsx')))
+        titles = workbook.sheetnames
+        self.assertEqual(titles[:3], ['Summary', '1', 'Tuition'])
+        self.assertEqual(titles[3], 'Tuition_ Evening_Weekend batch ')
+        summary = list(workbook['Summary'].values)
+        self.assertEqual(summary[1:], [('1', '1', 2), ('Tuition', 'Tuition', 1), ('Tuition: Evening/Weekend batch for seniors', titles[3], 1), ('Total', None, 4)])
+        self.assertEqual(sorted(row[1] for row in list(workbook['1'].values)[1:]), ['Asha', 'Ravi'])
+
+    def test_sheet_titles_are_unique_and_bounded(self):
+        used = {'summary'}
+        self.assertEqual(sheet_title('Summary', used), 'Summary (2)')
+        self.assertEqual(sheet_title('x' * 40, used), 'x' * 31)
+        self.assertEqual(sheet_title('X' * 40, used), 'X' * 27 + ' (2)')
+        self.assertEqual(sheet_title("'[3/4]'", used), '_3_4_')
+
+    @override_settings(EXPORT_CACHE_ENABLED=False)
+    def test_uncached_export_is_streamed_while_built(self):
+        self.client.login(username='export_admin', password='password')
+        response = self.client.get(reverse('export_data'), {'format': 'csv'})
+        self.assertIsInstance(response, StreamingHttpResponse)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIn('Tuition/student_data.csv', archive.namelist())
+
+    def test_institution_cannot_export(self):
+        self.client.login(username='export_institution', password='password')
+        response = self.client.get(reverse('export_data'))
+        self.assertEqual(response.status_code, 401)
+
+
+class ExportMemoryTests(TestCase):
+    rows = 10000
+    # Well under what 10k model instances held at once would take
+    peak_limit = 4 * 1024 * 1024
+
+    def test_large_export_peak_heap_stays_bounded(self):
+        user = User.objects.create_user(username='memory_institution', password='password', role='INSTITUTION')
+        Institution.objects.create(user=user)
+        seed_students(student_rows(self.rows, [user.pk], []))
+
+        for export_format in ('csv', 'xlsx'):
+            with self.subTest(export_format=export_format), tempfile.TemporaryFile() as archive:
+                students = order_by_export_class(Student.objects.all())
+                tracemalloc.start()
+                try:
+                    for _ in build_archive(archive, students, export_format):
+                        pass
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                self.assertLess(peak, self.peak_limit)
+                archive.seek(0)
+                classes = students.order_by().values('export_class').distinct().count()
+                self.assertEqual(len(zipfile.ZipFile(archive).namelist()), classes)
+
+
+@override_settings(EXPORT_CACHE_ENABLED=True)
+class ExportCacheTests(StudentExportTestCase):
+    def stale_classes(self, owner_key='admin', export_format='csv'):
+        return set(ExportSegment.objects.filter(
+            owner_key=owner_key, export_format=export_format, stale=True,
+        ).values_list('export_class', flat=True))
+
+    def test_unchanged_export_reuses_the_archive(self):
+        path = cached_export('admin', 'csv')
+        built_at = {segment.export_class: segment.built_at for segment in ExportSegment.objects.filter(owner_key='admin', export_format='csv')}
+        self.assertEqual(set(built_at), {'1', 'Tuition'})
+        mtime = os.stat(path).st_mtime_ns
+
+        with self.assertNumQueries(2):
+            self.assertEqual(cached_export('admin', 'csv'), path)
+        self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+
+    def test_saving_a_student_rebuilds_only_its_class(self):
+        cached_export('admin', 'csv')
+        cached_export(f'partner-{self.partner.pk}', 'csv')
+        tuition = ExportSegment.objects.get(owner_key='admin', export_format='csv', export_class='Tuition')
+
+        ravi = Student.objects.get(student_name='Ravi')
+        ravi.village = 'Eluru'
+        ravi.save()
+        self.assertEqual(self.stale_classes(), {'1'})
+        self.assertEqual(self.stale_classes(f'partner-{self.partner.pk}'), set())
+
+        archive = zipfile.ZipFile(cached_export('admin', 'csv'))
+        self.assertEqual(self.stale_classes(), set())
+        tuition_after = ExportSegment.objects.get(pk=tuition.pk)
+        self.assertEqual(tuition_after.built_at, tuition.built_at)
+        rows = list(csv.reader(io.StringIO(archive.read('1/student_data.csv').decode('utf-8'))))
+        self.assertIn('Eluru', [row[4] for row in rows[1:]])
+        self.assertEqual(len([n for n in archive.namelist() if '/Photos/' in n]), 3)
+
+    def test_moving_a_student_marks_both_classes_and_drops_empty_ones(self):
+        cached_export('admin', 'csv')
+        meena = Student.objects.get(student_name='Meena')
+        meena.class_name = '2'
+        meena.other_class = None
+        meena.save()
+        self.assertEqual(self.stale_classes(), {'2', 'Tuition'})
+
+        archive = zipfile.ZipFile(cached_export('admin', 'csv'))
+        names = archive.namelist()
+        self.assertIn('2/student_data.csv', names)
+        self.assertFalse([n for n in names if n.startswith('Tuition/')])
+        self.assertFalse(ExportSegment.objects.filter(owner_key='admin', export_class='Tuition', export_format='csv').exists())
+
+    def test_deleting_a_student_marks_its_class_stale(self):
+        cached_export('admin', 'csv')
+        Student.objects.get(student_name='Asha').delete()
+        self.assertEqual(self.stale_classes(), {'1'})
+        archive = zipfile.ZipFile(cached_export('admin', 'csv'))
+        rows = list(csv.reader(io.StringIO(archive.read('1/student_data.csv').decode('utf-8'))))
+        self.assertEqual([row[1] for row in rows[1:]], ['Ravi'])
+
+    def test_failed_rebuild_is_retried_by_the_next_export(self):
+        cached_export('admin', 'csv')
+        ravi = Student.objects.get(student_name='Ravi')
+        ravi.village = 'Eluru'
+        ravi.save()
+
+        with mock.patch('core.export_cache.build_archive', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                cached_export('admin', 'csv')
+        self.assertEqual(self.stale_classes(), {'1'})
+        self.assertFalse([n for _, _, names in os.walk(settings.EXPORT_CACHE_ROOT) for n in names if n.endswith('.tmp')])
+
+        archive = zipfile.ZipFile(cached_export('admin', 'csv'))
+        rows = list(csv.reader(io.StringIO(archive.read('1/student_data.csv').decode('utf-8'))))
+        self.assertIn('Eluru', [row[4] for row in rows[1:]])
+
+
+class ExportJobTests(StudentExportTestCase):
+    def setUp(self):
+        super().setUp()
+        job_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, job_root, ignore_errors=True)
+        job_override = override_settings(EXPORT_JOB_ROOT=job_root)
+        job_override.enable()
+        self.addCleanup(job_override.disable)
+        self.client.login(username='export_partner', password='password')
+
+    def test_identical_requests_share_a_job(self):
+        first = self.client.post(reverse('export_job_create'), {'format': 'csv'})
+        second = self.client.post(reverse('export_job_create'), {'format': 'csv'})
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(first.json()['id'], second.json()['id'])
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+        other_format = self.client.post(reverse('export_job_create'), {'format': 'xlsx'})
+        self.assertNotEqual(other_format.json()['id'], first.json()['id'])
+
+    def test_worker_builds_archive_and_download_supports_ranges(self):
+        job_id = self.client.post(reverse('export_job_create'), {'format': 'csv'}).json()['id']
+        status = self.client.get(reverse('export_job_status', kwargs={'pk': job_id})).json()
+        self.assertEqual(status['status'], 'PENDING')
+
+        call_command('run_export_worker', '--once', stdout=io.StringIO())
+
+        status = self.client.get(reverse('export_job_status', kwargs={'pk': job_id})).json()
+        self.assertEqual(status['status'], 'DONE')
+
+        response = self.client.get(status['download_url'])
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), status['size'])
+        archive = zipfile.ZipFile(io.BytesIO(body))
+        self.assertIn('1/student_data.csv', archive.namelist())
+
+        partial = self.client.get(status['download_url'], HTTP_RANGE='bytes=10-19')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial['Content-Range'], f"bytes 10-19/{status['size']}")
+        self.assertEqual(b''.join(partial.streaming_content), body[10:20])
+
+        unsatisfiable = self.client.get(status['download_url'], HTTP_RANGE=f"bytes={status['size']}-")
+        self.assertEqual(unsatisfiable.status_code, 416)
+
+        # A client resuming with either validator from the first response gets the rest of the file
+        for validator in (response['ETag'], response['Last-Modified']):
+            resumed = self.client.get(status['download_url'], HTTP_RANGE='bytes=10-', HTTP_IF_RANGE=validator)
+            self.assertEqual(resumed.status_code, 206, validator)
+            self.assertEqual(b''.join(resumed.streaming_content), body[10:])
+        stale_date = http_date(parse_http_date(response['Last-Modified']) - 60)
+        for validator in ('"stale"', f"W/{response['ETag']}", stale_date, 'not a date'):
+            stale = self.client.get(status['download_url'], HTTP_RANGE='bytes=10-', HTTP_IF_RANGE=validator)
+            self.assertEqual(stale.status_code, 200, validator)
+            self.assertEqual(b''.join(stale.streaming_content), body)
+
+    def test_jobs_are_not_visible_to_other_owners(self):
+        job_id = self.client.post(reverse('export_job_create'), {'format': 'csv'}).json()['id']
+        self.client.login(username='export_admin', password='password')
+        response = self.client.get(reverse('export_job_status', kwargs={'pk': job_id}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_abandoned_job_is_failed_and_requested_again(self):
+        job_id = self.client.post(reverse('export_job_create'), {'format': 'csv'}).json()['id']
+        job = claim_next_job()
+        self.assertEqual(job.pk, job_id)
+        # The worker died: its heartbeat is older than the lease
+        ExportJob.objects.filter(pk=job_id).update(heartbeat_at=timezone.now() - datetime.timedelta(hours=1))
+
+        retry = self.client.post(reverse('export_job_create'), {'format': 'csv'}).json()
+        self.assertNotEqual(retry['id'], job_id)
+        self.assertEqual(ExportJob.objects.get(pk=job_id).status, 'FAILED')
+        self.assertEqual(retry['status'], 'PENDING')
+
+        # A late finish by the dead worker does not publish over the failure
+        with self.assertLogs('core.export_jobs', 'WARNING'):
+            self.assertEqual(run_export_job(job).status, 'FAILED')
+        self.assertEqual(os.listdir(settings.EXPORT_JOB_ROOT), [])
+
+    def test_a_failure_after_the_lease_was_lost_keeps_the_reaped_state(self):
+        job_id = self.client.post(reverse('export_job_create'), {'format': 'csv'}).json()['id']
+        job = claim_next_job()
+
+        def reaped_then_failing(*args, **kwargs):
+            ExportJob.objects.filter(pk=job_id).update(status='FAILED', error='Reaped.', finished_at=timezone.now())
+            raise OSError('disk full')
+            yield
+
+        with mock.patch('core.export_jobs.build_archive', side_effect=reaped_then_failing), \
+                self.assertLogs('core.export_jobs', 'WARNING') as logs:
+            job = run_export_job(job)
+        self.assertEqual((job.status, job.error), ('FAILED', 'Reaped.'))
+        self.assertEqual(ExportJob.objects.get(pk=job_id).error, 'Reaped.')
+        self.assertIn('lost its lease', logs.output[-1])
+
+        # Re-queued meanwhile: a late failure leaves the job pending for the next worker
+        ExportJob.objects.filter(pk=job_id).update(status='RUNNING', error='', finished_at=None)
+        job.refresh_from_db()
+
+        def requeued_then_failing(*args, **kwargs):
+            ExportJob.objects.filter(pk=job_id).update(status='PENDING')
+            raise OSError('disk full')
+            yield
+
+        with mock.patch('core.export_jobs.build_archive', side_effect=requeued_then_failing), \
+                self.assertLogs('core.export_jobs', 'WARNING'):
+            self.assertEqual(run_export_job(job).status, 'PENDING')
+
+    def test_only_one_active_job_per_owner_and_format(self):
+        job = ExportJob.objects.create(requested_by=self.partner.user, owner_key=f'partner-{self.partner.pk}', export_format='csv')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ExportJob.objects.create(requested_by=self.partner.user, owner_key=job.owner_key, export_format='csv')
+
+    def test_worker_purges_expired_archives(self):
+        self.client.post(reverse('export_job_create'), {'format': 'csv'})
+        call_command('run_export_worker', '--once', stdout=io.StringIO())
+        job = ExportJob.objects.get()
+        self.assertTrue(os.path.exists(export_job_path(job)))
+
+        ExportJob.objects.filter(pk=job.pk).update(finished_at=timezone.now() - datetime.timedelta(days=2))
+        call_command('run_export_worker', '--once', stdout=io.StringIO())
+        self.assertFalse(ExportJob.objects.exists())
+        self.assertFalse(os.path.exists(export_job_path(job)))
+
+
+class StudentIdAllocationTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='id_institution', password='password', role='INSTITUTION')
+        self.institution = Institution.objects.create(user=user)
+        student_id_allocator.reset()
+        self.addCleanup(student_id_allocator.reset)
+
+    def create_student(self, name='Student'):
+        return Student.objects.create(
+            student_name=name, father_name='Father', class_name='1',
+            village='Village', mobile_number='9999999999', institution=self.institution,
+        )
+
+    def test_ids_are_allocated_from_the_counter(self):
+        IdCounter.objects.filter(name='student').update(value=41)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.create_student().unique_id, 'S0042')
+        self.assertEqual(self.create_student().unique_id, 'S0043')
+        self.assertEqual(IdCounter.objects.get(name='student').value, 41 + 1 + settings.STUDENT_ID_BLOCK_SIZE)
+
+    def test_ids_continue_past_s9999(self):
+        IdCounter.objects.filter(name='student').update(value=9998)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_student()
+        ids = ['S9999'] + [self.create_student().unique_id for _ in range(2)]
+        self.assertEqual(ids, ['S9999', 'S10000', 'S10001'])
+        self.assertEqual([int(unique_id[1:]) for unique_id in ids], [9999, 10000, 10001])
+
+    def test_block_reservation_is_one_counter_update(self):
+        with self.assertNumQueries(4):
+            ids = allocate_student_ids(5)
+        self.assertEqual(len(set(ids)), 5)
+
+    def test_rolled_back_reservation_is_not_reused(self):
+        IdCounter.objects.filter(name='student').update(value=0)
+        try:
+            with transaction.atomic():
+                self.assertEqual(allocate_student_ids(1), ['S0001'])
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertEqual(IdCounter.objects.get(name='student').value, 0)
+        self.assertEqual(allocate_student_ids(1), ['S0001'])
+
+    def test_block_size_is_read_from_the_current_settings(self):
+        IdCounter.objects.filter(name='student').update(value=0)
+        with override_settings(STUDENT_ID_BLOCK_SIZE=3), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(allocate_student_ids(1), ['S0001'])
+        self.assertEqual(IdCounter.objects.get(name='student').value, 1 + 3)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_forked_children_do_not_inherit_reserved_ids(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            allocate_student_ids(1)
+        self.assertTrue(student_id_allocator._ranges)
+
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Child: report what the allocator kept, without running any test machinery
+            os.write(write_end, str(len(student_id_allocator._ranges)).encode())
+            os._exit(0)
+        os.close(write_end)
+        with os.fdopen(read_end) as child:
+            kept = child.read()
+        os.waitpid(pid, 0)
+        self.assertEqual(kept, '0')
+        self.assertTrue(student_id_allocator._ranges)
+
+    def test_missing_counter_is_seeded_from_existing_ids(self):
+        self.create_student()
+        Student.objects.update(unique_id='S10005')
+        IdCounter.objects.all().delete()
+        self.assertEqual(allocate_student_ids(1), ['S10006'])
+
+
+class ConcurrentEnrollmentTests(TransactionTestCase):
+    workers = 8
+    enrollments_per_worker = 15
+
+    def test_parallel_enrollments_get_unique_ids(self):
+        student_id_allocator.reset()
+        self.addCleanup(student_id_allocator.reset)
+        user = User.objects.create_user(username='busy_institution', password='password', role='INSTITUTION')
+        institution = Institution.objects.create(user=user)
+        errors = []
+
+        def enroll(worker):
+            try:
+                for i in range(self.enrollments_per_worker):
+                    for attempt in range(50):
+                        try:
+                            # Atomic, so a lock hit by the post_save handlers cannot leave a half-done enrollment
+                            with transaction.atomic():
+                                Student.objects.create(
+                                    student_name=f'Student {worker}-{i}', father_name='Father', class_name='1',
+                                    village='Village', mobile_number='9999999999', institution=institution,
+                                )
+                            break
+                        except OperationalError:
+                            # SQLite's shared in-memory test database reports table locks immediately
+                            time.sleep(0.01)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=enroll, args=(worker,)) for worker in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        total = self.workers * self.enrollments_per_worker
+        unique_ids = list(Student.objects.values_list('unique_id', flat=True))
+        self.assertEqual(len(unique_ids), total)
+        self.assertEqual(len(set(unique_ids)), total)
+
+
+@override_settings(DASHBOARD_PAGE_SIZE=5)
+class DashboardPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.partner_user = User.objects.create_user(username='paging_partner', password='password', role='PARTNER')
+        self.partner = Partner.objects.create(user=self.partner_user)
+        self.institutions = []
+        for i in range(3):
+            user = User.objects.create_user(username=f'paging_institution_{i}', password='password', role='INSTITUTION')
+            self.institutions.append(Institution.objects.create(user=user))
+
+    def add_students(self, count):
+        for i in range(count):
+            Student.objects.create(
+                student_name=f'Student {i}', father_name='Father', class_name=['1', '2', 'LKG'][i % 3],
+                village='Village', mobile_number='9999999999',
+                institution=self.institutions[i % 3], partner=self.partner,
+            )
+
+    def walk(self, url_name):
+        seen = []
+        cursor = None
+        while True:
+            response = self.client.get(reverse(url_name), {'cursor': cursor} if cursor else {})
+            page = response.context['page']
+            seen.extend(student.pk for student in page)
+            if not page.has_next:
+                return response, seen
+            cursor = page.next_cursor
+
+    def test_partner_dashboard_pages_cover_every_student_in_order(self):
+        self.add_students(12)
+        self.client.login(username='paging_partner', password='password')
+        response, seen = self.walk('partner_dashboard')
+        expected = list(Student.objects.order_by('class_name', 'id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(response.context['total_students'], 12)
+
+        previous = self.client.get(reverse('partner_dashboard'), {'cursor': response.context['page'].previous_cursor})
+        self.assertEqual([s.pk for s in previous.context['page']], expected[5:10])
+
+    def test_partner_dashboard_query_count_does_not_grow(self):
+        self.client.login(username='paging_partner', password='password')
+        self.add_students(3)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('partner_dashboard'))
+        self.add_students(30)
+        cache.clear()
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse('partner_dashboard'))
+        self.assertContains(response, 'paging_institution_0')
+        self.assertEqual(len(small), len(large))
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        self.add_students(3)
+        self.client.login(username='paging_institution_0', password='password')
+        response = self.client.get(reverse('institution_dashboard'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page']), 1)
+        response = self.client.get(reverse('institution_dashboard'), {'cursor': encode_cursor(['A', 'x'], 'next')})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page']), 1)
+
+
+def make_jpeg(size=(350, 450), color=(200, 120, 80)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def make_mpo(size=(350, 450), color=(200, 120, 80)):
+    """A two-frame MPO, as phone cameras write a photo with its depth map or preview."""
+    buffer = io.BytesIO()
+    depth_map = Image.new('RGB', (size[0] // 2, size[1] // 2), (0, 0, 0))
+    Image.new('RGB', size, color).save(buffer, format='MPO', save_all=True, append_images=[depth_map])
+    return buffer.getvalue()
+
+
+class PhotoDerivativeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=self.media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        user = User.objects.create_user(username='photo_institution', password='password', role='INSTITUTION')
+        self.institution = Institution.objects.create(user=user)
+
+    def create_student(self):
+        student = Student(
+            student_name='Photo Student', father_name='Father', class_name='1',
+            village='Village', mobile_number='9999999999', institution=self.institution,
+        )
+        # Distinct pixels per student, so content-addressed storage keeps separate files
+        student.photo = ContentFile(make_jpeg(color=(Student.objects.count() * 40, 0, 0)), name='capture.jpg')
+        student.save()
+        return student
+
+    def test_derivatives_are_generated_on_upload(self):
+        student = self.create_student()
+        storage = student.photo.storage
+        with storage.open(derivative_name(student.photo.name, 'thumb')) as thumb:
+            self.assertEqual(max(Image.open(thumb).size), 64)
+        with storage.open(derivative_name(student.photo.name, 'print')) as print_size:
+            self.assertEqual(Image.open(print_size).size, (350, 450))
+        self.assertIn('_thumb.jpg?v=', student.thumbnail_url)
+
+        self.client.login(username='photo_institution', password='password')
+        response = self.client.get(reverse('institution_dashboard'))
+        self.assertContains(response, student.thumbnail_url)
+
+    def test_backfill_command_resumes_from_checkpoint(self):
+        students = [self.create_student() for _ in range(3)]
+        storage = students[0].photo.storage
+        for student in students:
+            for size in DERIVATIVE_SIZES:
+                storage.delete(derivative_name(student.photo.name, size))
+
+        checkpoint = os.path.join(self.media_root, 'checkpoint')
+        with open(checkpoint, 'w') as f:
+            f.write(str(students[0].pk))
+
+        call_command('generate_photo_derivatives', '--workers', '1', '--checkpoint', checkpoint, stdout=io.StringIO())
+
+        self.assertFalse(storage.exists(derivative_name(students[0].photo.name, 'thumb')))
+        for student in students[1:]:
+            self.assertTrue(storage.exists(derivative_name(student.photo.name, 'thumb')))
+        with open(checkpoint) as f:
+            self.assertEqual(int(f.read()), students[-1].pk)
+
+
+class PhotoIngestionTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=self.media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        self.partner = Partner.objects.create(user=User.objects.create_user(username='ingest_partner', password='password', role='PARTNER'))
+        self.institution = Institution.objects.create(user=User.objects.create_user(username='ingest_institution', password='password', role='INSTITUTION'))
+        self.url = reverse('referral_student_add', kwargs={'referral_code': self.partner.referral_code})
+
+    def post_student(self, photo):
+        return self.client.post(self.url, {
+            'student_name': 'Captured Student',
+            'father_name': 'Father',
+            'class_name': '2',
+            'village': 'Village',
+            'mobile_number': '1234567890',
+            'institution': self.institution.pk,
+            'photo': photo,
+        })
+
+    def test_capture_is_stored_as_normalized_jpeg(self):
+        buffer = io.BytesIO()
+        Image.new('RGBA', (350, 450), (10, 20, 30, 255)).save(buffer, format='PNG')
+        response = self.post_student(SimpleUploadedFile('capture.png', buffer.getvalue(), content_type='image/png'))
+        self.assertEqual(response.status_code, 302)
+
+        student = Student.objects.get(student_name='Captured Student')
+        self.assertTrue(student.photo.name.endswith('.jpg'))
+        with student.photo.open('rb') as photo:
+            image = Image.open(photo)
+            self.assertEqual((image.format, image.mode, image.size), ('JPEG', 'RGB', (350, 450)))
+
+    def test_phone_camera_mpo_is_stored_as_its_first_frame(self):
+        mpo = make_mpo(color=(10, 200, 30))
+        with Image.open(io.BytesIO(mpo)) as image:
+            self.assertEqual((image.format, image.n_frames), ('MPO', 2))
+        response = self.post_student(SimpleUploadedFile('capture.jpg', mpo, content_type='image/jpeg'))
+        self.assertEqual(response.status_code, 302)
+
+        student = Student.objects.get(student_name='Captured Student')
+        with student.photo.open('rb') as photo:
+            image = Image.open(photo)
+            self.assertEqual((image.format, image.mode, image.size), ('JPEG', 'RGB', (350, 450)))
+            self.assertEqual(getattr(image, 'n_frames', 1), 1)
+
+    def test_non_image_upload_is_rejected(self):
+        response = self.post_student(SimpleUploadedFile('capture.jpg', b'not an image', content_type='image/jpeg'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context['form'], 'photo', 'Upload a valid image.')
+        self.assertFalse(Student.objects.exists())
+
+    @override_settings(PHOTO_MAX_PIXELS=100 * 100)
+    def test_oversized_image_is_rejected_before_decoding(self):
+        response = self.post_student(SimpleUploadedFile('capture.jpg', make_jpeg(size=(200, 200)), content_type='image/jpeg'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context['form'], 'photo', 'Photo is larger than 10000 pixels.')
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=self.media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        user = User.objects.create_user(username='storage_institution', password='password', role='INSTITUTION')
+        self.institution = Institution.objects.create(user=user)
+        self.photo = make_jpeg()
+
+    def create_student(self, photo_bytes=None):
+        student = Student(
+            student_name='Stored Student', father_name='Father', class_name='1',
+            village='Village', mobile_number='9999999999', institution=self.institution,
+        )
+        student.photo = ContentFile(photo_bytes or self.photo, name='capture.jpg')
+        student.save()
+        return student
+
+    def test_photos_are_named_by_content_hash_in_sharded_directories(self):
+        student = self.create_student()
+        digest = hashlib.sha256(self.photo).hexdigest()
+        self.assertEqual(student.photo.name, f'student_photos/{digest[:2]}/{digest[2:4]}/{digest}.jpg')
+
+    def test_identical_photos_share_one_file_until_the_last_reference_goes(self):
+        first = self.create_student()
+        second = self.create_student()
+        self.assertEqual(first.photo.name, second.photo.name)
+        storage = first.photo.storage
+        directory = os.path.dirname(storage.path(first.photo.name))
+        self.assertEqual(len([n for n in os.listdir(directory) if not n.endswith(('_thumb.jpg', '_print.jpg'))]), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(storage.exists(second.photo.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(storage.exists(second.photo.name))
+        self.assertFalse(storage.exists(derivative_name(second.photo.name, 'thumb')))
+
+    def test_replacing_a_photo_releases_the_old_file(self):
+        student = Student.objects.get(pk=self.create_student().pk)
+        old_name = student.photo.name
+        student.photo = ContentFile(make_jpeg(color=(0, 0, 255)), name='retake.jpg')
+        with self.captureOnCommitCallbacks(execute=True):
+            student.save()
+        self.assertNotEqual(student.photo.name, old_name)
+        self.assertFalse(student.photo.storage.exists(old_name))
+
+    def test_concurrent_first_writes_keep_the_hashed_name(self):
+        storage = get_photo_storage()
+        # Both requests saw no file yet and write the same capture
+        with mock.patch.object(storage, 'exists', return_value=False):
+            names = {storage.save('student_photos/capture.jpg', ContentFile(self.photo)) for _ in range(2)}
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(is_hashed_name(name))
+        self.assertEqual(os.listdir(os.path.dirname(storage.path(name))), [os.path.basename(name)])
+
+    def test_release_racing_a_save_of_the_same_photo_keeps_the_file(self):
+        first = self.create_student()
+        storage = first.photo.storage
+        store = storage.save
+
+        def save_then_release(*args, **kwargs):
+            # The last other reference goes between storing the file and writing the new row
+            name = store(*args, **kwargs)
+            first.delete()
+            release_photo(name)
+            return name
+
+        with mock.patch.object(storage, 'save', side_effect=save_then_release):
+            second = self.create_student()
+        self.assertEqual(second.photo.name, first.photo.name)
+        with open(storage.path(second.photo.name), 'rb') as f:
+            self.assertEqual(f.read(), self.photo)
+
+    def test_migrate_command_moves_flat_files_into_the_hashed_layout(self):
+        student = self.create_student()
+        storage = student.photo.storage
+        legacy_name = FileSystemStorage().save('student_photos/legacy.jpg', ContentFile(make_jpeg(color=(1, 2, 3))))
+        Student.objects.filter(pk=student.pk).update(photo=legacy_name)
+
+        out = io.StringIO()
+        call_command('migrate_photo_storage', stdout=out)
+
+        student.refresh_from_db()
+        self.assertTrue(is_hashed_name(student.photo.name))
+        self.assertTrue(storage.exists(derivative_name(student.photo.name, 'thumb')))
+        self.assertFalse(storage.exists(legacy_name))
+        self.assertIn('Moved 1 photos', out.getvalue())
+
+    def test_migrate_command_keeps_a_photo_released_while_it_was_copied(self):
+        first = self.create_student()
+        storage = first.photo.storage
+        second = self.create_student()
+        legacy_name = FileSystemStorage().save('student_photos/legacy.jpg', ContentFile(self.photo))
+        Student.objects.filter(pk=second.pk).update(photo=legacy_name)
+        store = storage.save
+
+        def save_then_release(*args, **kwargs):
+            # The first student's photo is replaced while the command copies the same capture
+            name = store(*args, **kwargs)
+            Student.objects.filter(pk=first.pk).update(photo='')
+            release_photo(name)
+            return name
+
+        with mock.patch.object(storage, 'save', side_effect=save_then_release):
+            call_command('migrate_photo_storage', stdout=io.StringIO())
+
+        second.refresh_from_db()
+        self.assertEqual(second.photo.name, first.photo.name)
+        with open(storage.path(second.photo.name), 'rb') as f:
+            self.assertEqual(f.read(), self.photo)
+        self.assertTrue(storage.exists(derivative_name(second.photo.name, 'thumb')))
+        self.assertFalse(storage.exists(legacy_name))
+
+
+class MediaFileTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=self.media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        partner_user = User.objects.create_user(username='media_partner', password='password', role='PARTNER')
+        self.partner = Partner.objects.create(user=partner_user)
+        for username in ('media_institution', 'other_institution'):
+            user = User.objects.create_user(username=username, password='password', role='INSTITUTION')
+            Institution.objects.create(user=user)
+        self.student = Student(
+            student_name='Media Student', father_name='Father', class_name='1', village='Village',
+            mobile_number='9999999999', institution=Institution.objects.get(user__username='media_institution'),
+            partner=self.partner,
+        )
+        self.student.photo = ContentFile(make_jpeg(), name='capture.jpg')
+        self.student.save()
+        self.url = self.student.photo.url
+
+    def get(self, username, url=None, **headers):
+        self.client.login(username=username, password='password')
+        return self.client.get(url or self.url, headers=headers)
+
+    def test_owners_get_the_photo_with_immutable_caching(self):
+        with open(self.student.photo.path, 'rb') as f:
+            content = f.read()
+        for username in ('media_institution', 'media_partner'):
+            response = self.get(username)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), content)
+            self.assertEqual(response['Content-Type'], 'image/jpeg')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertIn('private', response['Cache-Control'])
+
+    def test_other_users_and_unknown_names_get_404(self):
+        self.assertEqual(self.get('other_institution').status_code, 404)
+        self.assertEqual(self.get('media_institution', url=f'{settings.MEDIA_URL}student_photos/missing.jpg').status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_derivatives_are_authorized_through_their_original(self):
+        response = self.get('media_partner', url=self.student.thumbnail_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.get('other_institution', url=self.student.thumbnail_url).status_code, 404)
+
+        # Without the current version the URL may outlive the derivative's content
+        response = self.get('media_partner', url=self.student.thumbnail_url.split('?')[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn(f'?v={DERIVATIVE_VERSION}', self.student.thumbnail_url)
+
+    def test_range_and_conditional_requests(self):
+        response = self.get('media_institution', Range='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(len(b''.join(response.streaming_content)), 10)
+
+        etag = self.get('media_institution')['ETag']
+        response = self.get('media_institution', If_None_Match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    @override_settings(MEDIA_SENDFILE_BACKEND='x-accel-redirect')
+    def test_accel_redirect_hands_the_file_to_the_front_end(self):
+        response = self.get('media_institution')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.student.photo.name}')
+        self.assertEqual(response.content, b'')
+
+    @override_settings(MEDIA_SENDFILE_BACKEND='x-sendfile')
+    def test_sendfile_names_the_stored_path(self):
+        response = self.get('media_partner')
+        self.assertEqual(response['X-Sendfile'], self.student.photo.path)
+
+
+class StudentImportTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=self.media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        user = User.objects.create_user(username='import_institution', password='password', role='INSTITUTION')
+        self.institution = Institution.objects.create(user=user)
+        self.client.login(username='import_institution', password='password')
+
+    def sheet(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['Unique ID', 'Student Name', "Father's Name", 'Class', 'Village', 'Mobile Number'])
+        writer.writerows(rows)
+        return SimpleUploadedFile('students.csv', buffer.getvalue().encode('utf-8'), content_type='text/csv')
+
+    def photos(self, names, make_photo=make_jpeg):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for i, name in enumerate(names):
+                archive.writestr(f'Photos/{name}.jpg', make_photo(color=(i * 30, 10, 10)))
+        return SimpleUploadedFile('photos.zip', buffer.getvalue(), content_type='application/zip')
+
+    def test_import_creates_students_with_photos(self):
+        response = self.client.post(reverse('student_import'), {
+            'sheet': self.sheet([
+                ['S0500', 'Asha', 'Father A', '3', 'Village', '1111111111'],
+                ['', 'Ravi', 'Father R', 'Tuition', 'Village', '2222222222'],
+                ['', 'Meena', 'Father M', 'LKG', 'Village', '3333333333'],
+            ]),
+            'photos': self.photos(['S0500', '3']),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['result'].committed)
+        self.assertContains(response, 'Imported 3 students')
+
+        students = {s.student_name: s for s in Student.objects.filter(institution=self.institution)}
+        self.assertEqual(len(students), 3)
+        self.assertEqual(len({s.unique_id for s in students.values()}), 3)
+        self.assertNotEqual(students['Asha'].unique_id, 'S0500')
+        self.assertEqual((students['Ravi'].class_name, students['Ravi'].other_class), ('Other', 'Tuition'))
+        self.assertTrue(students['Asha'].photo)
+        self.assertTrue(students['Ravi'].photo)
+        self.assertFalse(students['Meena'].photo)
+        self.assertTrue(students['Asha'].photo.storage.exists(derivative_name(students['Asha'].photo.name, 'thumb')))
+
+    def test_import_accepts_phone_camera_mpo_photos(self):
+        response = self.client.post(reverse('student_import'), {
+            'sheet': self.sheet([['', 'Asha', 'Father A', '3', 'Village', '1111111111']]),
+            'photos': self.photos(['2'], make_photo=make_mpo),
+        })
+        self.assertTrue(response.context['result'].committed)
+        student = Student.objects.get(institution=self.institution, student_name='Asha')
+        with student.photo.open('rb') as photo:
+            self.assertEqual(Image.open(photo).format, 'JPEG')
+
+    def test_invalid_rows_roll_back_the_whole_import(self):
+        response = self.client.post(reverse('student_import'), {
+            'sheet': self.sheet([
+                ['', 'Asha', 'Father A', '3', 'Village', '1111111111'],
+                ['', '', 'Father R', '4', 'Village', '2222222222'],
+                ['', 'Meena', 'Father M', 'LKG', 'Village', '3' * 20],
+            ]),
+            'photos': self.photos(['2']),
+        })
+        self.assertEqual(response.status_code, 400)
+        result = response.context['result']
+        self.assertFalse(result.committed)
+        self.assertEqual([row['row'] for row in result.rows], [3, 4])
+        self.assertIn('student_name', result.rows[0]['errors'])
+        self.assertIn('mobile_number', result.rows[1]['errors'])
+        self.assertFalse(Student.objects.exists())
+        self.assertEqual(os.listdir(self.media_root), [])
+
+    def test_photos_are_encoded_before_the_insert_transaction(self):
+        depth = len(connection.savepoint_ids)
+        seen = []
+
+        def ingest(photo):
+            seen.append(len(connection.savepoint_ids))
+            return ingest_photo(photo)
+
+        with mock.patch('core.forms.ingest_photo', side_effect=ingest):
+            response = self.client.post(reverse('student_import'), {
+                'sheet': self.sheet([['', 'Asha', 'Father A', '3', 'Village', '1111111111']]),
+                'photos': self.photos(['2']),
+            })
+        self.assertTrue(response.context['result'].committed)
+        self.assertEqual(seen, [depth])
+
+    def test_unreadable_uploads_are_reported_on_their_field(self):
+        header = 'Unique ID,Student Name,Father\'s Name,Class,Village,Mobile Number\n'.encode()
+        uploads = [
+            ({'sheet': SimpleUploadedFile('students.csv', header + b',Asha,F,3,V,1\xff\xfe\n')}, 'sheet'),
+            ({'sheet': SimpleUploadedFile('students.xlsx', b'not a workbook')}, 'sheet'),
+            ({'sheet': self.sheet([]), 'photos': SimpleUploadedFile('photos.zip', b'not a zip')}, 'photos'),
+        ]
+        for data, field in uploads:
+            response = self.client.post(reverse('student_import'), data)
+            self.assertEqual(response.status_code, 400, field)
+            self.assertEqual(list(response.context['form'].errors), [field])
+
+    def test_a_failed_insert_releases_the_stored_photos(self):
+        with mock.patch('core.imports.bump_student_versions', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                self.client.post(reverse('student_import'), {
+                    'sheet': self.sheet([['', 'Asha', 'Father A', '3', 'Village', '1111111111']]),
+                    'photos': self.photos(['2']),
+                })
+        self.assertFalse(Student.objects.exists())
+        self.assertEqual([files for _, _, files in os.walk(self.media_root) if files], [])
+
+    def test_command_imports_an_xlsx_sheet(self):
+        workbook = Workbook()
+        workbook.active.append(['Unique ID', 'Student Name', "Father's Name", 'Class', 'Village', 'Mobile Number'])
+        workbook.active.append(['', 'Kiran', 'Father K', 10, 'Village', 4444444444])
+        path = os.path.join(self.media_root, 'students.xlsx')
+        workbook.save(path)
+
+        out = io.StringIO()
+        call_command('import_students', 'import_institution', path, stdout=out)
+        self.assertIn('Imported 1 students', out.getvalue())
+        student = Student.objects.get()
+        self.assertEqual((student.class_name, student.mobile_number), ('10', '4444444444'))
+
+
+class IdCardRenderingTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            CARD_CACHE_ROOT=os.path.join(self.media_root, 'card_cache'),
+        )
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        user = User.objects.create_user(username='card_institution', password='password', role='INSTITUTION')
+        self.institution = Institution.objects.create(user=user)
+        self.students = []
+        for i in range(3):
+            student = Student(
+                student_name=f'Card Student {i}', father_name='Father', class_name='5',
+                village='Village', mobile_number='9999999999', institution=self.institution,
+            )
+            student.photo = ContentFile(make_jpeg(color=(i * 50, 100, 100)), name='capture.jpg')
+            student.save()
+            self.students.append(student)
+
+    def test_only_changed_students_are_re_rendered(self):
+        paths, rendered = render_cards(card_queryset(Student.objects.all()))
+        self.assertEqual(rendered, 3)
+        with Image.open(paths[0]) as card:
+            self.assertEqual(card.size, CARD_SIZE)
+
+        _, rendered = render_cards(card_queryset(Student.objects.all()))
+        self.assertEqual(rendered, 0)
+
+        Student.objects.filter(pk=self.students[1].pk).update(village='New Village')
+        new_paths, rendered = render_cards(card_queryset(Student.objects.all()))
+        self.assertEqual(rendered, 1)
+        self.assertEqual([p == q for p, q in zip(paths, new_paths)], [True, False, True])
+
+    def test_card_views(self):
+        self.client.login(username='card_institution', password='password')
+        response = self.client.get(reverse('student_card', kwargs={'pk': self.students[0].pk}))
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+        response = self.client.get(reverse('id_cards'), {'class_name': '5'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_class_filter_matches_the_printed_class(self):
+        tuition = Student.objects.create(
+            student_name='Tuition Student', father_name='Father', class_name='Other', other_class='Tuition',
+            village='Village', mobile_number='9999999999', institution=self.institution,
+        )
+        self.students[0].class_name, self.students[0].other_class = 'Other', '5'
+        self.students[0].save()
+        students = Student.objects.filter(institution=self.institution)
+        self.assertEqual(list(students.filter(card_class_filter('Tuition'))), [tuition])
+        self.assertEqual(students.filter(card_class_filter('5')).count(), 3)
+        self.assertFalse(students.filter(card_class_filter('Other')).exists())
+
+    def test_sheets_are_written_a_few_pages_at_a_time_into_one_pdf(self):
+        paths, _ = render_cards(card_queryset(Student.objects.all()))
+        for output in (io.BytesIO(), os.path.join(self.media_root, 'cards.pdf')):
+            with mock.patch('core.cards.CARD_PDF_PAGES_PER_SAVE', 2):
+                write_sheets(paths * 17, output)
+            if isinstance(output, str):
+                with open(output, 'rb') as f:
+                    pdf = f.read()
+            else:
+                pdf = output.getvalue()
+            self.assertTrue(pdf.startswith(b'%PDF'))
+            self.assertEqual(len(PdfParser.PdfParser(buf=pdf).pages), 6)
+
+    def test_concurrent_renders_of_one_card_use_their_own_partial_files(self):
+        student = card_queryset(Student.objects.filter(pk=self.students[0].pk))[0]
+        data, photo_path = card_data(student), student.photo.path
+        path = card_cache_path(card_cache_key(data, photo_path))
+        barrier = threading.Barrier(2)
+        partials = []
+
+        def draw(*args):
+            # Both threads have opened their partial file before either writes
+            barrier.wait(timeout=5)
+            return draw_card(*args)
+
+        real_mkstemp = tempfile.mkstemp
+
+        def mkstemp(*args, **kwargs):
+            fd, name = real_mkstemp(*args, **kwargs)
+            partials.append(name)
+            return fd, name
+
+        with mock.patch('core.cards.draw_card', side_effect=draw), mock.patch('core.cards.tempfile.mkstemp', side_effect=mkstemp):
+            threads = [threading.Thread(target=_render_to_cache, args=(path, data, photo_path)) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(set(partials)), 2)
+        self.assertFalse(any(os.path.exists(name) for name in partials))
+        with Image.open(path) as card:
+            card.verify()
+
+    def test_the_cards_view_renders_a_bounded_number_per_request(self):
+        self.client.login(username='card_institution', password='password')
+        with override_settings(CARD_RENDER_REQUEST_LIMIT=2):
+            response = self.client.get(reverse('id_cards'))
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+            self.assertContains(response, '1 are still to be rendered', status_code=503)
+            response = self.client.get(reverse('id_cards'))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(render_cards(card_queryset(Student.objects.all()))[1], 0)
+
+    def test_command_renders_over_a_spawned_process_pool(self):
+        output = os.path.join(self.media_root, 'cards.pdf')
+        stdout = io.StringIO()
+        call_command('render_id_cards', 'card_institution', output, '--workers', '2', stdout=stdout)
+        self.assertIn('Wrote 3 cards', stdout.getvalue())
+        self.assertIn('3 rendered', stdout.getvalue())
+        self.assertEqual(render_cards(card_queryset(Student.objects.all()))[1], 0)
+        with open(output, 'rb') as f:
+            self.assertTrue(f.read().startswith(b'%PDF'))
+
+    def test_other_institutions_cannot_fetch_a_card(self):
+        other = User.objects.create_user(username='other_card_institution', password='password', role='INSTITUTION')
+        Institution.objects.create(user=other)
+        self.client.login(username='other_card_institution', password='password')
+        response = self.client.get(reverse('student_card', kwargs={'pk': self.students[0].pk}))
+        self.assertEqual(response.status_code, 404)
+
+
+class BenchmarkCommandTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_override = override_settings(
+            MEDIA_ROOT=self.media_root, EXPORT_CACHE_ROOT=os.path.join(self.media_root, 'export_cache')
+        )
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+    def test_seed_data_covers_every_class_with_photos(self):
+        call_command('seed_data', '--institutions', '2', '--partners', '2', '--students', '60', '--photos', '3', stdout=io.StringIO())
+        self.assertEqual(Student.objects.count(), 60)
+        self.assertEqual(set(Student.objects.values_list('class_name', flat=True)), {value for value, _ in Student.CLASS_CHOICES})
+        self.assertEqual(Student.objects.exclude(photo='').values('photo').distinct().count(), 3)
+        self.assertTrue(self.client.login(username='seed_institution_0', password='password'))
+        self.assertEqual(allocate_student_ids(1), ['S0061'])
+
+        with self.assertRaises(CommandError):
+            call_command('seed_data', '--students', '1', stdout=io.StringIO())
+
+    def test_benchmark_views_reports_every_view(self):
+        call_command('seed_data', '--institutions', '1', '--partners', '1', '--students', '30', '--photos', '2', stdout=io.StringIO())
+        output = os.path.join(self.media_root, 'views.json')
+        call_command('benchmark_views', '--repeat', '2', '--output', output, stdout=io.StringIO())
+
+        with open(output) as f:
+            views = json.load(f)['views']
+        self.assertEqual(set(views), {
+            'institution_dashboard', 'partner_dashboard', 'export_data_csv', 'export_data_xlsx',
+            'referral_student_add_get', 'referral_student_add_post', 'institution_lookup', 'user_list',
+            'student_admin_changelist',
+        })
+        for name, result in views.items():
+            self.assertIn(result['status'], (200, 302), name)
+            # After the warmup, institution lookups are answered from the cache alone
+            self.assertGreaterEqual(result['queries'], 0 if name == 'institution_lookup' else 1, name)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+        # The benchmarked enrollments are rolled back
+        self.assertEqual(Student.objects.count(), 30)
+
+
+class PerformanceMetricsTests(StudentExportTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.superuser = User.objects.create_superuser(username='metrics_admin', password='password')
+
+    def test_fingerprint_drops_values(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE a = 'x''y' AND b IN (%s, %s,  %s) LIMIT 21"),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) LIMIT ?',
+        )
+
+    def test_requests_are_recorded_per_url_name(self):
+        self.client.login(username='export_institution', password='password')
+        self.client.get(reverse('institution_dashboard'))
+        self.client.get(reverse('institution_dashboard'))
+
+        stats = registry.snapshot()['institution_dashboard']
+        self.assertEqual(stats['requests'], 2)
+        self.assertGreater(stats['queries'], 0)
+        self.assertGreater(stats['db_duration'], 0)
+        self.assertGreater(stats['response_bytes'], 0)
+        self.assertEqual(stats['streamed'], 0)
+
+    @override_settings(EXPORT_CACHE_ENABLED=False)
+    def test_streamed_responses_record_time_to_first_byte_and_their_queries(self):
+        self.client.login(username='export_admin', password='password')
+        response = self.client.get(reverse('export_data'), {'format': 'csv'})
+        self.assertNotIn('export_data', registry.snapshot())
+        body = b''.join(response.streaming_content)
+        response.close()
+
+        stats = registry.snapshot()['export_data']
+        self.assertEqual((stats['streamed'], stats['response_bytes']), (1, len(body)))
+        self.assertLessEqual(stats['first_byte'], stats['duration'])
+        # The export's rows are read while streaming, after the view has returned
+        self.assertGreaterEqual(stats['queries'], 2)
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_query_fingerprints(self):
+        self.client.login(username='export_institution', password='password')
+        with self.assertLogs('core.metrics', 'WARNING') as logs:
+            self.client.get(reverse('institution_dashboard'))
+        self.assertIn('Slow request to institution_dashboard', logs.output[-1])
+        self.assertIn('SELECT', logs.output[-1])
+
+    def test_metrics_endpoint_is_for_superusers_only(self):
+        self.client.login(username='export_admin', password='password')
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+
+        self.client.login(username='metrics_admin', password='password')
+        self.client.get(reverse('user_list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE idcard_request_duration_seconds histogram', text)
+        self.assertIn('idcard_request_duration_seconds_count{route="user_list"} 1', text)
+        self.assertIn('idcard_db_queries_total{route="user_list"}', text)
+
+
+class ReadOnlyRouterTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('core.routers.read_only_available', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = ReadOnlyRouter()
+
+    def test_reads_use_the_read_only_alias_only_inside_the_block(self):
+        self.assertIsNone(self.router.db_for_read(Student))
+        with read_only_database():
+            self.assertEqual(self.router.db_for_read(Student), 'readonly')
+        self.assertIsNone(self.router.db_for_read(Student))
+
+    def test_read_only_instances_are_written_through_default(self):
+        student = Student()
+        student._state.db = 'readonly'
+        self.assertEqual(self.router.db_for_write(Student, instance=student), 'default')
+        self.assertIsNone(self.router.db_for_write(Student))
+        self.assertFalse(self.router.allow_migrate('readonly', 'core'))
+        self.assertIsNone(self.router.db_for_write(Student, instance=Student()))
+
+
+
+class ReadOnlyDatabaseTests(TransactionTestCase):
+    """Point the read-only alias at a file copy of the test database, as it is in production."""
+
+    databases = {'default', 'readonly'}
+
+    def setUp(self):
+        user = User.objects.create_user(username='readonly_institution', password='password', role='INSTITUTION')
+        self.student = Student.objects.create(
+            student_name='Asha', father_name='Father', class_name='1', village='Village',
+            mobile_number='9999999999', institution=Institution.objects.create(user=user),
+        )
+        self.assertFalse(read_only_available())
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'db.sqlite3')
+        connection.ensure_connection()
+        copy = sqlite3.connect(path)
+        connection.connection.backup(copy)
+        copy.close()
+
+        # The mirror shares the default alias's settings dict, so swap in a copy rather than editing it
+        read_only = connections['readonly']
+        original = read_only.settings_dict
+        read_only.settings_dict = {**original, 'NAME': path}
+        read_only.close()
+
+        def restore():
+            read_only.close()
+            read_only.settings_dict = original
+        self.addCleanup(restore)
+
+    def test_reads_use_the_file_connection_and_writes_the_default(self):
+        self.assertTrue(read_only_available())
+        with CaptureQueriesContext(connections['readonly']) as reads, CaptureQueriesContext(connection) as defaults:
+            with read_only_database():
+                student = Student.objects.get(pk=self.student.pk)
+        self.assertEqual(student._state.db, 'readonly')
+        self.assertEqual((len(reads), len(defaults)), (1, 0))
+
+        with CaptureQueriesContext(connections['readonly']) as reads, CaptureQueriesContext(connection) as writes:
+            student.village = 'Elsewhere'
+            student.save(update_fields=['village'])
+        self.assertEqual(len(reads), 0)
+        self.assertTrue(any(query['sql'].startswith('UPDATE') for query in writes))
+        self.assertEqual(Student.objects.get(pk=student.pk).village, 'Elsewhere')
+
+        # Outside the block reads stay on the default connection
+        with CaptureQueriesContext(connections['readonly']) as reads:
+            Student.objects.count()
+        self.assertEqual(len(reads), 0)
+
+
+class SqliteJournalModeTests(SimpleTestCase):
+    def test_connections_leave_the_file_alone_and_the_migration_switches_it_to_wal(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'db.sqlite3')
+        sqlite3.connect(path).close()
+
+        def journal_mode():
+            with closing(sqlite3.connect(path)) as db:
+                return db.execute('PRAGMA journal_mode').fetchone()[0]
+
+        default = connections['default']
+        file_connection = default.__class__({**default.settings_dict, 'NAME': path}, alias='journal_mode_test')
+        try:
+            with file_connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            self.assertEqual(journal_mode(), 'delete')
+
+            wal_migration = import_module('core.migrations.0016_sqlite_wal')
+            wal_migration.use_wal(None, SimpleNamespace(connection=file_connection))
+            self.assertEqual(journal_mode(), 'wal')
+        finally:
+            file_connection.close()
+
+
+class DashboardFragmentCacheTests(StudentExportTestCase):
+    def setUp(self):
+        super().setUp()
+        fragment_stats.reset()
+        self.addCleanup(fragment_stats.reset)
+        self.client.login(username='export_institution', password='password')
+
+    def dashboard(self):
+        return self.client.get(reverse('institution_dashboard')).content.decode()
+
+    def test_unchanged_table_is_served_from_the_cache(self):
+        first = self.dashboard()
+        self.assertEqual((fragment_stats.hits, fragment_stats.misses), (0, 1))
+        self.assertEqual(self.dashboard(), first)
+        self.assertEqual((fragment_stats.hits, fragment_stats.misses), (1, 1))
+        self.assertEqual(fragment_stats.saved_seconds, fragment_stats.render_seconds)
+
+        other_page = self.client.get(reverse('institution_dashboard'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(other_page.status_code, 200)
+        self.assertEqual(fragment_stats.misses, 2)
+        self.assertIn('idcard_fragment_cache_hit_ratio 0.3333', registry.render())
+
+    def test_cached_table_skips_the_page_query(self):
+        self.dashboard()
+        with CaptureQueriesContext(connection) as queries:
+            self.dashboard()
+        self.assertEqual(fragment_stats.hits, 1)
+        self.assertFalse([q for q in queries.captured_queries if 'FROM "core_student"' in q['sql']])
+
+    def test_change_committed_during_render_is_not_cached_as_current(self):
+        page = KeysetPaginator.page
+
+        def page_then_edit(paginator, cursor=None):
+            result = page(paginator, cursor)
+            # Another request commits an edit after the rows were read but before the table renders
+            if not Student.objects.filter(student_name='Ravi Kumar').exists():
+                Student.objects.filter(student_name='Ravi').update(student_name='Ravi Kumar')
+                bump_owner_versions([f'institution-{self.institution.pk}'])
+            return result
+
+        with mock.patch.object(KeysetPaginator, 'page', page_then_edit):
+            self.assertNotIn('Ravi Kumar', self.dashboard())
+        self.assertIn('Ravi Kumar', self.dashboard())
+
+    def test_editing_a_student_refreshes_the_table(self):
+        self.dashboard()
+        ravi = Student.objects.get(student_name='Ravi')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('student_update', kwargs={'pk': ravi.pk}), {
+                'student_name': 'Ravi Kumar', 'father_name': 'Ravi Father', 'class_name': '1',
+                'village': 'Village', 'mobile_number': '9999999999', 'institution': self.institution.pk,
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('Ravi Kumar', self.dashboard())
+        self.assertEqual(fragment_stats.hits, 0)
+
+    def test_deleting_a_student_refreshes_the_table(self):
+        self.assertIn('Meena', self.dashboard())
+        meena = Student.objects.get(student_name='Meena')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('student_delete', kwargs={'pk': meena.pk}))
+        self.assertNotIn('Meena', self.dashboard())
+
+    def test_moving_a_student_bumps_the_old_and_new_owners(self):
+        other_partner = Partner.objects.create(
+            user=User.objects.create_user(username='other_partner', password='password', role='PARTNER')
+        )
+        owners = [f'institution-{self.institution.pk}', f'partner-{self.partner.pk}', f'partner-{other_partner.pk}']
+        before = [owner_version(owner) for owner in owners]
+        asha = Student.objects.get(student_name='Asha')
+        asha.partner = other_partner
+        with self.captureOnCommitCallbacks(execute=True):
+            asha.save()
+        after = [owner_version(owner) for owner in owners]
+        self.assertTrue(all(new > old for old, new in zip(before, after)), (before, after))
+
+
+class StudentSearchTests(StudentExportTestCase):
+    def search(self, text):
+        return sorted(search_students(Student.objects.all(), text).values_list('student_name', flat=True))
+
+    def test_every_word_matches_as_a_prefix_of_any_field(self):
+        self.assertEqual(self.search('me'), ['Meena'])
+        self.assertEqual(self.search('ravi fath'), ['Ravi'])
+        self.assertEqual(self.search('VILL 99999'), ['Asha', 'Meena', 'Ravi'])
+        self.assertEqual(self.search(Student.objects.get(student_name='Asha').unique_id), ['Asha'])
+        self.assertEqual(self.search('ravi meena'), [])
+        self.assertEqual(self.search('  '), ['Asha', 'Meena', 'Ravi'])
+
+    def test_query_syntax_is_treated_as_words(self):
+        self.assertEqual(search_terms('Ravi "OR" NEAR(x'), ['ravi', 'or', 'near', 'x'])
+        self.assertEqual(match_expression(['ravi', 'or']), '"ravi"* "or"*')
+        self.assertEqual(self.search('asha OR'), [])
+        self.assertEqual(self.search('student_name:asha'), [])
+
+    def test_index_follows_updates_deletes_and_bulk_inserts(self):
+        ravi = Student.objects.get(student_name='Ravi')
+        ravi.student_name, ravi.father_name = 'Kiran', 'Kiran Father'
+        ravi.save()
+        self.assertEqual(self.search('ravi'), [])
+        self.assertEqual(self.search('kiran'), ['Kiran'])
+
+        Student.objects.filter(student_name='Meena').update(village='Eluru')
+        self.assertEqual(self.search('eluru'), ['Meena'])
+        Student.objects.filter(student_name='Meena').delete()
+        self.assertEqual(self.search('eluru'), [])
+
+        seed_students(student_rows(3, [self.institution.pk], [], first_number=100))
+        self.assertEqual(len(self.search('s01')), 3)
+        self.assertEqual(search_students(Student.objects.all(), 'S0101').get().unique_id, 'S0101')
+
+    def test_owner_scoped_search_matches_the_same_words_through_the_owner_index(self):
+        owned = Student.objects.filter(institution=self.institution)
+        for text in ('me', 'ravi fath', 'VILL 99999', 'ather', 'ravi meena', 'asha OR'):
+            scoped = search_students(owned, text, owner_scoped=True)
+            self.assertEqual(sorted(scoped.values_list('student_name', flat=True)), self.search(text), text)
+        plan = search_students(owned, 'mee', owner_scoped=True).order_by('class_name', 'id').explain()
+        self.assertIn('student_inst_class_idx', plan)
+        self.assertNotIn(SEARCH_TABLE, plan)
+
+    def test_migrations_leave_the_index_and_its_triggers_in_place(self):
+        # A migration that rebuilds core_student on SQLite drops its triggers unless it recreates them
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT type, name FROM sqlite_master WHERE name LIKE %s", [f'{SEARCH_TABLE}%'])
+            objects = set(cursor.fetchall())
+        self.assertLessEqual({
+            ('table', SEARCH_TABLE),
+            ('trigger', f'{SEARCH_TABLE}_insert'),
+            ('trigger', f'{SEARCH_TABLE}_update'),
+            ('trigger', f'{SEARCH_TABLE}_delete'),
+        }, objects)
+
+    def test_dashboard_search_filters_the_table_and_keeps_the_query_in_pager_links(self):
+        self.client.login(username='export_institution', password='password')
+        response = self.client.get(reverse('institution_dashboard'), {'q': 'mee'})
+        self.assertEqual([student.student_name for student in response.context['students']], ['Meena'])
+        self.assertEqual(response.context['total_students'], 1)
+        self.assertContains(response, 'value="mee"')
+
+        everyone = self.client.get(reverse('institution_dashboard'))
+        self.assertEqual(everyone.context['total_students'], 3)
+        self.assertContains(everyone, 'Asha')
+
+        with override_settings(DASHBOARD_PAGE_SIZE=1):
+            cache.clear()
+            paged = self.client.get(reverse('institution_dashboard'), {'q': 'village'})
+        self.assertContains(paged, '&amp;q=village')
+
+    def test_admin_changelist_uses_the_search_index(self):
+        self.admin_user.is_staff = self.admin_user.is_superuser = True
+        self.admin_user.save()
+        self.client.login(username='export_admin', password='password')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:core_student_changelist'), {'q': 'asha fat'})
+        self.assertEqual(list(response.context['cl'].result_list.values_list('student_name', flat=True)), ['Asha'])
+        self.assertTrue(any('core_student_search' in query['sql'] for query in queries.captured_queries))
+
+    def test_admin_changelist_finds_part_of_an_id_or_mobile_number(self):
+        self.admin_user.is_staff = self.admin_user.is_superuser = True
+        self.admin_user.save()
+        self.client.login(username='export_admin', password='password')
+        Student.objects.filter(student_name='Asha').update(unique_id='S0012')
+        Student.objects.filter(student_name='Ravi').update(mobile_number='9876543210')
+
+        def search(text):
+            response = self.client.get(reverse('admin:core_student_changelist'), {'q': text})
+            return sorted(response.context['cl'].result_list.values_list('student_name', flat=True))
+
+        self.assertEqual(search('0012'), ['Asha'])
+        self.assertEqual(search('s001'), ['Asha'])
+        self.assertEqual(search('6543'), ['Ravi'])
+        # Words still match by prefix only, through the index
+        self.assertEqual(search('sha'), [])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(search('mee'), ['Meena'])
+        self.assertFalse(any('LIKE' in query['sql'] for query in queries.captured_queries))
+
+
+class StudentApiTests(StudentExportTestCase):
+    def get(self, name, username, **params):
+        self.client.login(username=username, password='password')
+        return self.client.get(reverse(name), params)
+
+    def test_students_are_scoped_like_the_dashboards(self):
+        response = self.get('api_partner_students', 'export_partner')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['student_name'] for row in response.json()['results']], ['Asha', 'Meena'])
+        self.assertEqual(set(response.json()['results'][0]), {
+            'id', 'unique_id', 'student_name', 'father_name', 'class_name', 'other_class', 'village', 'mobile_number',
+        })
+
+        response = self.get('api_institution_students', 'export_institution')
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertEqual(self.get('api_partner_students', 'export_institution').status_code, 403)
+
+    def test_only_requested_fields_are_selected(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get('api_partner_students', 'export_partner', fields='unique_id,thumbnail,institution_name')
+        asha = response.json()['results'][0]
+        self.assertEqual(set(asha), {'unique_id', 'thumbnail', 'institution_name'})
+        self.assertEqual(asha['institution_name'], 'export_institution')
+        self.assertTrue(asha['thumbnail'].startswith(settings.MEDIA_URL))
+        student_query = next(q['sql'] for q in queries.captured_queries if 'core_student' in q['sql'])
+        self.assertNotIn('father_name', student_query)
+
+        response = self.get('api_partner_students', 'export_partner', fields='unique_id,password')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['fields'], ['password'])
+
+    @override_settings(API_PAGE_SIZE=2)
+    def test_cursor_pagination(self):
+        first = self.get('api_institution_students', 'export_institution', fields='student_name').json()
+        self.assertEqual([row['student_name'] for row in first['results']], ['Asha', 'Ravi'])
+        self.assertIsNone(first['previous'])
+        self.assertIn('fields=student_name', first['next'])
+
+        second = self.client.get(first['next']).json()
+        self.assertEqual(second['results'], [{'student_name': 'Meena'}])
+        self.assertIsNone(second['next'])
+        self.assertEqual(self.client.get(second['previous']).json()['results'], first['results'])
+        self.assertEqual(self.get('api_institution_students', 'export_institution', cursor='nope').status_code, 400)
+
+    def test_malformed_cursor_is_rejected(self):
+        for values in ({'k': 5}, ['1', 'x'], [None, None], [[], {}], ['A']):
+            cursor = encode_cursor(values, 'next')
+            response = self.get('api_institution_students', 'export_institution', cursor=cursor)
+            self.assertEqual(response.status_code, 400, values)
+            self.assertEqual(response.json(), {'error': 'Invalid cursor'})
+        self.assertEqual(self.get('api_institution_students', 'export_institution', cursor=encode_cursor(['A', 1], 'up')).status_code, 400)
+
+    def test_conditional_get_until_the_owner_changes(self):
+        response = self.get('api_partner_students', 'export_partner')
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        self.assertEqual(self.client.get(reverse('api_partner_students'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(
+            self.client.get(reverse('api_partner_students'), HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304
+        )
+
+        asha = Student.objects.get(student_name='Asha')
+        asha.village = 'Eluru'
+        asha.save()
+        # Versions live in the database, so a process with its own (here: emptied) cache sees the bump too
+        cache.clear()
+        response = self.client.get(reverse('api_partner_students'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response['ETag'], self.get('api_partner_students', 'export_partner')['ETag'])
+
+    def test_renaming_an_institution_changes_its_partners_etags(self):
+        response = self.get('api_partner_students', 'export_partner', fields='student_name,institution_name')
+        etag = response['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.institution_user.username = 'renamed_institution'
+            self.institution_user.save()
+        response = self.client.get(
+            reverse('api_partner_students'), {'fields': 'student_name,institution_name'}, HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({item['institution_name'] for item in response.json()['results']}, {'renamed_institution'})
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class StudentSyncTests(StudentExportTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.login(username='export_partner', password='password')
+
+    def sync(self, token=None, **params):
+        if token:
+            params['token'] = token
+        response = self.client.get(reverse('api_partner_sync'), {'fields': 'unique_id,student_name', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_first_sync_returns_every_student_and_then_nothing(self):
+        first = self.sync()
+        self.assertEqual(sorted(row['student_name'] for row in first['changed']), ['Asha', 'Meena'])
+        self.assertEqual(first['deleted'], [])
+        self.assertFalse(first['more'])
+
+        again = self.sync(first['token'])
+        self.assertEqual((again['changed'], again['deleted']), ([], []))
+        self.assertEqual(self.client.get(reverse('api_partner_sync'), {'token': 'junk'}).status_code, 400)
+
+    def test_renaming_the_institution_resends_its_students(self):
+        token = self.sync()['token']
+        self.institution_user.username = 'renamed_institution'
+        self.institution_user.save()
+        delta = self.sync(token)
+        self.assertEqual(sorted(row['student_name'] for row in delta['changed']), ['Asha', 'Meena'])
+
+    def test_changes_creations_moves_and_deletes_since_the_token(self):
+        token = self.sync()['token']
+        asha = Student.objects.get(student_name='Asha')
+        asha.village = 'Eluru'
+        asha.save()
+        self.create_student('Kiran', '2', partner=self.partner)
+        meena = Student.objects.get(student_name='Meena')
+        meena.partner = None
+        meena.save()
+        Student.objects.filter(student_name='Ravi').delete()
+
+        delta = self.sync(token)
+        self.assertEqual(sorted(row['student_name'] for row in delta['changed']), ['Asha', 'Kiran'])
+        self.assertEqual(delta['deleted'], [{'id': meena.pk, 'unique_id': meena.unique_id}])
+
+        self.client.login(username='export_institution', password='password')
+        response = self.client.get(reverse('api_institution_sync'), {'token': token})
+        self.assertEqual({row['student_name'] for row in response.json()['changed']}, {'Asha', 'Kiran', 'Meena'})
+        self.assertEqual([row['student_name'] for row in response.json()['changed']][-1], 'Meena')
+        self.assertEqual(len(response.json()['deleted']), 1)
+
+    def test_a_student_moved_away_and_back_is_not_reported_deleted(self):
+        token = self.sync()['token']
+        asha = Student.objects.get(student_name='Asha')
+        asha.partner = None
+        asha.save()
+        asha.partner = self.partner
+        asha.save()
+        self.assertEqual(StudentTombstone.objects.filter(partner_id=self.partner.pk).count(), 1)
+
+        delta = self.sync(token)
+        self.assertEqual([row['student_name'] for row in delta['changed']], ['Asha'])
+        self.assertEqual(delta['deleted'], [])
+
+    @override_settings(SYNC_PAGE_SIZE=1)
+    def test_large_deltas_come_in_pages(self):
+        seen, token, more = [], None, True
+        while more:
+            page = self.sync(token)
+            seen += [row['student_name'] for row in page['changed']]
+            token, more = page['token'], page['more']
+        self.assertEqual(sorted(seen), ['Asha', 'Meena'])
+
+    def test_unsettled_saves_wait_for_the_next_sync(self):
+        with override_settings(SYNC_SETTLE_SECONDS=60):
+            self.assertEqual(self.sync()['changed'], [])
+
+    def test_sync_reads_changes_through_the_owner_index(self):
+        students = Student.objects.filter(partner=self.partner, updated_at__gt=timezone.now()).order_by('updated_at', 'id')
+        self.assertIn('student_partner_updated_idx', students.explain())
+
+    def test_raw_inserts_carry_updated_at(self):
+        seed_students(student_rows(2, [self.institution.pk], [self.partner.pk], first_number=100))
+        self.assertFalse(Student.objects.filter(updated_at=None).exists())
+
+
+class BatchEnrollmentTests(StudentExportTestCase):
+    def record(self, key, name, **fields):
+        return {
+            'key': key, 'student_name': name, 'father_name': f'{name} Father', 'class_name': '4',
+            'village': 'Eluru', 'mobile_number': '9876543210', 'photo': f'photo-{key}', **fields,
+        }
+
+    def setUp(self):
+        super().setUp()
+        self.token = f'Token {self.institution.api_token}'
+
+    def enroll(self, records, photos=None, url=None):
+        payload = {'records': json.dumps(records)}
+        for key in photos if photos is not None else [record['key'] for record in records]:
+            payload[f'photo-{key}'] = SimpleUploadedFile(f'{key}.jpg', make_jpeg(color=(len(key) * 20, 0, 0)))
+        return self.client.post(url or reverse('api_institution_enroll'), payload, headers={'Authorization': self.token})
+
+    def test_institution_batch_creates_students_with_photos_in_one_request(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.enroll([self.record('a1', 'Kiran'), self.record('a2', 'Divya', class_name='Other', other_class='Tuition')])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['created'], 2)
+        self.assertEqual([result['status'] for result in body['results']], ['created', 'created'])
+
+        kiran = Student.objects.get(unique_id=body['results'][0]['unique_id'])
+        self.assertEqual((kiran.student_name, kiran.institution, kiran.partner), ('Kiran', self.institution, None))
+        self.assertTrue(is_hashed_name(kiran.photo.name))
+        self.assertTrue(kiran.photo.storage.exists(derivative_name(kiran.photo.name, 'thumb')))
+        self.assertEqual(EnrollmentReceipt.objects.filter(scope=f'institution-{self.institution.pk}').count(), 2)
+
+    def test_retries_return_the_first_result_without_duplicates(self):
+        first = self.enroll([self.record('a1', 'Kiran')]).json()
+        retry = self.enroll([self.record('a1', 'Kiran'), self.record('a2', 'Divya')]).json()
+        self.assertEqual(retry['created'], 1)
+        self.assertEqual(retry['results'][0], {
+            'key': 'a1', 'status': 'duplicate', 'unique_id': first['results'][0]['unique_id'], 'errors': {},
+        })
+        self.assertEqual(Student.objects.filter(student_name='Kiran').count(), 1)
+
+    def test_a_key_reused_for_different_data_is_refused(self):
+        first = self.enroll([self.record('a1', 'Kiran')]).json()
+        response = self.enroll([self.record('a1', 'Divya'), self.record('a2', 'Meera')])
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['keys'], ['a1'])
+        self.assertFalse(Student.objects.filter(student_name__in=['Divya', 'Meera']).exists())
+        # The original record is still answered as a retry
+        retry = self.enroll([self.record('a1', 'Kiran')]).json()
+        self.assertEqual(retry['results'][0]['unique_id'], first['results'][0]['unique_id'])
+
+    def test_derivatives_wait_for_the_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            body = self.enroll([self.record('a1', 'Kiran')]).json()
+        student = Student.objects.get(unique_id=body['results'][0]['unique_id'])
+        thumb = derivative_name(student.photo.name, 'thumb')
+        self.assertFalse(student.photo.storage.exists(thumb))
+        for callback in callbacks:
+            callback()
+        self.assertTrue(student.photo.storage.exists(thumb))
+
+    def test_invalid_records_are_reported_while_the_rest_are_enrolled(self):
+        records = [self.record('ok', 'Kiran'), self.record('bad', '', class_name='12'), self.record('nophoto', 'Divya')]
+        response = self.enroll(records, photos=['ok', 'bad'])
+        results = {result['key']: result for result in response.json()['results']}
+        self.assertEqual(results['ok']['status'], 'created')
+        self.assertEqual(results['bad']['status'], 'invalid')
+        self.assertEqual(set(results['bad']['errors']), {'student_name', 'class_name'})
+        self.assertIn('photo', results['nophoto']['errors'])
+        self.assertFalse(EnrollmentReceipt.objects.filter(key__in=['bad', 'nophoto']).exists())
+
+        rejected = self.client.post(reverse('api_institution_enroll'), {
+            'records': json.dumps([self.record('junk', 'Kiran')]),
+            'photo-junk': SimpleUploadedFile('junk.jpg', b'not an image'),
+        }, headers={'Authorization': self.token})
+        self.assertEqual(rejected.json()['results'][0]['errors'], {'photo': ['Upload a valid image.']})
+
+    def test_malformed_batches_are_rejected(self):
+        for records in ('not json', '{}', '[]', json.dumps([{'student_name': 'No key'}]), json.dumps([{'key': 'a'}, {'key': 'a'}])):
+            response = self.client.post(reverse('api_institution_enroll'), {'records': records}, headers={'Authorization': self.token})
+            self.assertEqual(response.status_code, 400, records)
+
+    def test_institution_endpoint_needs_the_token_not_a_session(self):
+        self.client.login(username='export_institution', password='password')
+        for token in (None, 'Token not-a-uuid', f'Token {uuid.uuid4()}', f'Bearer {self.institution.api_token}'):
+            self.token = token or ''
+            response = self.enroll([self.record('a1', 'Kiran')])
+            self.assertEqual(response.status_code, 401, token)
+            self.assertEqual(response['WWW-Authenticate'], 'Token')
+            self.assertIn('error', response.json())
+        self.assertFalse(Student.objects.filter(student_name='Kiran').exists())
+
+    def test_referral_batch_enrolls_for_the_partner(self):
+        url = reverse('api_referral_enroll', kwargs={'referral_code': self.partner.referral_code})
+        response = self.enroll([self.record('r1', 'Kiran', institution=self.institution.pk)], url=url)
+        self.assertEqual(response.json()['results'][0]['status'], 'created')
+        self.assertEqual(Student.objects.get(student_name='Kiran').partner, self.partner)
+        self.assertTrue(EnrollmentReceipt.objects.filter(scope=f'partner-{self.partner.pk}', key='r1').exists())
+
+    def test_enrollment_endpoints_skip_csrf_and_answer_errors_in_json(self):
+        client = Client(enforce_csrf_checks=True)
+        url = reverse('api_referral_enroll', kwargs={'referral_code': self.partner.referral_code})
+        payload = {'records': json.dumps([self.record('r1', 'Kiran', institution=self.institution.pk)]), 'photo-r1': SimpleUploadedFile('r1.jpg', make_jpeg())}
+        self.assertEqual(client.post(url, payload).json()['results'][0]['status'], 'created')
+        payload['photo-r1'].seek(0)
+        response = client.post(reverse('api_institution_enroll'), payload, headers={'Authorization': self.token})
+        self.assertEqual(response.status_code, 200)
+
+        not_allowed = client.get(url)
+        self.assertEqual((not_allowed.status_code, not_allowed['Allow']), (405, 'POST'))
+        self.assertIn('error', not_allowed.json())
+        unknown = client.post(reverse('api_referral_enroll', kwargs={'referral_code': uuid.uuid4()}), payload)
+        self.assertEqual(unknown.status_code, 404)
+        self.assertEqual(unknown.json(), {'error': 'Unknown referral link'})
+
+
+# Committed data: the async views read through executor threads with their own connections
+@override_settings(ROOT_URLCONF='id_card_project.asgi_urls')
+class AsyncViewTests(StudentExportFixture, TransactionTestCase):
+    async def login(self, username):
+        client = AsyncClient()
+        await client.aforce_login(await User.objects.aget(username=username))
+        return client
+
+    async def test_asgi_urls_route_to_the_async_views(self):
+        for name in ('institution_dashboard', 'partner_dashboard', 'export_data', 'student_add', 'api_institution_enroll'):
+            self.assertEqual(resolve(reverse(name)).func.__module__, 'core.async_views')
+        referral_url = reverse('referral_student_add', kwargs={'referral_code': self.partner.referral_code})
+        self.assertEqual(resolve(referral_url).func.__module__, 'core.async_views')
+        self.assertEqual(resolve(reverse('student_import')).func.__module__, 'core.views')
+
+    def test_only_the_asgi_settings_select_the_async_urls(self):
+        self.assertEqual(settings_asgi.ROOT_URLCONF, 'id_card_project.asgi_urls')
+        # Management commands and tests keep the sync URLconf whatever the environment
+        self.assertEqual(project_settings.ROOT_URLCONF, 'id_card_project.urls')
+
+    async def test_dashboards_render_like_the_sync_views(self):
+        registry.reset()
+        client = await self.login('export_institution')
+        response = await client.get(reverse('institution_dashboard'), {'q': 'mee'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([student.student_name for student in response.context['students']], ['Meena'])
+        self.assertEqual(response.context['total_students'], 1)
+        # Queries made by the async ORM's threads are counted for the route
+        self.assertGreater(registry.snapshot()['institution_dashboard']['queries'], 0)
+
+        client = await self.login('export_partner')
+        response = await client.get(reverse('partner_dashboard'))
+        self.assertContains(response, 'export_institution')
+        self.assertEqual(response.context['total_students'], 2)
+        self.assertEqual((await client.get(reverse('institution_dashboard'))).status_code, 302)
+
+    @override_settings(EXPORT_CACHE_ENABLED=False)
+    async def test_export_streams_from_an_async_iterator(self):
+        client = await self.login('export_admin')
+        response = await client.get(reverse('export_data'), {'format': 'csv'})
+        self.assertTrue(response.is_async)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join([chunk async for chunk in response.streaming_content])))
+        self.assertIn('Tuition/student_data.csv', archive.namelist())
+        self.assertEqual(len([name for name in archive.namelist() if '/Photos/' in name]), 3)
+
+    @override_settings(EXPORT_CACHE_ENABLED=True)
+    async def test_cached_export_is_served_as_a_file(self):
+        client = await self.login('export_partner')
+        response = await client.get(reverse('export_data'), {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        self.assertFalse(response.is_async)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len([name for name in archive.namelist() if '/Photos/' in name]), 2)
+
+    async def test_batch_enrollment(self):
+        institution = await Institution.objects.aget(user__username='export_institution')
+        client = AsyncClient(enforce_csrf_checks=True)
+        headers = {'Authorization': f'Token {institution.api_token}'}
+        records = [{
+            'key': 'k1', 'student_name': 'Kiran', 'father_name': 'Father', 'class_name': '4',
+            'village': 'Eluru', 'mobile_number': '9876543210', 'photo': 'p1',
+        }]
+        payload = {'records': json.dumps(records), 'p1': SimpleUploadedFile('p1.jpg', make_jpeg())}
+        response = await client.post(reverse('api_institution_enroll'), payload, headers=headers)
+        self.assertEqual(response.json()['results'][0]['status'], 'created')
+        payload['p1'].seek(0)
+        retry = await client.post(reverse('api_institution_enroll'), payload, headers=headers)
+        self.assertEqual(retry.json()['results'][0]['status'], 'duplicate')
+        self.assertEqual(await Student.objects.filter(student_name='Kiran').acount(), 1)
+        self.assertEqual((await client.post(reverse('api_institution_enroll'), payload)).status_code, 401)
+        unknown = await client.get(reverse('api_referral_enroll', kwargs={'referral_code': uuid.uuid4()}))
+        self.assertEqual((unknown.status_code, unknown.json()), (405, {'error': 'Method not allowed'}))
+        unknown = await client.post(reverse('api_referral_enroll', kwargs={'referral_code': uuid.uuid4()}), payload)
+        self.assertEqual((unknown.status_code, unknown.json()), (404, {'error': 'Unknown referral link'}))
+
+    async def test_blocking_calls_drop_obsolete_connections_around_the_work(self):
+        with mock.patch('core.async_views.close_old_connections') as close:
+            self.assertEqual(await run_blocking(lambda: close.call_count), 1)
+        self.assertEqual(close.call_count, 2)
+
+    async def test_dashboards_render_on_the_blocking_executor(self):
+        threads = []
+
+        def render_on_thread(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return render(*args, **kwargs)
+
+        client = await self.login('export_institution')
+        with mock.patch('core.async_views.render', side_effect=render_on_thread):
+            responses = await asyncio.gather(*[client.get(reverse('institution_dashboard')) for _ in range(2)])
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('async-blocking') for name in threads), threads)
+
+    async def test_form_enrollment_saves_photos_on_the_blocking_executor(self):
+        threads = []
+
+        def save_on_thread(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return _save_student_form(*args, **kwargs)
+
+        data = {'student_name': 'Kiran', 'father_name': 'Father', 'class_name': '4', 'village': 'Eluru', 'mobile_number': '9876543210'}
+        client = await self.login('export_institution')
+        referral_url = reverse('referral_student_add', kwargs={'referral_code': self.partner.referral_code})
+        with mock.patch('core.async_views._save_student_form', side_effect=save_on_thread):
+            response = await client.post(reverse('student_add'), {**data, 'photo': SimpleUploadedFile('kiran.jpg', make_jpeg())})
+            self.assertRedirects(response, reverse('institution_dashboard'), fetch_redirect_response=False)
+            response = await AsyncClient().post(
+                f'{referral_url}?institution={self.institution.pk}', {**data, 'student_name': 'Lata'},
+            )
+            self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+            response = await client.post(reverse('student_add'), {**data, 'photo': SimpleUploadedFile('bad.jpg', b'not an image')})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['form'].errors['photo'])
+
+        self.assertEqual(len(threads), 3)
+        self.assertTrue(all(name.startswith('async-blocking') for name in threads), threads)
+        kiran = await Student.objects.aget(student_name='Kiran')
+        self.assertTrue(kiran.photo.name)
+        self.assertEqual(await Student.objects.filter(student_name='Lata', partner=self.partner).acount(), 1)
+        self.assertEqual((await AsyncClient().get(f'{referral_url}?institution=x')).status_code, 404)
+
+    async def test_enrollment_runs_on_the_blocking_executor(self):
+        threads = []
+
+        def enroll(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return enroll_students(*args, **kwargs)
+
+        institution = await Institution.objects.aget(user__username='export_institution')
+        records = [{'key': 'k1', 'student_name': 'Kiran', 'father_name': 'Father', 'class_name': '4', 'village': 'Eluru', 'mobile_number': '9876543210'}]
+        with mock.patch('core.async_views.enroll_students', side_effect=enroll):
+            response = await AsyncClient().post(
+                reverse('api_institution_enroll'), {'records': json.dumps(records)},
+                headers={'Authorization': f'Token {institution.api_token}'},
+            )
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('async-blocking'), threads)
+
+    async def test_iterate_blocking_propagates_errors_and_stops_early(self):
+        def failing():
+            yield b'a'
+            raise ValueError('boom')
+
+        chunks = []
+        with self.assertRaises(ValueError):
+            async for chunk in iterate_blocking(failing):
+                chunks.append(chunk)
+        self.assertEqual(chunks, [b'a'])
+
+        produced = []
+
+        def endless():
+            for i in range(10_000):
+                produced.append(i)
+                yield i
+
+        stream = iterate_blocking(endless)
+        self.assertEqual(await anext(stream), 0)
+        await stream.aclose()
+        self.assertLess(len(produced), 100)
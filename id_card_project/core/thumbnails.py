@@ -0,0 +1,63 @@
+import hashlib
+import io
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Derivatives are bounded to these boxes, keeping the aspect ratio and never upscaling
+DERIVATIVE_SIZES = {
+    'thumb': (64, 64),
+    'print': (350, 450),
+}
+DERIVATIVE_QUALITY = 85
+# Derivative URLs carry this, so changing the sizes or quality moves them past long-lived browser caches
+DERIVATIVE_VERSION = hashlib.md5(
+    repr((sorted(DERIVATIVE_SIZES.items()), DERIVATIVE_QUALITY)).encode(), usedforsecurity=False
+).hexdigest()[:8]
+
+
+def derivative_name(name, size):
+    stem, _ = os.path.splitext(name)
+    return f'{stem}_{size}.jpg'
+
+
+def _render(image, box):
+    derivative = image.copy()
+    derivative.thumbnail(box, Image.LANCZOS)
+    buffer = io.BytesIO()
+    derivative.save(buffer, format='JPEG', quality=DERIVATIVE_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def generate_derivatives(name, storage=None, force=False):
+    """Write every derivative of the photo stored as ``name`` next to it.
+
+    Returns the number of derivative files written.
+    """
+    storage = storage or default_storage
+    wanted = {
+        size: derivative_name(name, size)
+        for size in DERIVATIVE_SIZES
+        if force or not storage.exists(derivative_name(name, size))
+    }
+    if not wanted:
+        return 0
+
+    with storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+    # Derivatives live at names derived from the original, not at their own content hash
+    save = getattr(storage, 'save_as', storage.save)
+    for size, target in wanted.items():
+        if storage.exists(target):
+            storage.delete(target)
+        save(target, ContentFile(_render(image, DERIVATIVE_SIZES[size])))
+    return len(wanted)
+
+
+def derivative_url(name, size, storage=None):
+    storage = storage or default_storage
+    return f'{storage.url(derivative_name(name, size))}?v={DERIVATIVE_VERSION}'
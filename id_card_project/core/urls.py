@@ -2,14 +2,18 @@ from django.urls import path
 from .views import (
     PartnerSignUpView, InstitutionSignUpView, referral_student_add,
     institution_dashboard, partner_dashboard, admin_dashboard, export_data,
-    StudentUpdateView, StudentDeleteView, student_add_by_institution,
-    user_list, UserCreateView, UserUpdateView, UserDeleteView, admin_reset_password,
+    export_job_create, export_job_status, export_job_download,
+    StudentUpdateView, StudentDeleteView, student_add_by_institution, student_import,
+    student_card, id_cards, institution_lookup, api_institution_students, api_partner_students,
+    api_institution_sync, api_partner_sync, api_institution_enroll, api_referral_enroll,
+    metrics, user_list, UserCreateView, UserUpdateView, UserDeleteView, admin_reset_password,
     home
 )
 from django.contrib.auth import views as auth_views
 
 urlpatterns = [
     path('', home, name='home'),
+    path('metrics/', metrics, name='metrics'),
     path('admin/users/', user_list, name='user_list'),
     path('admin/users/create/', UserCreateView.as_view(), name='user_create'),
     path('admin/users/<int:pk>/update/', UserUpdateView.as_view(), name='user_update'),
@@ -19,9 +23,22 @@ urlpatterns = [
     path('dashboard/institution/', institution_dashboard, name='institution_dashboard'),
     path('dashboard/partner/', partner_dashboard, name='partner_dashboard'),
     path('export/', export_data, name='export_data'),
+    path('export/jobs/', export_job_create, name='export_job_create'),
+    path('export/jobs/<int:pk>/', export_job_status, name='export_job_status'),
+    path('export/jobs/<int:pk>/download/', export_job_download, name='export_job_download'),
+    path('api/institution/students/', api_institution_students, name='api_institution_students'),
+    path('api/partner/students/', api_partner_students, name='api_partner_students'),
+    path('api/institution/sync/', api_institution_sync, name='api_institution_sync'),
+    path('api/partner/sync/', api_partner_sync, name='api_partner_sync'),
+    path('api/institution/enroll/', api_institution_enroll, name='api_institution_enroll'),
+    path('api/referral/<uuid:referral_code>/enroll/', api_referral_enroll, name='api_referral_enroll'),
+    path('institutions/lookup/', institution_lookup, name='institution_lookup'),
     path('student/add/', student_add_by_institution, name='student_add'),
+    path('student/import/', student_import, name='student_import'),
     path('student/<int:pk>/update/', StudentUpdateView.as_view(), name='student_update'),
     path('student/<int:pk>/delete/', StudentDeleteView.as_view(), name='student_delete'),
+    path('student/<int:pk>/card/', student_card, name='student_card'),
+    path('cards/', id_cards, name='id_cards'),
     path('referral/<uuid:referral_code>/', referral_student_add, name='referral_student_add'),
     path('signup/partner/', PartnerSignUpView.as_view(), name='partner_signup'),
     path('signup/institution/', InstitutionSignUpView.as_view(), name='institution_signup'),
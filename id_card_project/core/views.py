@@ -1,19 +1,35 @@
-import base64
-import uuid
-import zipfile
-import io
-import csv
+import hashlib
 import os
-from django.http import HttpResponse
-from openpyxl import Workbook
+import tempfile
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.core.files.base import ContentFile
 from django.shortcuts import render, redirect, get_object_or_404
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET, require_POST, require_safe
 from django.views.generic import CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy, reverse
-from .forms import PartnerSignUpForm, InstitutionSignUpForm, StudentForm
-from .models import User, Partner, Institution, Student
+from .forms import PartnerSignUpForm, InstitutionSignUpForm, StudentForm, StudentImportForm
+from .models import User, Partner, Institution, Student, ExportJob
+from .api import InvalidFields, api_owner, owner_etag, owner_last_modified, parse_fields, student_page
+from .cards import CardsPending, card_class_filter, card_queryset, render_cards, write_sheets
+from .export_cache import SEGMENTED_FORMATS, cached_export
+from .exports import EXPORT_FORMATS, export_owner_key, export_queryset, stream_archive
+from .export_jobs import enqueue_export, export_job_path
+from .http import api_post, authorization_token, ranged_file_response
+from .fragments import owner_version
+from .media import media_response, photo_filter, visible_students
+from .enrollment import EnrollmentConflict, IdempotencyKeyReused, InvalidEnrollment, enroll_students, parse_records
+from .imports import InvalidImport, import_students
+from .institutions import lookup_institutions
+from .metrics import registry
+from .routers import uses_read_only_database
+from .sync import InvalidSyncToken, sync_page
+from .search import search_students, search_terms
+from .pagination import InvalidCursor, KeysetPaginator, cached_count
 
 class PartnerSignUpView(CreateView):
     model = User
@@ -59,6 +75,10 @@ class StudentUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         student = self.get_object()
         return self.request.user.role == 'INSTITUTION' and student.institution == self.request.user.institution
 
+    def get_form_kwargs(self):
+        # The student stays with the institution editing it
+        return {**super().get_form_kwargs(), 'institution': self.request.user.institution}
+
 class StudentDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     model = Student
     template_name = 'student_confirm_delete.html'
@@ -70,24 +90,25 @@ class StudentDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
 
 def referral_student_add(request, referral_code):
     partner = get_object_or_404(Partner, referral_code=referral_code)
+    # ?institution=<id> binds the link to one institution, so the form has nothing to look up
+    institution = None
+    institution_id = request.GET.get('institution')
+    if institution_id:
+        if not institution_id.isdigit():
+            raise Http404
+        institution = get_object_or_404(Institution.objects.select_related('user'), pk=institution_id)
+
     if request.method == 'POST':
-        form = StudentForm(request.POST, request.FILES)
+        form = StudentForm(request.POST, request.FILES, institution=institution)
         if form.is_valid():
             student = form.save(commit=False)
             student.partner = partner
 
-            photo_data = request.POST.get('photo_data')
-            if photo_data:
-                format, imgstr = photo_data.split(';base64,')
-                ext = format.split('/')[-1]
-                data = ContentFile(base64.b64decode(imgstr), name=f'{uuid.uuid4()}.{ext}')
-                student.photo = data
-
             student.save()
             return redirect('login') # Or a success page
     else:
-        form = StudentForm()
-    return render(request, 'student_form.html', {'form': form, 'partner': partner})
+        form = StudentForm(institution=institution)
+    return render(request, 'student_form.html', {'form': form, 'partner': partner, 'institution': institution})
 
 @login_required
 def student_add_by_institution(request):
@@ -95,47 +116,135 @@ def student_add_by_institution(request):
         return redirect('login')
 
     if request.method == 'POST':
-        form = StudentForm(request.POST, request.FILES)
+        form = StudentForm(request.POST, request.FILES, institution=request.user.institution)
         if form.is_valid():
-            student = form.save(commit=False)
-            student.institution = request.user.institution
-
-            photo_data = request.POST.get('photo_data')
-            if photo_data:
-                format, imgstr = photo_data.split(';base64,')
-                ext = format.split('/')[-1]
-                data = ContentFile(base64.b64decode(imgstr), name=f'{uuid.uuid4()}.{ext}')
-                student.photo = data
-
-            student.save()
+            form.save()
             return redirect('institution_dashboard')
     else:
-        form = StudentForm()
+        form = StudentForm(institution=request.user.institution)
     return render(request, 'student_form.html', {'form': form})
 
 
 @login_required
+def student_import(request):
+    if request.user.role != 'INSTITUTION':
+        return redirect('login')
+
+    result = None
+    if request.method == 'POST':
+        form = StudentImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                result = import_students(
+                    request.user.institution,
+                    form.cleaned_data['sheet'],
+                    form.cleaned_data['sheet'].name,
+                    photos=form.cleaned_data['photos'],
+                )
+            except InvalidImport as exc:
+                form.add_error(exc.field, str(exc))
+    else:
+        form = StudentImportForm()
+    status = 400 if form.errors or (result and not result.committed) else 200
+    return render(request, 'student_import.html', {'form': form, 'result': result}, status=status)
+
+
+@login_required
+def student_card(request, pk):
+    if request.user.role != 'INSTITUTION':
+        return redirect('login')
+
+    students = card_queryset(Student.objects.filter(pk=pk, institution=request.user.institution))
+    if not students:
+        raise Http404
+    paths, _ = render_cards(students)
+    return FileResponse(open(paths[0], 'rb'), content_type='image/png')
+
+@login_required
+def id_cards(request):
+    if request.user.role != 'INSTITUTION':
+        return redirect('login')
+
+    students = Student.objects.filter(institution=request.user.institution)
+    class_name = request.GET.get('class_name')
+    if class_name:
+        students = students.filter(card_class_filter(class_name))
+    # Rendered here, a bounded number per request; render_id_cards renders large batches over a process pool
+    try:
+        paths, _ = render_cards(card_queryset(students), limit=settings.CARD_RENDER_REQUEST_LIMIT)
+    except CardsPending as exc:
+        response = HttpResponse(
+            f"Rendered {exc.rendered} cards; {exc.remaining} are still to be rendered. Reload to continue.",
+            status=503, content_type='text/plain',
+        )
+        response['Retry-After'] = '1'
+        return response
+
+    # Anonymous temporary file: removed as soon as the response closes it
+    sheet_file = tempfile.TemporaryFile()
+    write_sheets(paths, sheet_file)
+    sheet_file.seek(0)
+    filename = f"id_cards_{class_name}.pdf" if class_name else "id_cards.pdf"
+    return FileResponse(sheet_file, content_type='application/pdf', as_attachment=True, filename=filename)
+
+
+DASHBOARD_FIELDS = ('id', 'unique_id', 'student_name', 'father_name', 'class_name', 'other_class', 'village', 'mobile_number', 'photo')
+
+def search_key(search):
+    return hashlib.md5(' '.join(search_terms(search)).encode(), usedforsecurity=False).hexdigest()
+
+def dashboard_page(paginator, cursor):
+    """The keyset page for ``cursor``, falling back to the first page for a cursor that does not decode."""
+    try:
+        return paginator.page(cursor)
+    except InvalidCursor:
+        return paginator.page()
+
+def _dashboard_page(request, students, owner_key):
+    # Read before anything is queried: the table fragment is cached under this version
+    version = owner_version(owner_key)
+    search = request.GET.get('q', '').strip()
+    students = search_students(students, search, owner_scoped=True)
+    paginator = KeysetPaginator(students, ordering=('class_name', 'id'), per_page=settings.DASHBOARD_PAGE_SIZE)
+    # Queried only if the table fragment is rendered rather than served from the cache
+    page = SimpleLazyObject(lambda: dashboard_page(paginator, request.GET.get('cursor')))
+    # Keyed by the owner's data version, so an edit shows up at once instead of after the timeout
+    total = cached_count(f'students:{owner_key}:{version}:{search_key(search)}', students, settings.DASHBOARD_COUNT_CACHE_TIMEOUT)
+    return {
+        'students': page, 'page': page, 'total_students': total,
+        'owner_key': owner_key, 'data_version': version, 'search': search,
+    }
+
+@login_required
+@uses_read_only_database
 def institution_dashboard(request):
     if request.user.role != 'INSTITUTION':
         return redirect('login') # Or a custom access denied page
 
-    students = Student.objects.filter(institution=request.user.institution)
-    return render(request, 'institution_dashboard.html', {'students': students})
+    institution = request.user.institution
+    students = Student.objects.filter(institution=institution).only(*DASHBOARD_FIELDS)
+    context = _dashboard_page(request, students, f'institution-{institution.pk}')
+    return render(request, 'institution_dashboard.html', context)
 
 @login_required
+@uses_read_only_database
 def partner_dashboard(request):
     if request.user.role != 'PARTNER':
         return redirect('login')
 
-    students = Student.objects.filter(partner=request.user.partner)
+    partner = request.user.partner
+    # The table shows each student's institution, which is its user's username
+    students = (
+        Student.objects.filter(partner=partner)
+        .select_related('institution__user')
+        .only(*DASHBOARD_FIELDS, 'institution__user__username')
+    )
 
-    referral_path = reverse('referral_student_add', kwargs={'referral_code': request.user.partner.referral_code})
+    referral_path = reverse('referral_student_add', kwargs={'referral_code': partner.referral_code})
     referral_link = request.build_absolute_uri(referral_path)
 
-    context = {
-        'students': students,
-        'referral_link': referral_link,
-    }
+    context = _dashboard_page(request, students, f'partner-{partner.pk}')
+    context['referral_link'] = referral_link
     return render(request, 'partner_dashboard.html', context)
 
 @login_required
@@ -145,89 +254,229 @@ def admin_dashboard(request):
     return render(request, 'admin_dashboard.html')
 
 @login_required
+@uses_read_only_database
 def export_data(request):
     export_format = request.GET.get('format', 'csv') # default to csv
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'csv'
 
-    students = []
-    if request.user.role == 'ADMIN':
-        students = Student.objects.all()
-    elif request.user.role == 'PARTNER':
-        students = Student.objects.filter(partner=request.user.partner)
-    else:
+    students = export_queryset(request.user)
+    if students is None:
         return HttpResponse("Unauthorized", status=401)
-
-    # Group students by class
-    students_by_class = {}
-    for student in students:
-        class_name = student.class_name
-        if class_name == 'Other':
-            class_name = student.other_class if student.other_class else 'Other'
-
-        if class_name not in students_by_class:
-            students_by_class[class_name] = []
-        students_by_class[class_name].append(student)
-
-    # Create a zip file in memory
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, 'w') as zip_file:
-        for class_name, students_in_class in students_by_class.items():
-
-            if export_format == 'xlsx':
-                # Create XLSX file in memory
-                workbook = Workbook()
-                worksheet = workbook.active
-                worksheet.title = "Students"
-                header = ['Unique ID', 'Student Name', "Father's Name", 'Class', 'Village', 'Mobile Number']
-                worksheet.append(header)
-
-                for student in students_in_class:
-                    s_class = student.class_name
-                    if s_class == 'Other':
-                        s_class = student.other_class
-                    worksheet.append([student.unique_id, student.student_name, student.father_name, s_class, student.village, student.mobile_number])
-
-                    # Add photo to zip
-                    if student.photo:
-                        photo_path = student.photo.path
-                        _, extension = os.path.splitext(student.photo.name)
-                        photo_filename = f"{student.unique_id}{extension}"
-                        zip_file.write(photo_path, f'{class_name}/Photos/{photo_filename}')
-
-                # Save workbook to a buffer and add to zip
-                excel_buffer = io.BytesIO()
-                workbook.save(excel_buffer)
-                excel_buffer.seek(0)
-                zip_file.writestr(f'{class_name}/student_data.xlsx', excel_buffer.getvalue())
-
-            else: # Default to CSV
-                # Create CSV file in memory
-                csv_buffer = io.StringIO()
-                csv_writer = csv.writer(csv_buffer)
-                csv_writer.writerow(['Unique ID', 'Student Name', "Father's Name", 'Class', 'Village', 'Mobile Number'])
-
-                for student in students_in_class:
-                    s_class = student.class_name
-                    if s_class == 'Other':
-                        s_class = student.other_class
-                    csv_writer.writerow([student.unique_id, student.student_name, student.father_name, s_class, student.village, student.mobile_number])
-
-                    # Add photo to zip
-                    if student.photo:
-                        photo_path = student.photo.path
-                        _, extension = os.path.splitext(student.photo.name)
-                        photo_filename = f"{student.unique_id}{extension}"
-                        zip_file.write(photo_path, f'{class_name}/Photos/{photo_filename}')
-
-                # Add CSV to zip
-                zip_file.writestr(f'{class_name}/student_data.csv', csv_buffer.getvalue())
-
-
-    buffer.seek(0)
-    response = HttpResponse(buffer, content_type='application/zip')
+    # Pin the read-only connection now; a streamed export is read after the view returns
+    students = students.using(students.db)
+
+    if settings.EXPORT_CACHE_ENABLED and export_format in SEGMENTED_FORMATS:
+        path = cached_export(export_owner_key(request.user), export_format)
+        stat = os.stat(path)
+        # Rebuilds can land within the same second, so tag the archive by its nanosecond mtime
+        return ranged_file_response(
+            request, path, 'application/zip', filename='student_data.zip', etag=f'{stat.st_mtime_ns}-{stat.st_size}'
+        )
+
+    # Stream the zip as it is built so memory stays flat and the download starts right away
+    response = StreamingHttpResponse(stream_archive(students, export_format), content_type='application/zip')
     response['Content-Disposition'] = 'attachment; filename="student_data.zip"'
     return response
 
 
+@require_GET
+@uses_read_only_database
+@cache_control(max_age=60)
+def institution_lookup(request):
+    # Public like the referral form it serves; at most a few names per prefix
+    return JsonResponse({'results': lookup_institutions(request.GET.get('q', ''))})
+
+@login_required
+@require_safe
+@uses_read_only_database
+def media_file(request, name):
+    # Unknown and forbidden names both 404, so probing does not reveal which photos exist
+    if not visible_students(request.user).filter(photo_filter(name)).exists():
+        raise Http404
+    return media_response(request, name)
+
+
+def _export_job_payload(job):
+    payload = {
+        'id': job.pk,
+        'status': job.status,
+        'format': job.export_format,
+        'created_at': job.created_at.isoformat(),
+        'status_url': reverse('export_job_status', kwargs={'pk': job.pk}),
+    }
+    if job.status == 'DONE':
+        payload['download_url'] = reverse('export_job_download', kwargs={'pk': job.pk})
+        payload['size'] = job.file_size
+    elif job.status == 'FAILED':
+        payload['error'] = job.error
+    return payload
+
+def _get_export_job(request, pk):
+    # Jobs are shared by everyone exporting the same data, so scope by owner rather than requester
+    return get_object_or_404(ExportJob, pk=pk, owner_key=export_owner_key(request.user))
+
+@login_required
+@require_POST
+def export_job_create(request):
+    export_format = request.POST.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'error': 'Unsupported format'}, status=400)
+
+    job = enqueue_export(request.user, export_format)
+    if job is None:
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+    return JsonResponse(_export_job_payload(job), status=202)
+
+@login_required
+def export_job_status(request, pk):
+    job = _get_export_job(request, pk)
+    return JsonResponse(_export_job_payload(job))
+
+@login_required
+def export_job_download(request, pk):
+    job = _get_export_job(request, pk)
+    if job.status != 'DONE':
+        return JsonResponse(_export_job_payload(job), status=409)
+    return ranged_file_response(request, export_job_path(job), 'application/zip', filename='student_data.zip')
+
+
+def _api_owner(request, role):
+    # Resolved once per request; the ETag, Last-Modified and the view itself all need it
+    if not hasattr(request, '_api_owner'):
+        request._api_owner = api_owner(request.user, role)
+        request._api_version = owner_version(request._api_owner[0]) if request._api_owner else None
+    return request._api_owner
+
+
+def _api_condition(role):
+    def etag(request):
+        owner = _api_owner(request, role)
+        return owner_etag(owner[0], request._api_version) if owner else None
+
+    def last_modified(request):
+        owner = _api_owner(request, role)
+        return owner_last_modified(request._api_version) if owner else None
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def _api_students(request, role):
+    owner = _api_owner(request, role)
+    if owner is None:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    _, students = owner
+
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+    except InvalidFields as exc:
+        return JsonResponse({'error': 'Unknown fields', 'fields': exc.args[0]}, status=400)
+    try:
+        page = student_page(students, fields, request.GET.get('cursor'), per_page=settings.API_PAGE_SIZE)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    def page_url(cursor):
+        if cursor is None:
+            return None
+        query = request.GET.copy()
+        query['cursor'] = cursor
+        return request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+    response = JsonResponse({
+        'results': page.items,
+        'next': page_url(page.next_cursor),
+        'previous': page_url(page.previous_cursor),
+    })
+    # Always revalidate; the ETag makes that a cheap 304 while nothing has changed
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+@login_required
+@require_GET
+@uses_read_only_database
+@_api_condition('INSTITUTION')
+def api_institution_students(request):
+    return _api_students(request, 'INSTITUTION')
+
+@login_required
+@require_GET
+@uses_read_only_database
+@_api_condition('PARTNER')
+def api_partner_students(request):
+    return _api_students(request, 'PARTNER')
+
+def _api_sync(request, role):
+    owner = _api_owner(request, role)
+    if owner is None:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    owner_key, students = owner
+
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+    except InvalidFields as exc:
+        return JsonResponse({'error': 'Unknown fields', 'fields': exc.args[0]}, status=400)
+    try:
+        page = sync_page(
+            owner_key, students, fields, request.GET.get('token'),
+            limit=settings.SYNC_PAGE_SIZE, settle_seconds=settings.SYNC_SETTLE_SECONDS,
+        )
+    except InvalidSyncToken:
+        return JsonResponse({'error': 'Invalid sync token'}, status=400)
+
+    response = JsonResponse({'changed': page.changed, 'deleted': page.deleted, 'token': page.token, 'more': page.more})
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
+@login_required
+@require_GET
+@uses_read_only_database
+def api_institution_sync(request):
+    return _api_sync(request, 'INSTITUTION')
+
+@login_required
+@require_GET
+@uses_read_only_database
+def api_partner_sync(request):
+    return _api_sync(request, 'PARTNER')
+
+def _api_enroll(request, scope, institution=None, partner=None):
+    try:
+        records = parse_records(request.POST.get('records'))
+    except InvalidEnrollment as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    try:
+        result = enroll_students(records, request.FILES, scope, institution=institution, partner=partner)
+    except EnrollmentConflict:
+        return JsonResponse({'error': 'These records are already being enrolled; retry shortly.'}, status=409)
+    except IdempotencyKeyReused as exc:
+        return JsonResponse({'error': 'These keys were already used for different records.', 'keys': exc.keys}, status=422)
+    return JsonResponse(result.as_dict())
+
+def token_required():
+    response = JsonResponse({'error': 'Send the institution API token as "Authorization: Token <token>".'}, status=401)
+    response['WWW-Authenticate'] = 'Token'
+    return response
+
+def unknown_referral():
+    return JsonResponse({'error': 'Unknown referral link'}, status=404)
+
+@api_post
+def api_institution_enroll(request):
+    token = authorization_token(request)
+    institution = Institution.objects.filter(api_token=token, user__is_active=True).first() if token else None
+    if institution is None:
+        return token_required()
+    return _api_enroll(request, f'institution-{institution.pk}', institution=institution)
+
+@api_post
+def api_referral_enroll(request, referral_code):
+    partner = Partner.objects.filter(referral_code=referral_code).first()
+    if partner is None:
+        return unknown_referral()
+    return _api_enroll(request, f'partner-{partner.pk}', partner=partner)
+
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib import messages
 from .forms import PasswordResetForm
@@ -261,6 +510,11 @@ def admin_reset_password(request, pk):
 def admin_required(view_func):
     return user_passes_test(lambda u: u.is_superuser)(view_func)
 
+@login_required
+@admin_required
+def metrics(request):
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @login_required
 @admin_required
 def user_list(request):
@@ -11,6 +11,7 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "id_card_project.settings")
+# The ASGI settings route the I/O-heavy views to their native async versions (see core.async_views)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "id_card_project.settings_asgi")
 
 application = get_asgi_application()
@@ -0,0 +1,23 @@
+"""
+URL configuration for ASGI deployments.
+
+The I/O-heavy views are served by their native async versions in
+core.async_views; every other URL is the same as in id_card_project.urls.
+Both patterns keep their URL names, so reverse() is unchanged.
+"""
+
+from django.urls import path
+
+from core import async_views
+
+from .urls import urlpatterns as wsgi_urlpatterns
+
+urlpatterns = [
+    path('dashboard/institution/', async_views.institution_dashboard, name='institution_dashboard'),
+    path('dashboard/partner/', async_views.partner_dashboard, name='partner_dashboard'),
+    path('export/', async_views.export_data, name='export_data'),
+    path('student/add/', async_views.student_add_by_institution, name='student_add'),
+    path('referral/<uuid:referral_code>/', async_views.referral_student_add, name='referral_student_add'),
+    path('api/institution/enroll/', async_views.api_institution_enroll, name='api_institution_enroll'),
+    path('api/referral/<uuid:referral_code>/enroll/', async_views.api_referral_enroll, name='api_referral_enroll'),
+] + wsgi_urlpatterns
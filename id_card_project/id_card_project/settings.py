@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.metrics.PerformanceMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -50,6 +51,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# ASGI deployments use settings_asgi, which routes the I/O-heavy views to core.async_views
 ROOT_URLCONF = "id_card_project.urls"
 
 TEMPLATES = [
@@ -73,13 +75,41 @@ WSGI_APPLICATION = "id_card_project.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# WAL lets readers and the single writer proceed concurrently. It is a property of the database
+# file, so migration core.0016_sqlite_wal switches the file to it once, when it is migrated;
+# opening a connection never changes the file. busy_timeout makes writers queue for the lock
+# instead of failing with "database is locked"
+SQLITE_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL;"
+    "PRAGMA busy_timeout=5000;"
+    "PRAGMA mmap_size=268435456;"
+    "PRAGMA cache_size=-65536;"
+    "PRAGMA temp_store=MEMORY;"
+)
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+        "CONN_MAX_AGE": None,
+        "OPTIONS": {
+            "init_command": SQLITE_PRAGMAS,
+            # Take the write lock up front, so transactions never fail upgrading a read lock
+            "transaction_mode": "IMMEDIATE",
+        },
+    },
+    # Long dashboard and export reads run on their own connection (see core.routers)
+    "readonly": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+        "CONN_MAX_AGE": None,
+        "OPTIONS": {"init_command": SQLITE_PRAGMAS + "PRAGMA query_only=ON;"},
+        "TEST": {"MIRROR": "default"},
+    },
 }
 
+DATABASE_ROUTERS = ["core.routers.ReadOnlyRouter"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -120,6 +150,85 @@ STATIC_URL = "static/"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Media is only served through core.views.media_file, which checks who may see each photo. Set the
+# backend to "x-accel-redirect" (nginx) or "x-sendfile" (Apache, lighttpd) to let the front-end
+# server send the file; with None, Django streams it. The nginx location must be internal, e.g.
+#   location /protected-media/ { internal; alias /path/to/media/; }
+MEDIA_SENDFILE_BACKEND = None
+MEDIA_ACCEL_REDIRECT_PREFIX = "/protected-media/"
+# Content-hashed photos and versioned derivatives are cached privately for this long
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Finished background exports; kept outside MEDIA_ROOT so they are only reachable through the job views
+EXPORT_JOB_ROOT = BASE_DIR / "export_jobs"
+# A running job whose worker has not renewed it for this long is failed, so it can be requested again
+EXPORT_JOB_LEASE_SECONDS = 300
+# Finished jobs and their archives are removed by run_export_worker after this long
+EXPORT_JOB_RETENTION_SECONDS = 24 * 60 * 60
+
+# Per-class export segments, rebuilt only for classes that changed since the last export. Off by
+# default: a cold or stale cache is rebuilt before the first byte is sent, whereas the uncached
+# export streams at once. Enable it where exports are repeated far more often than data changes.
+EXPORT_CACHE_ENABLED = False
+EXPORT_CACHE_ROOT = BASE_DIR / "export_cache"
+
+# Threads reading student photos ahead of the export ZIP writer, and how many rows they may run ahead
+EXPORT_PHOTO_READERS = 8
+EXPORT_PHOTO_PREFETCH = 32
+# Larger photos are streamed into the archive instead of being read ahead whole
+EXPORT_PHOTO_INLINE_SIZE = 256 * 1024
+
+# Rendered ID cards are cached by a hash of the printed fields and photo
+CARD_CACHE_ROOT = BASE_DIR / "card_cache"
+# Process pool size for render_id_cards (None: one per CPU)
+CARD_RENDER_WORKERS = None
+# Cards one request to the cards view may render; the rest are rendered on reload
+CARD_RENDER_REQUEST_LIMIT = 50
+
+# Uploaded student photos are verified and re-encoded to JPEG by core.photos
+PHOTO_MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+PHOTO_MAX_PIXELS = 4096 * 4096
+PHOTO_JPEG_QUALITY = 90
+PHOTO_ENCODE_WORKERS = 2
+
+# Dashboard tables are keyset-paginated; the total is cached so paging does not COUNT(*) every time
+DASHBOARD_PAGE_SIZE = 50
+DASHBOARD_COUNT_CACHE_TIMEOUT = 300
+DASHBOARD_FRAGMENT_CACHE_TIMEOUT = 600
+
+# The JSON student API pages with the same cursors; ETags come from the per-owner data version
+API_PAGE_SIZE = 100
+
+# Delta syncs return at most this many changes and removals per call; rows saved within the
+# settle window wait for the next call, so a token never skips a save still being committed
+SYNC_PAGE_SIZE = 500
+SYNC_SETTLE_SECONDS = 5
+
+# Institution autocomplete results; the cache is also invalidated whenever an institution changes
+INSTITUTION_LOOKUP_CACHE_TIMEOUT = 600
+
+# Batch enrollment takes up to this many records, each with its own photo part, per request
+ENROLLMENT_MAX_RECORDS = 100
+
+# Blocking file, zip and multipart work of the async views runs on this many threads
+ASYNC_BLOCKING_WORKERS = 8
+
+# Dashboard fragments, counts and lookups are cached here under per-owner versions that live in the
+# database (core.DataVersion), so every process sees each bump. Local memory is still per process:
+# with several workers each warms its own copy, so point them at one shared backend (Redis,
+# Memcached, or django.core.cache.backends.filebased.FileBasedCache) for a better hit ratio.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+# Requests slower than this are logged by core.metrics with their most frequent queries
+METRICS_SLOW_REQUEST_MS = 1000
+
+# Student unique IDs each worker reserves from the counter table at a time
+STUDENT_ID_BLOCK_SIZE = 20
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
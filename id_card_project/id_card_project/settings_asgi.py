@@ -0,0 +1,13 @@
+"""
+Settings for ASGI deployments of id_card_project.
+
+The same as id_card_project.settings, except that the I/O-heavy views are
+served by their native async versions in core.async_views (see
+id_card_project.asgi_urls). asgi.py uses this module unless
+DJANGO_SETTINGS_MODULE names another; WSGI, management commands and tests
+use id_card_project.settings and the sync views.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+ROOT_URLCONF = "id_card_project.asgi_urls"